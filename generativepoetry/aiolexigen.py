@@ -0,0 +1,95 @@
+"""Asyncio versions of lexigen's functions that accept lists of words.
+
+Datamuse is queried through requests, which has no asyncio client, so these are a thread-backed wrapper rather than an
+asyncio-native client: lookups run on lexigen's pool of lookup threads, which share its keep-alive connections, and
+the filtering and sampling of their results run on the event loop's default executor. The loop itself only waits.
+"""
+import asyncio
+import contextvars
+import functools
+from typing import Callable, Iterable, List, Optional
+from . import lexigen
+from .lexigen import lookup, str_or_list_of_str
+from .utils import validate_str_or_list_of_str, validate_word
+
+
+async def datamuse_lookups(lookups: Iterable[lookup], concurrency: Optional[int] = None) -> List[List[dict]]:
+    """Perform several Datamuse lookups concurrently and return their responses in order.
+
+    :param lookups: (relation, word, max) tuples, as passed to lexigen.datamuse_lookup
+    :param concurrency: the maximum number of lookups in flight at once (default: lexigen.lookup_concurrency)
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency or lexigen.lookup_concurrency)
+
+    async def bounded_lookup(key: lookup) -> List[dict]:
+        async with semaphore:
+            # In a copy of the task's context, so the lookup is made under the caller's latency budget, if any
+            return await loop.run_in_executor(lexigen.lookup_executor(), contextvars.copy_context().run,
+                                              lexigen.datamuse_lookup, *key)
+
+    return await asyncio.gather(*(bounded_lookup(key) for key in lookups))
+
+
+async def _off_loop(function: Callable, *args, **kwargs):
+    # Filtering, spellchecking and sampling are CPU-bound, and a lookup the cache can't answer blocks, so they run on a
+    # thread (in a copy of the task's context, like the lookups) instead of on the loop
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(contextvars.copy_context().run, function, *args, **kwargs))
+
+
+async def similar_sounding_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 6,
+                                 datamuse_api_max: Optional[int] = 50, weighted: bool = False) -> list:
+    """Asyncio version of lexigen.similar_sounding_words."""
+    input_words = validate_str_or_list_of_str(input_val)
+    await datamuse_lookups(('sl', input_word, datamuse_api_max) for input_word in input_words)
+    return await _off_loop(lexigen.similar_sounding_words, input_words, sample_size=sample_size,
+                           datamuse_api_max=datamuse_api_max, weighted=weighted)
+
+
+async def similar_meaning_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 6,
+                                datamuse_api_max: Optional[int] = 20, weighted: bool = False) -> list:
+    """Asyncio version of lexigen.similar_meaning_words."""
+    input_words = validate_str_or_list_of_str(input_val)
+    await datamuse_lookups(('ml', input_word, datamuse_api_max) for input_word in input_words)
+    return await _off_loop(lexigen.similar_meaning_words, input_words, sample_size=sample_size,
+                           datamuse_api_max=datamuse_api_max, weighted=weighted)
+
+
+async def contextually_linked_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 6,
+                                    datamuse_api_max: Optional[int] = 20, weighted: bool = False) -> list:
+    """Asyncio version of lexigen.contextually_linked_words."""
+    input_words = validate_str_or_list_of_str(input_val)
+    for input_word in input_words:
+        validate_word(input_word)
+    await datamuse_lookups(('rel_trg', input_word, datamuse_api_max) for input_word in input_words)
+    return await _off_loop(lexigen.contextually_linked_words, input_words, sample_size=sample_size,
+                           datamuse_api_max=datamuse_api_max, weighted=weighted)
+
+
+async def frequently_following_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 8,
+                                     datamuse_api_max: Optional[int] = None) -> list:
+    """Asyncio version of lexigen.frequently_following_words."""
+    input_words = validate_str_or_list_of_str(input_val)
+    await datamuse_lookups(('lc', input_word, datamuse_api_max) for input_word in input_words)
+    return await _off_loop(lexigen.frequently_following_words, input_words, sample_size=sample_size,
+                           datamuse_api_max=datamuse_api_max)
+
+
+async def phonetically_related_words(input_val: str_or_list_of_str, sample_size=None, datamuse_api_max=50,
+                                     max_results_per_input_word: Optional[int] = None) -> list:
+    """Asyncio version of lexigen.phonetically_related_words."""
+    input_words = validate_str_or_list_of_str(input_val)
+    await datamuse_lookups(('sl', input_word, datamuse_api_max) for input_word in input_words)
+    return await _off_loop(lexigen.phonetically_related_words, input_words, sample_size=sample_size,
+                           datamuse_api_max=datamuse_api_max, max_results_per_input_word=max_results_per_input_word)
+
+
+async def related_rare_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 8,
+                             rare_word_population_max: int = 20) -> list:
+    """Asyncio version of lexigen.related_rare_words. All three relation families of every word are looked up at
+    once, so the latency of any number of input words is roughly that of a single round trip."""
+    input_words = validate_str_or_list_of_str(input_val)
+    await datamuse_lookups(lexigen.related_rare_lookups(input_words))
+    return await _off_loop(lexigen.related_rare_words, input_words, sample_size=sample_size,
+                           rare_word_population_max=rare_word_population_max)
@@ -0,0 +1,179 @@
+import gzip
+import json
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+token_pattern = re.compile(r"[a-z]+(?:'[a-z]+)?")
+# Bigrams don't cross the end of a sentence or clause
+boundary_pattern = re.compile(r'[.!?;:()\[\]"\n]+')
+
+
+class BigramIndex:
+    """Counts of which words follow which in a body of text, for answering left context lookups (Datamuse's lc, i.e.
+    frequently following words) locally.
+
+    Text is counted into integer-encoded pairs of word ids, and the counts are then compacted into three flat arrays:
+    for each word, its followers' ids and counts sit in one run of the followers and counts arrays, sorted from most to
+    least frequent, and the offsets array says where each word's run starts. A lookup is a slice of two arrays.
+
+    Only bigrams that occurred at least min_count times are returned, but all counts are kept, so adding texts later
+    (they're merged in on the next lookup) gives the same index as counting them all at once.
+    """
+
+    def __init__(self, min_count: int = 1):
+        """
+        :param min_count: how many times a bigram has to occur to be returned
+        """
+        self.min_count = min_count
+        self.words: List[str] = []  # Word ids index into this list
+        self.word_ids: Dict[str, int] = {}
+        self.offsets = array('l', [0])  # Word id -> start of its run; the next word's offset is the end
+        self.followers = array('i')
+        self.counts = array('i')
+        self.ranked = array('i')  # Word id -> how many of its followers are returned (they come first in its run)
+        self.texts = 0
+        self._pending: Counter = Counter()  # left id << 32 | right id -> count, for text not compacted yet
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """The number of distinct bigrams."""
+        self.compact()
+        return len(self.followers)
+
+    def __contains__(self, word: str) -> bool:
+        """Check whether any word is known to follow a word often enough to be returned."""
+        self.compact()
+        word_id = self.word_ids.get(word)
+        return word_id is not None and word_id < len(self.ranked) and self.ranked[word_id] > 0
+
+    def intern(self, word: str) -> int:
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def add_text(self, text: str):
+        """Count the bigrams in a text, such as a document from decomposer.get_gutenberg_document. Words are
+        lowercased.
+
+        :param text: the text to count
+        """
+        pairs: Counter = Counter()
+        with self._lock:
+            for clause in boundary_pattern.split(text.lower().replace('\u2019', "'")):
+                word_ids = [self.intern(token) for token in token_pattern.findall(clause)]
+                pairs.update(left << 32 | right for left, right in zip(word_ids, word_ids[1:]))
+            self._pending.update(pairs)
+            self.texts += 1
+
+    def compact(self):
+        """Merge the counts of the texts added since the last compaction into the arrays. Lookups do this as needed."""
+        if not self._pending:
+            return
+        with self._lock:
+            pairs, self._pending = self._pending, Counter()
+            for left in range(len(self.offsets) - 1):
+                for i in range(self.offsets[left], self.offsets[left + 1]):
+                    pairs[left << 32 | self.followers[i]] += self.counts[i]
+            rows: Dict[int, List[Tuple[int, int]]] = {}
+            for code, count in pairs.items():
+                rows.setdefault(code >> 32, []).append((-count, code & 0xFFFFFFFF))
+            offsets, followers, counts = array('l', [0]), array('i'), array('i')
+            for left in range(len(self.words)):
+                for negative_count, right in sorted(rows.get(left, ())):
+                    followers.append(right)
+                    counts.append(-negative_count)
+                offsets.append(len(followers))
+            self.offsets, self.followers, self.counts = offsets, followers, counts
+            self.ranked = self._ranked()
+
+    def _ranked(self) -> array:
+        # How many of each word's followers occurred at least min_count times; runs are sorted by count
+        ranked = array('i')
+        for left in range(len(self.offsets) - 1):
+            start, end = self.offsets[left], self.offsets[left + 1]
+            ranked.append(sum(1 for i in range(start, end) if self.counts[i] >= self.min_count))
+        return ranked
+
+    def scored_following(self, word: str, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Return the words that follow a word, most frequent first, with how many times each did.
+
+        :param word: the word to look up
+        :param limit: the most words to return
+        """
+        self.compact()
+        word_id = self.word_ids.get(word)
+        if word_id is None or word_id >= len(self.ranked):
+            return []
+        start = self.offsets[word_id]
+        end = start + self.ranked[word_id]
+        if limit is not None:
+            end = min(end, start + limit)
+        words = self.words
+        return [(words[follower], count) for follower, count in zip(self.followers[start:end], self.counts[start:end])]
+
+    def following(self, word: str, limit: Optional[int] = None) -> List[str]:
+        """Return the words that follow a word, most frequent first.
+
+        :param word: the word to look up
+        :param limit: the most words to return
+        """
+        return [follower for follower, count in self.scored_following(word, limit)]
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], min_count: int = 1) -> 'BigramIndex':
+        """Build an index from several texts.
+
+        :param texts: the texts to count
+        :param min_count: how many times a bigram has to occur to be returned
+        """
+        index = cls(min_count=min_count)
+        for text in texts:
+            index.add_text(text)
+        index.compact()
+        return index
+
+    @property
+    def stats(self) -> dict:
+        self.compact()
+        return {'texts': self.texts, 'words': len(self.words), 'bigrams': len(self.followers),
+                'ranked_bigrams': sum(self.ranked), 'occurrences': sum(self.counts)}
+
+    def save(self, path: str):
+        """Write the index to a gzipped JSON file.
+
+        :param path: location of the file
+        """
+        self.compact()
+        with self._lock:
+            data = {'min_count': self.min_count, 'texts': self.texts, 'words': self.words,
+                    'offsets': self.offsets.tolist(), 'followers': self.followers.tolist(),
+                    'counts': self.counts.tolist()}
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BigramIndex':
+        """Read an index written by save.
+
+        :param path: location of the file
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(min_count=data['min_count'])
+        index.texts = data['texts']
+        index.words = data['words']
+        index.word_ids = {word: word_id for word_id, word in enumerate(index.words)}
+        index.offsets = array('l', data['offsets'])
+        index.followers = array('i', data['followers'])
+        index.counts = array('i', data['counts'])
+        index.ranked = index._ranked()
+        return index
@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+cache_key = Tuple[str, str, Optional[int]]  # (relation code, word, max)
+
+
+def default_cache_path() -> Optional[str]:
+    """Return the path of the persistent lexical cache database.
+
+    The GENERATIVEPOETRY_CACHE environment variable overrides the default location; setting it to an empty string
+    disables the persistent tier altogether.
+    """
+    path = os.environ.get('GENERATIVEPOETRY_CACHE')
+    if path is not None:
+        return path or None
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'generativepoetry', 'lexicon.sqlite3')
+
+
+class LexicalCache:
+    """A two-tier cache for lexical lookups: an in-process LRU dictionary in front of a persistent SQLite store.
+
+    Entries are keyed on (relation code, word, max) and hold the parsed API response. Empty responses are cached too,
+    as negative entries with their own (shorter) time to live, so weird words don't cost a round trip every time.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_memory_entries: int = 10000,
+                 max_disk_entries: int = 250000, ttl: float = 30 * 86400, negative_ttl: float = 86400):
+        """
+        :param path: location of the SQLite database. If None, only the in-memory tier is used.
+        :param max_memory_entries: the number of entries kept in memory before the least recently used are evicted
+        :param max_disk_entries: the number of entries kept on disk before the oldest are evicted
+        :param ttl: how long, in seconds, a nonempty response stays fresh
+        :param negative_ttl: how long, in seconds, an empty response stays fresh
+        """
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory: OrderedDict = OrderedDict()
+        self.hits, self.misses, self.memory_hits, self.disk_hits, self.negative_hits, self.stale_hits = 0, 0, 0, 0, 0, 0
+        self._lock = threading.RLock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._disk_entries: Optional[int] = None
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._connection is None and self.path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._connection = sqlite3.connect(self.path, check_same_thread=False)
+                self._connection.execute('CREATE TABLE IF NOT EXISTS lookups (relation TEXT, word TEXT, max INTEGER, '
+                                         'response TEXT, expires REAL, PRIMARY KEY (relation, word, max))')
+                self._connection.execute('CREATE INDEX IF NOT EXISTS lookups_expires ON lookups (expires)')
+                self._disk_entries = self._connection.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+            except (OSError, sqlite3.Error):
+                # An unwritable cache directory shouldn't stop anyone from writing poems, so just stay in memory.
+                self.path, self._connection = None, None
+        return self._connection
+
+    def get(self, key: cache_key) -> Optional[List[dict]]:
+        """Return the cached response for a key, or None if it's missing or stale. Negative entries return []."""
+        return self.lookup(key)[0]
+
+    def get_stale(self, key: cache_key) -> Optional[List[dict]]:
+        """Return the cached response for a key even if it has expired, or None if there isn't one. For when a stale
+        response is better than none, e.g. when the API is down."""
+        return self.lookup(key, stale=True)[0]
+
+    def lookup(self, key: cache_key, stale: bool = False) -> Tuple[Optional[List[dict]], Optional[str]]:
+        """Return the cached response for a key and the tier it was found in ('memory' or 'disk'), or (None, None).
+
+        :param key: a (relation code, word, max) tuple
+        :param stale: return the response even if it has expired
+        """
+        with self._lock:
+            now = 0 if stale else time.time()
+            entry = self.memory.get(key)
+            if entry is not None and entry[1] > now:
+                if stale:
+                    self.stale_hits += 1
+                    return entry[0], 'memory'
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._hit(entry[0]), 'memory'
+            connection = self._connect()
+            if connection is not None:
+                relation, word, max_results = key
+                row = connection.execute('SELECT response, expires FROM lookups WHERE relation = ? AND word = ? AND '
+                                         'max = ?', (relation, word, max_results or 0)).fetchone()
+                if row is not None and row[1] > now:
+                    response = json.loads(row[0])
+                    if stale:
+                        self.stale_hits += 1
+                        return response, 'disk'
+                    self._remember(key, response, row[1])
+                    self.disk_hits += 1
+                    return self._hit(response), 'disk'
+            if not stale:
+                self.misses += 1
+            return None, None
+
+    def peek(self, key: cache_key) -> Optional[List[dict]]:
+        """Return a fresh entry from the in-memory tier without touching the counters or the disk, or None."""
+        entry = self.memory.get(key)
+        return entry[0] if entry is not None and entry[1] > time.time() else None
+
+    def _hit(self, response: List[dict]) -> List[dict]:
+        self.hits += 1
+        if not response:
+            self.negative_hits += 1
+        return response
+
+    def _remember(self, key: cache_key, response: List[dict], expires: float):
+        self.memory[key] = (response, expires)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def set(self, key: cache_key, response: List[dict]):
+        """Store a response in both tiers.
+
+        :param key: a (relation code, word, max) tuple
+        :param response: the parsed API response; an empty list is stored as a negative entry
+        """
+        with self._lock:
+            expires = time.time() + (self.ttl if response else self.negative_ttl)
+            self._remember(key, response, expires)
+            connection = self._connect()
+            if connection is None:
+                return
+            relation, word, max_results = key
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?)',
+                                   (relation, word, max_results or 0, json.dumps(response, separators=(',', ':')),
+                                    expires))
+                self._disk_entries += 1  # An overestimate when replacing, which only means evicting a bit early
+                if self._disk_entries > self.max_disk_entries:
+                    # Evict expired entries first and then whichever entries will expire soonest
+                    connection.execute('DELETE FROM lookups WHERE rowid IN (SELECT rowid FROM lookups ORDER BY '
+                                       'expires LIMIT ?)', (self._disk_entries - int(self.max_disk_entries * .9),))
+                    self._disk_entries = connection.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+
+    def clear(self):
+        """Empty both tiers and reset the hit and miss counters."""
+        with self._lock:
+            self.memory.clear()
+            connection = self._connect()
+            if connection is not None:
+                with connection:
+                    connection.execute('DELETE FROM lookups')
+                self._disk_entries = 0
+            self.hits, self.misses = 0, 0
+            self.memory_hits, self.disk_hits, self.negative_hits, self.stale_hits = 0, 0, 0, 0
+
+    @property
+    def stats(self) -> dict:
+        """Hit and miss counters, for judging how warm a worker is."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits, 'negative_hits': self.negative_hits, 'stale_hits': self.stale_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls: callers asking for a key that is already being fetched wait for that call and
+    share its result instead of making their own."""
+
+    def __init__(self):
+        self.calls, self.coalesced = 0, 0
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, function: Callable, *args):
+        """Call function(*args), unless a call for the same key is in flight, in which case wait for its result.
+
+        :param key: identifies calls that are interchangeable
+        :param function: the function to call
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    @property
+    def stats(self) -> dict:
+        """How many calls were made and how many callers shared another caller's call instead."""
+        return {'calls': self.calls, 'coalesced': self.coalesced}
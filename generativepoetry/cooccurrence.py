@@ -0,0 +1,203 @@
+import gzip
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from .bigrams import token_pattern
+
+# Words only count as co-occurring within a sentence (or a paragraph, for text without punctuation)
+sentence_pattern = re.compile(r'[.!?]+|\n\s*\n')
+
+
+class CooccurrenceIndex:
+    """Counts of which words occur near which in a body of text, ranked by pointwise mutual information, for answering
+    trigger lookups (Datamuse's rel_trg, i.e. contextually linked words) locally.
+
+    Two words co-occur when they're at most window words apart in a sentence. The counts are kept in compressed sparse
+    row form: for each word, its partners' ids, the number of times each co-occurred with it, and their PMI sit in one
+    run of the partners, counts and scores arrays, and the offsets array says where each word's run starts. Each run is
+    sorted by PMI, so a lookup is a slice of two arrays.
+
+    PMI is computed with the partner's count raised to the smoothing power, which keeps rare words from topping every
+    list (see Levy, Goldberg and Dagan, Improving Distributional Similarity with Lessons Learned from Word Embeddings),
+    and only pairs that co-occurred at least min_count times and have a positive PMI are returned. All counts are kept,
+    so adding texts later (they're merged in on the next lookup) gives the same index as counting them all at once.
+    """
+
+    def __init__(self, window: int = 5, min_count: int = 3, smoothing: float = .75):
+        """
+        :param window: how many words apart two words can be and still co-occur
+        :param min_count: how many times two words have to co-occur to be returned
+        :param smoothing: the power partners' counts are raised to in the PMI; 1 for plain PMI
+        """
+        self.window = window
+        self.min_count = min_count
+        self.smoothing = smoothing
+        self.words: List[str] = []  # Word ids index into this list
+        self.word_ids: Dict[str, int] = {}
+        self.offsets = array('l', [0])  # Word id -> start of its run; the next word's offset is the end
+        self.partners = array('i')
+        self.counts = array('i')
+        self.scores = array('f')  # The PMI of each pair, or -inf for those that aren't returned
+        self.ranked = array('i')  # Word id -> how many of its partners are returned (they come first in its run)
+        self.texts = 0
+        self._pending: Counter = Counter()  # word id << 32 | partner id -> count, for text not compacted yet
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """The number of distinct pairs of words that co-occurred (each pair is counted in both orders)."""
+        self.compact()
+        return len(self.partners)
+
+    def __contains__(self, word: str) -> bool:
+        """Check whether a word has any triggers."""
+        self.compact()
+        word_id = self.word_ids.get(word)
+        return word_id is not None and word_id < len(self.ranked) and self.ranked[word_id] > 0
+
+    def intern(self, word: str) -> int:
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def add_text(self, text: str):
+        """Count the co-occurrences in a text, such as a document from decomposer.get_gutenberg_document. Words are
+        lowercased.
+
+        :param text: the text to count
+        """
+        pairs: Counter = Counter()
+        window = self.window
+        with self._lock:
+            for sentence in sentence_pattern.split(text.lower().replace('\u2019', "'")):
+                word_ids = [self.intern(token) for token in token_pattern.findall(sentence)]
+                for i, word_id in enumerate(word_ids):
+                    for partner_id in word_ids[i + 1:i + 1 + window]:
+                        if partner_id != word_id:
+                            pairs[word_id << 32 | partner_id] += 1
+                            pairs[partner_id << 32 | word_id] += 1
+            self._pending.update(pairs)
+            self.texts += 1
+
+    def compact(self):
+        """Merge the counts of the texts added since the last compaction into the arrays, and rank every word's
+        partners again, since each text changes the totals PMI is computed from. Lookups do this as needed."""
+        if not self._pending:
+            return
+        with self._lock:
+            pairs, self._pending = self._pending, Counter()
+            for word_id in range(len(self.offsets) - 1):
+                for i in range(self.offsets[word_id], self.offsets[word_id + 1]):
+                    pairs[word_id << 32 | self.partners[i]] += self.counts[i]
+            rows: Dict[int, List[Tuple[int, int]]] = {}
+            totals = [0] * len(self.words)  # How many co-occurrences each word is part of
+            for code, count in pairs.items():
+                rows.setdefault(code >> 32, []).append((code & 0xFFFFFFFF, count))
+                totals[code >> 32] += count
+            smoothed = [total ** self.smoothing for total in totals]
+            smoothed_sum = sum(smoothed)
+            offsets, partners, counts, scores, ranked = array('l', [0]), array('i'), array('i'), array('f'), array('i')
+            for word_id in range(len(self.words)):
+                row = []
+                for partner_id, count in rows.get(word_id, ()):
+                    score = math.log(count * smoothed_sum / (totals[word_id] * smoothed[partner_id])) \
+                        if count >= self.min_count else 0.0
+                    row.append((-score if score > 0 else math.inf, -count, partner_id, count))
+                row.sort()  # Returned pairs first, by PMI and then count
+                for negative_score, _, partner_id, count in row:
+                    partners.append(partner_id)
+                    counts.append(count)
+                    scores.append(-negative_score)
+                offsets.append(len(partners))
+                ranked.append(sum(1 for entry in row if entry[0] < math.inf))
+            self.offsets, self.partners, self.counts = offsets, partners, counts
+            self.scores, self.ranked = scores, ranked
+
+    def scored_triggers(self, word: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return the words most strongly associated with a word, with their PMI, highest first.
+
+        :param word: the word to look up
+        :param limit: the most words to return
+        """
+        self.compact()
+        word_id = self.word_ids.get(word)
+        if word_id is None or word_id >= len(self.ranked):
+            return []
+        start = self.offsets[word_id]
+        end = start + self.ranked[word_id]
+        if limit is not None:
+            end = min(end, start + limit)
+        words = self.words
+        return [(words[partner], round(score, 4))
+                for partner, score in zip(self.partners[start:end], self.scores[start:end])]
+
+    def triggers(self, word: str, limit: Optional[int] = None) -> List[str]:
+        """Return the words most strongly associated with a word, highest PMI first.
+
+        :param word: the word to look up
+        :param limit: the most words to return
+        """
+        return [trigger for trigger, score in self.scored_triggers(word, limit)]
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], window: int = 5, min_count: int = 3,
+                   smoothing: float = .75) -> 'CooccurrenceIndex':
+        """Build an index from several texts.
+
+        :param texts: the texts to count
+        :param window: see __init__
+        :param min_count: see __init__
+        :param smoothing: see __init__
+        """
+        index = cls(window=window, min_count=min_count, smoothing=smoothing)
+        for text in texts:
+            index.add_text(text)
+        index.compact()
+        return index
+
+    @property
+    def stats(self) -> dict:
+        self.compact()
+        return {'texts': self.texts, 'words': len(self.words), 'pairs': len(self.partners),
+                'ranked_pairs': sum(self.ranked)}
+
+    def save(self, path: str):
+        """Write the index to a gzipped JSON file. The scores are worked out again when it's loaded.
+
+        :param path: location of the file
+        """
+        self.compact()
+        with self._lock:
+            data = {'window': self.window, 'min_count': self.min_count, 'smoothing': self.smoothing,
+                    'texts': self.texts, 'words': self.words, 'offsets': self.offsets.tolist(),
+                    'partners': self.partners.tolist(), 'counts': self.counts.tolist()}
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CooccurrenceIndex':
+        """Read an index written by save.
+
+        :param path: location of the file
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(window=data['window'], min_count=data['min_count'], smoothing=data['smoothing'])
+        index.texts = data['texts']
+        index.words = data['words']
+        index.word_ids = {word: word_id for word_id, word in enumerate(index.words)}
+        offsets = data['offsets']
+        index._pending = Counter({word_id << 32 | partner: count for word_id in range(len(offsets) - 1)
+                                  for partner, count in zip(data['partners'][offsets[word_id]:offsets[word_id + 1]],
+                                                            data['counts'][offsets[word_id]:offsets[word_id + 1]])})
+        index.compact()
+        return index
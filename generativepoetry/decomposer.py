@@ -2,22 +2,54 @@ import random
 import re
 from collections import defaultdict
 from typing import List, TypeVar
-import inflect
 import markovify
-import nltk
-import spacy
 from gutenberg.acquire import load_etext
 from gutenberg.query import get_metadata
 from gutenberg.cleanup import strip_headers
 from gutenberg_cleaner import super_cleaner
 from internetarchive import download
 from urllib.parse import urlsplit
+from .resources import LazyResource
+
+
+def load_sentence_detector():
+    import nltk
+    return nltk.data.load('tokenizers/punkt/english.pickle')
+
+
+def load_spacy_nlp():
+    import spacy
+    nlp = spacy.load('en_core_web_sm', disable=['ner'])
+    nlp.remove_pipe("parser")
+    return nlp
+
+
+def load_inflector():
+    import inflect
+    return inflect.engine()
+
+
+# These are loaded the first time they're used, so importing the module stays fast
+sent_detector = LazyResource(load_sentence_detector, name='punkt sentence detector')
+spacy_nlp = LazyResource(load_spacy_nlp, name='spaCy en_core_web_sm')
+inflector = LazyResource(load_inflector, name='inflect engine')
+
+
+def get_sentence_detector():
+    """Return the punkt sentence tokenizer, loading it on first use."""
+    return sent_detector.load()
+
+
+def get_spacy_nlp():
+    """Return the spaCy pipeline (without the parser and named entity recognizer), loading it on first use."""
+    return spacy_nlp.load()
+
+
+def get_inflector():
+    """Return the inflect engine, loading it on first use."""
+    return inflector.load()
 
 
-sent_detector = nltk.data.load('tokenizers/punkt/english.pickle')
-spacy_nlp = spacy.load('en_core_web_sm', disable=['ner'])
-spacy_nlp.remove_pipe("parser")
-inflector = inflect.engine()
 input_type = TypeVar('input_type', str, List[str])  # Must be str or list of strings
 
 
@@ -25,7 +57,7 @@ class ParsedText:
 
     def __init__(self, text):
         self.raw_text = text
-        self.sentences = sent_detector.tokenize(text)
+        self.sentences = get_sentence_detector().tokenize(text)
         self.paragraphs = self.raw_text.split("\n\n")
 
     def random_sentence(self, minimum_tokens=1) -> str:
@@ -35,9 +67,10 @@ class ParsedText:
             minimum_tokens; allows for sampling a sentence of a minimum NLP tokens
         """
         num_tokens = 0
+        nlp = get_spacy_nlp()
         while num_tokens < minimum_tokens:
             sentence = random.choice(self.sentences)
-            num_tokens = len([token.text for token in spacy_nlp(sentence)])
+            num_tokens = len([token.text for token in nlp(sentence)])
         return sentence
 
     def random_sentences(self, num=5, minimum_tokens=1) -> list:
@@ -60,9 +93,10 @@ class ParsedText:
             minimum_tokens; allows for sampling a sentence of a minimum NLP tokens
         """
         num_sentences = 0
+        detector = get_sentence_detector()
         while num_sentences < minimum_sentences:
             paragraph = random.choice(self.paragraphs)
-            num_sentences = len(sent_detector.tokenize(paragraph))
+            num_sentences = len(detector.tokenize(paragraph))
         return paragraph
 
 
@@ -141,6 +175,7 @@ def reconcile_replacement_word(original_word_with_ws, original_word_tag, replace
         replacement_word_tag (str):  part-of-speech tag of replacement word
     """
     # Pluralize or singularize the replacement word if we're dealing with nouns and one's plural and one's singular.
+    inflector = get_inflector()
     if original_word_tag == 'NNS' and replacement_word_tag == 'NN':
         replacement_word = inflector.plural(replacement_word)
     elif original_word_tag == 'NN' and replacement_word_tag == 'NNS':
@@ -159,8 +194,9 @@ def swap_parts_of_speech(text1, text2, parts_of_speech=['ADJ', 'NOUN']) -> (str,
         parts_of_speech (list) -- list of parts of speech tags to swap out. Must be from the list provided by spaCy:
                                   https://spacy.io/api/annotation#pos-tagging
     """
-    doc1 = spacy_nlp(text1)
-    doc2 = spacy_nlp(text2)
+    nlp = get_spacy_nlp()
+    doc1 = nlp(text1)
+    doc2 = nlp(text2)
     # First build two dictionaries (one for each text) whose keys are parts of speech and values are lists of words
     doc1_words_keyed_by_pos, doc2_words_keyed_by_pos = defaultdict(lambda: []), defaultdict(lambda: [])
     for token in doc1:
@@ -0,0 +1,111 @@
+import heapq
+import importlib
+import math
+import random
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional
+from .resources import LazyResource
+
+wordfreq = LazyResource(lambda: importlib.import_module('wordfreq'), name='wordfreq')
+
+
+class FrequencyTable:
+    """English word frequencies from the wordfreq package, looked up once per word and kept in a compact table.
+
+    The table grows as words are looked up, so a long-running process soon answers nearly every lookup from memory
+    instead of going through wordfreq's tokenizer.
+    """
+
+    def __init__(self, lang: str = 'en'):
+        self.lang = lang
+        self.word_ids: Dict[str, int] = {}
+        self.values = array('d')  # Word ids index into this array
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def frequency(self, word: str) -> float:
+        """Return how frequently a word appears in the wordfreq package's corpus, as a fraction of all words.
+
+        :param word: the word to look up
+        """
+        word_id = self.word_ids.get(word)
+        if word_id is not None:
+            return self.values[word_id]
+        value = wordfreq.word_frequency(word, self.lang)
+        with self._lock:
+            if word not in self.word_ids:
+                self.word_ids[word] = len(self.values)
+                self.values.append(value)
+        return value
+
+    def zipf(self, word: str) -> float:
+        """Return a word's frequency on the Zipf scale, where x means 10**x occurrences per billion words.
+
+        :param word: the word to look up
+        """
+        value = self.frequency(word)
+        return round(math.log10(value) + 9, 2) if value > 0 else 0.0
+
+    def sort_by_rarity(self, word_list: Iterable[str]) -> List[str]:
+        """Return the words sorted from rarest to most common. Equally frequent words keep their order.
+
+        :param word_list: the words to sort
+        """
+        return sorted(word_list, key=self.frequency)
+
+    def rarest(self, word_list: Iterable[str], k: Optional[int]) -> List[str]:
+        """Return the k rarest words, from rarest to most common; the same as sort_by_rarity(word_list)[:k], but with a
+        heap rather than a full sort.
+
+        :param word_list: the words to choose from
+        :param k: how many words to return. If None, return all of them.
+        """
+        if k is None:
+            return self.sort_by_rarity(word_list)
+        return heapq.nsmallest(k, word_list, key=self.frequency)
+
+    def tiers(self, word_list: Iterable[str]) -> 'ZipfTiers':
+        """Return the words grouped into Zipf frequency tiers.
+
+        :param word_list: the words to group
+        """
+        return ZipfTiers(word_list, self)
+
+
+class ZipfTiers:
+    """Words grouped by the integer part of their Zipf frequency, for picking rare words in constant time.
+
+    Tier 0 holds words that appear about once per billion words or less; tier 7 holds words like 'the'.
+    """
+
+    def __init__(self, word_list: Iterable[str], table: Optional[FrequencyTable] = None):
+        """
+        :param word_list: the words to group
+        :param table: the table to look up frequencies in (default: the shared frequency_table)
+        """
+        table = table or frequency_table
+        self.buckets: Dict[int, List[str]] = {}
+        for word in dict.fromkeys(word_list):
+            self.buckets.setdefault(int(table.zipf(word)), []).append(word)
+        self.tier_numbers = sorted(self.buckets)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def words_in_tier(self, tier: int) -> List[str]:
+        return self.buckets.get(tier, [])
+
+    def random_rare_word(self, max_tier: Optional[int] = None) -> Optional[str]:
+        """Return a random word from the rarest nonempty tier, or None if there's no word in or below max_tier.
+
+        :param max_tier: the most common tier the word may come from
+        """
+        if not self.tier_numbers or (max_tier is not None and self.tier_numbers[0] > max_tier):
+            return None
+        return random.choice(self.buckets[self.tier_numbers[0]])
+
+
+frequency_table = FrequencyTable()
@@ -1,18 +1,265 @@
+import itertools
 import random
+import threading
+import time
+from . import lexigen, sampling
+from .frequency import frequency_table
 from .lexigen import *
+from .providers import record_tier
+from .resilience import LookupUnavailableError
 from .utils import *
 
 
+class SearchBudget:
+    """Bounds the search for a word by a number of attempts and a deadline, whichever runs out first."""
+
+    def __init__(self, max_attempts: Optional[int] = None, deadline: Optional[float] = None):
+        """
+        :param max_attempts: the most attempts to make, or None for no limit
+        :param deadline: when to give up, as a time.monotonic() value, or None for no deadline
+        """
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.attempts = 0
+        self.exhausted = False
+
+    def spend(self) -> bool:
+        """Count an attempt and return True, or return False if the budget has run out."""
+        if (self.max_attempts is not None and self.attempts >= self.max_attempts) or \
+                (self.deadline is not None and time.monotonic() >= self.deadline):
+            self.exhausted = True
+            return False
+        self.attempts += 1
+        return True
+
+
+class AlgorithmBandit:
+    """Learns how often each of random_nonrhyme's algorithms produces a word that gets used, and how long it takes,
+    separately for input words of each Zipf frequency tier, and leans towards the productive ones.
+
+    Algorithms are picked by Thompson sampling: each algorithm's acceptance rate is drawn from a beta distribution
+    fitted to its record with words of that tier, once for each time the algorithm appears in the list of choices, and
+    the algorithm with the highest draw is picked. Some picks are made uniformly from the list instead, so the poems
+    stay varied and no algorithm's record goes stale.
+
+    Time isn't part of the score. Whether an algorithm is fast mostly depends on whether its lookups happen to be
+    cached, so scoring by it would hand nearly every pick to whichever algorithm was warm; it's reported in stats.
+    """
+
+    def __init__(self, exploration: float = .15):
+        """
+        :param exploration: the fraction of picks made uniformly at random from the list
+        """
+        self.exploration = exploration
+        # (algorithm name, Zipf tier of the input word) -> [attempts, accepted words, seconds, lookups]
+        self.records: Dict[Tuple[str, int], List[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def word_class(word: str) -> int:
+        """Return the Zipf frequency tier of a word, which is what the bandit's records are kept by."""
+        return int(frequency_table.zipf(word))
+
+    def choose(self, algorithms: list, input_word: str):
+        """Pick an algorithm to run on a word.
+
+        :param algorithms: the algorithms to choose from; one listed twice is favored accordingly
+        :param input_word: the word the algorithm will be run on
+        """
+        if random.random() < self.exploration:
+            return random.choice(algorithms)
+        word_class = self.word_class(input_word)
+        best, best_score = None, -1.0
+        for algorithm in dict.fromkeys(algorithms):
+            attempts, accepted, _, _ = self.records.get((algorithm.__name__, word_class), (0, 0, 0.0, 0))
+            # An algorithm listed n times gets the best of n draws, so with nothing learned the picks are uniform over
+            # the list, as random.choice's would be
+            score = max(random.betavariate(accepted + 1, attempts - accepted + 1)
+                        for _ in range(algorithms.count(algorithm)))
+            if score > best_score:
+                best, best_score = algorithm, score
+        return best
+
+    def record(self, algorithm, input_word: str, accepted: bool, seconds: float, lookups: int):
+        """Record the outcome of running an algorithm on a word.
+
+        :param algorithm: the algorithm that was run
+        :param input_word: the word it was run on
+        :param accepted: whether its result was used
+        :param seconds: how long it took
+        :param lookups: how many Datamuse lookups it made
+        """
+        with self._lock:
+            record = self.records.setdefault((algorithm.__name__, self.word_class(input_word)), [0, 0, 0.0, 0])
+            record[0] += 1
+            record[1] += accepted
+            record[2] += seconds
+            record[3] += lookups
+
+    @property
+    def stats(self) -> dict:
+        """Each algorithm's attempts, accepted words, seconds, and lookups over all tiers, and the lookups made per
+        accepted word."""
+        totals: Dict[str, List[float]] = {}
+        for (name, _), record in list(self.records.items()):
+            total = totals.setdefault(name, [0, 0, 0.0, 0])
+            for i, value in enumerate(record):
+                total[i] += value
+        accepted = sum(total[1] for total in totals.values())
+        lookups = sum(total[3] for total in totals.values())
+        return {'algorithms': {name: dict(zip(('attempts', 'accepted', 'seconds', 'lookups'), total))
+                               for name, total in totals.items()},
+                'lookups_per_accepted_word': lookups / accepted if accepted else None}
+
+
+algorithm_bandit = AlgorithmBandit()  # Shared by generators, so what's learned carries over from line to line
+
+
 class StochasticJolasticWordGenerator:
     common_words = ["the", "with", "in", "that", "not", "a", "an", "of", "for", "as", "like", "on", 'his', 'the',
                     'your', 'my', 'their']
+    # Where a word can come from, from most to least preferred. When a search runs out of attempts or time, the
+    # remaining rungs are tried in this order, and the last two never need a lookup.
+    degradation_ladder = ('rhyme', 'nonrhyme', 'sampling pool', 'common word')
 
-    def __init__(self, previous_lines=[]):
+    line_ending_query = WordQuery().excluding(common_words)  # What the last word of a line is picked with
+    # The Datamuse lookups (relation and max) behind each algorithm random_nonrhyme chooses from
+    algorithm_lookups = {similar_sounding_word: ('sl', 20), similar_meaning_word: ('ml', 10),
+                         contextually_linked_word: ('rel_trg', 10), frequently_following_word: ('lc', 10)}
+
+    def __init__(self, previous_lines=[], prefetch: bool = False, max_attempts: Optional[int] = 30,
+                 word_timeout: Optional[float] = None, lattice=None, bandit: Optional[AlgorithmBandit] = None):
+        """
+        :param previous_lines: the lines of the poem generated so far
+        :param prefetch: speculatively look up, in the background, what random_nonrhyme will probably need next
+        :param lattice: a CandidateLattice planned for the poem, to pick next words from without lookups
+        :param bandit: what picks random_nonrhyme's algorithms (default: the shared algorithm_bandit)
+        :param max_attempts: the default number of attempts a search for a word may make before falling back on the
+                             next rung of the degradation ladder, or None for no limit
+        :param word_timeout: the default number of seconds a search for a word may take, or None for no limit
+        """
         self.connector_choices = ['and', 'or', 'as', 'like', 'with']
         self.last_algorithms_used_to_reach_next_word = (None, None)
         self.previous_lines = previous_lines
+        self.prefetch = prefetch
+        self.max_attempts = max_attempts
+        self.word_timeout = word_timeout
+        self.lattice = lattice
+        self.bandit = bandit if bandit is not None else algorithm_bandit
+        self.lookups = 0  # How many times next_word had to run an algorithm, rather than pick a word from memory
+        # How many words came from each rung of the degradation ladder (or were connectors), and how many searches ran
+        # out of attempts or time
+        self.rungs_used = dict.fromkeys(self.degradation_ladder + ('connector',), 0)
+        self.exhausted_searches = 0
+        if prefetch and len(previous_lines):
+            self.prefetch_next_word_lookups(previous_lines[-1].split(' ')[-1])
 
-    def random_nonrhyme(self, previous_words: List[str], rhymable: bool = False) -> str:
+    def prefetch_next_word_lookups(self, word: str):
+        """Start the lookups of every algorithm random_nonrhyme might run on a word, without waiting for them, so that
+        the next word can usually be picked without a network round trip.
+
+        :param word: a word likely to be the input of the next random_nonrhyme call
+        """
+        if self.prefetch and word and not has_invalid_characters(word):
+            prefetch_in_background((relation, word, datamuse_api_max)
+                                   for relation, datamuse_api_max in self.algorithm_lookups.values()
+                                   if not lexigen.relation_graph.is_explored(relation, word, datamuse_api_max) and
+                                   not (self.lattice is not None and (relation, word) in self.lattice.candidates))
+
+    def search_budget(self, max_attempts: Optional[int] = None, deadline: Optional[float] = None) -> SearchBudget:
+        """Return the budget for a search for a word, using the generator's defaults for whatever isn't given.
+
+        :param max_attempts: the most attempts the search may make
+        :param deadline: when the search must stop, as a time.monotonic() value
+        """
+        if deadline is None and self.word_timeout is not None:
+            deadline = time.monotonic() + self.word_timeout
+        return SearchBudget(max_attempts if max_attempts is not None else self.max_attempts, deadline)
+
+    def _used(self, rung: str, word: str, budget: SearchBudget) -> str:
+        self.rungs_used[rung] += 1
+        if budget.exhausted:
+            self.exhausted_searches += 1
+        return word
+
+    def _fall_back(self, budget: SearchBudget, words_for_sampling: List[str], acceptable,
+                   constraints: Optional[WordQuery] = None) -> str:
+        # The last two rungs of the ladder: an acceptable word from the sampling pool, else a common word
+        for word in sampling.sample(words_for_sampling):
+            if acceptable(word):
+                return self._used('sampling pool', word, budget)
+        if constraints is not None and constraints.meter_slot is not None:
+            # Few of the common words fit every slot of a meter, so pick from the frequent words that fit this one
+            fitting = list(itertools.islice((word for word in lexigen.stress_index.frequent_words_fitting(
+                *constraints.meter_slot) if acceptable(word)), 100))
+            if fitting:
+                return self._used('common word', random.choice(fitting), budget)
+        return self._used('common word', random.choice(self.common_words), budget)
+
+    @property
+    def stats(self) -> dict:
+        """How many words came from each rung of the degradation ladder, how many searches ran out of budget, and how
+        many times an algorithm had to be run rather than answered from memory."""
+        return {'rungs_used': dict(self.rungs_used), 'exhausted_searches': self.exhausted_searches,
+                'lookups': self.lookups}
+
+    @staticmethod
+    def candidate_words(relation: str, input_word: str, neighbors: List[str]) -> List[str]:
+        """Filter a word's Datamuse results for a relation the way the matching algorithm does.
+
+        :param relation: the Datamuse relation code
+        :param input_word: the word that was looked up
+        :param neighbors: the words Datamuse returned
+        """
+        # Only similar sounding words are spellchecked, and they exclude the input word
+        return filter_word_list(neighbors, spellcheck=relation == 'sl',
+                                exclude_words=[input_word] if relation == 'sl' else ())
+
+    def next_word(self, algorithm, input_word: str, rhymable: bool = False,
+                  constraints: Optional[WordQuery] = None) -> Optional[str]:
+        """Return the result of one of random_nonrhyme's algorithms for a word. If the generator's lattice has the word,
+        the result is picked from its candidates (preferring ones it also has); otherwise, if the word's neighborhood is
+        in the relation graph, the result is picked from there the same way the algorithm would pick it. Either way
+        there's no lookup.
+
+        :param algorithm: one of the functions in algorithm_lookups
+        :param input_word: the word to run the algorithm on
+        :param rhymable: when picking from the lattice or the graph, only pick words that have a rhyme
+        :param constraints: when picking from the lattice or the graph, only pick words that match this query's local
+                            constraints (see WordQuery.matches); a word the algorithm returns that doesn't match is
+                            swapped for one that does from the neighborhood its lookup added to the graph
+        """
+        relation, datamuse_api_max = self.algorithm_lookups[algorithm]
+        if self.lattice is not None:
+            candidates = self.lattice.get(relation, input_word, rhymable)
+            if candidates is not None:
+                if constraints is not None:
+                    candidates = [candidate for candidate in candidates if constraints.matches(candidate)]
+                # Staying within the lattice means the word after this one won't need a lookup either
+                candidates = [candidate for candidate in candidates if candidate in self.lattice] or candidates
+                record_tier('memory')
+                return random.choice(candidates) if candidates else None
+        neighbors = None if has_invalid_characters(input_word) else \
+            lexigen.relation_graph.neighbors(relation, input_word, datamuse_api_max)
+        if neighbors is None:
+            self.lookups += 1
+            word = algorithm(input_word)
+            if constraints is None or word is None or constraints.matches(word):
+                return word
+            neighbors = lexigen.relation_graph.neighbors(relation, input_word, datamuse_api_max)
+            if neighbors is None:
+                return None
+        record_tier('memory')
+        if rhymable:
+            constraints = (constraints or WordQuery()).rhymable()
+        candidates = self.candidate_words(relation, input_word, neighbors)
+        if constraints is not None:
+            # Rejecting candidates here rather than after picking one saves the caller from trying again
+            candidates = [candidate for candidate in candidates if constraints.matches(candidate)]
+        return random.choice(candidates) if candidates else None
+
+    def random_nonrhyme(self, previous_words: List[str], rhymable: bool = False, max_attempts: Optional[int] = None,
+                        deadline: Optional[float] = None) -> str:
         """Return a random result of a random function that hits Project Datamuse API (rhyme function excluded)
 
         This function is primarily designed for use by the poem_line_from_markov function, but it may have other
@@ -22,11 +269,28 @@ class StochasticJolasticWordGenerator:
         the function will try different random functions from the lexigen module with different words until a word is
         found that is both not too similar to preceding words and not too similar to the last line's last word.
 
+        If the search runs out of attempts or time, the function falls back on a common word.
+
         :param previous_words: an ordered list of previous words of generated poem line
         :param rhymable: result must have a valid rhyme
+        :param max_attempts: the most algorithms (or pairs of them) to try (default: the generator's max_attempts)
+        :param deadline: when to stop trying, as a time.monotonic() value (default: word_timeout seconds from now)
         """
+        budget = self.search_budget(max_attempts, deadline)
+        result = self._random_nonrhyme(previous_words, rhymable, budget)
+        if result is not None:
+            return self._used('nonrhyme', result, budget)
+        line_index = SimilarityIndex(previous_words)
+        return self._fall_back(budget, [], lambda word: not line_index.too_similar(word))
+
+    def _random_nonrhyme(self, previous_words: List[str], rhymable: bool, budget: SearchBudget,
+                         constraints: Optional[WordQuery] = None) -> Optional[str]:
+        # random_nonrhyme's search, which returns None once the budget runs out or the API is unavailable. The
+        # constraints are applied when the result is picked, so results that break them needn't be tried and rejected.
         result = None
-        while result is None:
+        line_index = SimilarityIndex(previous_words)
+        previous_line_index = SimilarityIndex(self.previous_lines[-1].split(' ')) if len(self.previous_lines) else None
+        while result is None and budget.spend():
             # Randomly choose up to two algorithms the next word - one's repeated in this list for increased probability
             next_word_algorithms = [similar_sounding_word, similar_meaning_word, contextually_linked_word,
                                     frequently_following_word, frequently_following_word]
@@ -34,80 +298,124 @@ class StochasticJolasticWordGenerator:
             if self.last_algorithms_used_to_reach_next_word and self.last_algorithms_used_to_reach_next_word[0]:
                 # Don't use the same algorithm for picking two successive words
                 next_word_algorithms.remove(self.last_algorithms_used_to_reach_next_word[0])
-            random_algorithm = random.choice(next_word_algorithms)
             # The frequently following function should always use the preceding word as input
             # But otherwise, this will randomly sometimes use a different preceding word as input
             input_word = previous_words[-1] if random.random() <= .75 else random.choice(previous_words)
-            if random_algorithm != frequently_following_word and random.random() <= .25:
-                if self.last_algorithms_used_to_reach_next_word and self.last_algorithms_used_to_reach_next_word[1]:
-                    # Same goe for the 2nd algorithm used though this should be pretty rare
-                    nw_algorithms_copy.remove(self.last_algorithms_used_to_reach_next_word[1])
-                second_random_algorithm = random.choice(nw_algorithms_copy)
-                possible_result = random_algorithm(input_word)
-                possible_result = second_random_algorithm(possible_result) if possible_result else \
-                    second_random_algorithm(input_word)
-                self.last_algorithms_used_to_reach_next_word = (random_algorithm, second_random_algorithm)
-            else:
-                possible_result = random_algorithm(input_word)
-                self.last_algorithms_used_to_reach_next_word = (random_algorithm, None)
-            if possible_result and not too_similar(possible_result, previous_words) and \
-                    not (len(self.previous_lines) > 0 and
-                         too_similar(possible_result, self.previous_lines[-1].split(' '))
+            # Favor the algorithms that have been productive for words like this one
+            random_algorithm = self.bandit.choose(next_word_algorithms, input_word)
+            start, lookups = time.perf_counter(), self.lookups
+            try:
+                if random_algorithm != frequently_following_word and random.random() <= .25:
+                    if self.last_algorithms_used_to_reach_next_word and self.last_algorithms_used_to_reach_next_word[1]:
+                        # Same goe for the 2nd algorithm used though this should be pretty rare
+                        nw_algorithms_copy.remove(self.last_algorithms_used_to_reach_next_word[1])
+                    second_random_algorithm = random.choice(nw_algorithms_copy)
+                    # Both hops are local when the graph has explored the words
+                    possible_result = self.next_word(random_algorithm, input_word)
+                    possible_result = self.next_word(second_random_algorithm, possible_result or input_word, rhymable,
+                                                     constraints)
+                    self.last_algorithms_used_to_reach_next_word = (random_algorithm, second_random_algorithm)
+                else:
+                    possible_result = self.next_word(random_algorithm, input_word, rhymable, constraints)
+                    self.last_algorithms_used_to_reach_next_word = (random_algorithm, None)
+            except LookupUnavailableError:
+                # Without the API there's no point in more attempts; fall back on the local rungs of the ladder
+                budget.exhausted = True
+                return None
+            if possible_result and not line_index.too_similar(possible_result) and \
+                    not (previous_line_index is not None and previous_line_index.too_similar(possible_result)
                          and not has_invalid_characters(possible_result)) and \
-                    not (rhymable and not rhyme(possible_result)):
+                    not (rhymable and not is_rhymable(possible_result)) and \
+                    (constraints is None or constraints.matches(possible_result)):
                 # Is the word too similar to another word in the line or the previous line?
                 # Does the word have numbers or spaces for some reason? (extremely rare)
                 # If so, keep trying; otherwise exit the loop and return the word)
                 result = possible_result
+            self.bandit.record(random_algorithm, input_word, result is not None, time.perf_counter() - start,
+                               self.lookups - lookups)
         return result
 
     def last_word_of_markov_line(self, previous_words: List[str], rhyme_with: Optional[str] = None,
-                                 max_length: Optional[int] = None) -> str:
+                                 max_length: Optional[int] = None, words_for_sampling: List[str] = [],
+                                 max_attempts: Optional[int] = None, deadline: Optional[float] = None,
+                                 constraints: Optional[WordQuery] = None) -> str:
         """Get the last word of a poem line generated by the markov algorithm and optionally try to make it rhyme.
 
+        The word is looked for down the degradation ladder: a rhyme (if rhyme_with is given), then a word from
+        random_nonrhyme, then a word from words_for_sampling, then a common word. The search moves down a rung when
+        the current one has no fitting word or the search runs out of attempts or time.
+
         :param previous_words: an ordered list of previous words of generated poem line
         :param rhyme_with: the last word of the last line of the poem, if it exists
         :param max_line_legnth: an upper limit in characters for the word
+        :param words_for_sampling: words to fall back on if no other word can be found
+        :param max_attempts: the most attempts to make (default: the generator's max_attempts)
+        :param deadline: when to stop trying, as a time.monotonic() value (default: word_timeout seconds from now)
+        :param constraints: local constraints the word has to meet as well, such as fitting the end of a meter (see
+                            WordQuery.fits_meter)
         """
-        word = None
-        if rhyme_with:
-            word = word = rhyme(rhyme_with)
-            # if the word is a common word or would be awkward to end a line with, keep trying
-            while word in self.common_words or (max_length and len(word) > max_length):
-                word = rhyme(rhyme_with)
-            # But if there's no rhyme result try another method altogether
-            if not word:
-                while word is None or (max_length and len(word) > max_length) or word in self.common_words \
-                        or too_similar(word, previous_words):
-                    word = self.random_nonrhyme(previous_words)
-        else:
-            while word is None or (max_length and len(word) > max_length) or word in self.common_words \
-                    or too_similar(word, previous_words):
-                # Maybe revisit defaulting rhymable to true here
-                word = self.random_nonrhyme(previous_words, rhymable=True)
-        return word
+        budget = self.search_budget(max_attempts, deadline)
+        line_index = SimilarityIndex(previous_words)
+        # Common words would be awkward to end a line with
+        ending = self.line_ending_query if constraints is None else constraints.excluding(self.common_words)
+        ending = ending.max_length(max_length)
+        if rhyme_with and not has_invalid_characters(rhyme_with):
+            rhyme_words = ending.rhymes_with(rhyme_with).words()
+            if rhyme_words:
+                return self._used('rhyme', random.choice(rhyme_words), budget)
+        # If there's no rhyme result try another method altogether
+        while True:
+            # Maybe revisit defaulting rhymable to true here
+            word = self._random_nonrhyme(previous_words, not rhyme_with, budget, ending)
+            if word is None:
+                break
+            if not line_index.too_similar(word):
+                return self._used('nonrhyme', word, budget)
+        return self._fall_back(budget, words_for_sampling,
+                               lambda word: ending.matches(word) and not line_index.too_similar(word), ending)
 
-    def nonlast_word_of_markov_line(self, previous_words: List[str], words_for_sampling: List[str] = []) -> str:
+    def nonlast_word_of_markov_line(self, previous_words: List[str], words_for_sampling: List[str] = [],
+                                    max_attempts: Optional[int] = None, deadline: Optional[float] = None,
+                                    constraints: Optional[WordQuery] = None) -> str:
         """Get the next word of a poem line generated by the markov algorithm.
 
         :param previous_words: an ordered list of previous words of generated poem line
         :param param words_for_sampling: a list of other words to throw in to the poem.
+        :param max_attempts: the most attempts to make before falling back on words_for_sampling and then a common
+                             word (default: the generator's max_attempts)
+        :param deadline: when to stop trying, as a time.monotonic() value (default: word_timeout seconds from now)
+        :param constraints: local constraints the word has to meet, such as fitting the next syllables of a meter (see
+                            WordQuery.fits_meter)
         """
-        word = None
+        budget = self.search_budget(max_attempts, deadline)
+        line_index = SimilarityIndex(previous_words)
+
+        def acceptable(word: str) -> bool:
+            return not line_index.too_similar(word) and (constraints is None or constraints.matches(word))
+
+        if constraints is not None:
+            # Pruned up front, so the words that don't fit are never tried
+            words_for_sampling = [word for word in words_for_sampling if constraints.matches(word)]
+        if self.lattice is not None:
+            # Words the lattice has can be followed without lookups
+            words_for_sampling = [word for word in words_for_sampling if word in self.lattice] or words_for_sampling
         if previous_words[-1] in self.common_words:
             if random.random() >= .85 and len(previous_words) > 1:
-                word = self.random_nonrhyme(previous_words[:-1])
-            else:
-                while word is None or too_similar(word, previous_words):
-                    word = random.choice(words_for_sampling)
+                word = self._random_nonrhyme(previous_words[:-1], False, budget, constraints)
+                if word is not None:
+                    return self._used('nonrhyme', word, budget)
         else:
             threshold = .6 if len(words_for_sampling) else 1
-            while word is None or too_similar(word,  previous_words):
+            while budget.spend():
                 if random.random() > threshold:
                     if random.random() <= .5:
-                        word = random.choice(self.connector_choices)
+                        word, rung = random.choice(self.connector_choices), 'connector'
                     else:
-                        word = random.choice(words_for_sampling)
+                        word, rung = random.choice(words_for_sampling), 'sampling pool'
                 else:
-                    word = self.random_nonrhyme(previous_words)
-        return word
+                    word, rung = self._random_nonrhyme(previous_words, False, budget, constraints), 'nonrhyme'
+                    if word is None:
+                        break
+                if acceptable(word):
+                    return self._used(rung, word, budget)
+        return self._fall_back(budget, words_for_sampling, acceptable, constraints)
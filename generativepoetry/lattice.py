@@ -0,0 +1,129 @@
+import random
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from . import sampling
+from .jolastic import StochasticJolasticWordGenerator
+from .lexigen import datamuse_lookup, is_rhymable, prefetch
+from .resilience import LookupUnavailableError
+from .utils import *
+
+
+class CandidateLattice:
+    """The words a Markov poem can reach, planned before it is written.
+
+    For each word in the lattice and each of random_nonrhyme's relations, the lattice holds the candidate next words,
+    already filtered the way the generator would filter them: spellchecked where the algorithm spellchecks, without
+    words with invalid characters, words too long for a line, or words too similar to the word they were looked up
+    from. The rhymable candidates are kept separately, for when the next word has to end a line. A generator with a
+    lattice samples from it instead of looking the words up, and prefers candidates that are in the lattice themselves,
+    so that its walks stay in memory.
+    """
+
+    def __init__(self, lookups: Optional[Iterable[Tuple[str, int]]] = None, max_length: Optional[int] = None):
+        """
+        :param lookups: the (relation, max) of each Datamuse lookup to plan (default: those of random_nonrhyme)
+        :param max_length: an upper limit in characters for candidates
+        """
+        self.lookups = dict(lookups or StochasticJolasticWordGenerator.algorithm_lookups.values())
+        self.max_length = max_length
+        self.words: Set[str] = set()  # The words whose candidates are in the lattice
+        self.candidates: Dict[Tuple[str, str], List[str]] = {}
+        self.rhymable_candidates: Dict[Tuple[str, str], List[str]] = {}
+        self.hits, self.misses, self.failed_lookups = 0, 0, 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def add(self, relation: str, word: str, neighbors: List[str]):
+        """Filter a word's Datamuse results for a relation and store them as its candidates.
+
+        :param relation: the Datamuse relation code
+        :param word: the word that was looked up
+        :param neighbors: the words Datamuse returned, in order
+        """
+        candidates = StochasticJolasticWordGenerator.candidate_words(relation, word, neighbors)
+        candidates = [candidate for candidate in candidates if not has_invalid_characters(candidate) and
+                      not (self.max_length and len(candidate) > self.max_length) and
+                      not too_similar(candidate, word)]
+        with self._lock:
+            self.words.add(word)
+            self.candidates[(relation, word)] = candidates
+
+    def get(self, relation: str, word: str, rhymable: bool = False) -> Optional[List[str]]:
+        """Return the candidates after a word for a relation, or None if the lattice doesn't have them.
+
+        :param relation: the Datamuse relation code
+        :param word: the word to find the candidates after
+        :param rhymable: only return candidates that have a rhyme
+        """
+        candidates = self.candidates.get((relation, word))
+        if candidates is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if rhymable:
+            # Worked out when first needed, since checking every candidate's rhymes up front would take a while
+            rhymable_candidates = self.rhymable_candidates.get((relation, word))
+            if rhymable_candidates is None:
+                rhymable_candidates = [candidate for candidate in candidates if is_rhymable(candidate)]
+                self.rhymable_candidates[(relation, word)] = rhymable_candidates
+            return rhymable_candidates
+        return candidates
+
+    def neighbors(self, word: str) -> List[str]:
+        """Return the distinct candidates after a word, for every relation.
+
+        :param word: the word to find the candidates after
+        """
+        return sampling.unique(candidate for relation in self.lookups
+                               for candidate in self.candidates.get((relation, word), ()))
+
+    def expand(self, words: Iterable[str]):
+        """Look up, in one concurrent batch, every relation of the words that aren't in the lattice yet, and add the
+        results. Lookups that fail are left out of the lattice, so the generator will try them again itself.
+
+        :param words: the words to add to the lattice
+        """
+        keys = [(relation, word, datamuse_api_max) for word in sampling.unique(words)
+                if word and not has_invalid_characters(word)
+                for relation, datamuse_api_max in self.lookups.items() if (relation, word) not in self.candidates]
+        prefetch(keys)
+        for relation, word, datamuse_api_max in keys:
+            try:
+                response = datamuse_lookup(relation, word, datamuse_api_max)
+            except LookupUnavailableError:
+                self.failed_lookups += 1
+                continue
+            self.add(relation, word, [obj['word'] for obj in response])
+
+    @classmethod
+    def build(cls, input_words: Iterable[str], neighbors_per_word: int = 1, max_length: Optional[int] = None,
+              lookups: Optional[Iterable[Tuple[str, int]]] = None,
+              rng: Optional[random.Random] = None) -> 'CandidateLattice':
+        """Plan a lattice for a poem: look up the input words in one batch, then a sample of their candidates in a
+        second.
+
+        :param input_words: the words the poem is made from
+        :param neighbors_per_word: how many of each input word's candidates to add to the lattice as well
+        :param max_length: an upper limit in characters for candidates
+        :param lookups: the (relation, max) of each Datamuse lookup to plan (default: those of random_nonrhyme)
+        :param rng: the random number generator for sampling the neighbors
+        """
+        lattice = cls(lookups, max_length=max_length)
+        input_words = sampling.unique(input_words)
+        lattice.expand(input_words)
+        if neighbors_per_word:
+            lattice.expand(neighbor for word in input_words
+                           for neighbor in sampling.sample(lattice.neighbors(word), neighbors_per_word, rng=rng))
+        return lattice
+
+    @property
+    def stats(self) -> dict:
+        """The size of the lattice and how many of the generator's lookups it answered."""
+        return {'words': len(self.words), 'entries': len(self.candidates),
+                'candidates': sum(len(candidates) for candidates in self.candidates.values()),
+                'hits': self.hits, 'misses': self.misses, 'failed_lookups': self.failed_lookups}
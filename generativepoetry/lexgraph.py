@@ -0,0 +1,149 @@
+import gzip
+import json
+import os
+import threading
+from array import array
+from typing import Dict, List, Optional
+from .cache import default_cache_path
+
+relations = ('sl', 'ml', 'rel_trg', 'lc')
+
+
+def default_graph_path() -> Optional[str]:
+    """Return where the relation graph is saved between runs: next to the lexical cache, or None if the lexical cache is
+    memory-only."""
+    cache_path = default_cache_path()
+    return os.path.join(os.path.dirname(cache_path), 'relations.json.gz') if cache_path else None
+
+
+class RelationGraph:
+    """The Datamuse results seen so far, as a graph over interned word ids with an edge type for each relation.
+
+    Each explored word has, per relation, an array of its neighbors' ids in the order Datamuse returned them (most to
+    least related) and an array of their scores. Any walk over explored words can be taken without querying the API.
+    """
+
+    def __init__(self):
+        self.words: List[str] = []  # Word ids index into this list
+        self.word_ids: Dict[str, int] = {}
+        self.neighbor_ids: Dict[str, Dict[int, array]] = {relation: {} for relation in relations}
+        self.scores: Dict[str, Dict[int, array]] = {relation: {} for relation in relations}
+        # The max each word was looked up with, which bounds how many of its neighbors are known
+        self.limits: Dict[str, Dict[int, int]] = {relation: {} for relation in relations}
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.words)
+
+    def intern(self, word: str) -> int:
+        """Return the id of a word, assigning it one if it hasn't been seen."""
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def add(self, relation: str, word: str, response: List[dict], limit: int):
+        """Record a word's Datamuse results for a relation, unless results from a lookup with a max at least as high are
+        already recorded.
+
+        :param relation: the Datamuse relation code
+        :param word: the word that was looked up
+        :param response: the API results, in the order returned
+        :param limit: the max the word was looked up with
+        """
+        if relation not in self.limits:
+            return
+        with self._lock:
+            word_id = self.intern(word)
+            if self.limits[relation].get(word_id, -1) >= limit:
+                return
+            self.neighbor_ids[relation][word_id] = array('i', (self.intern(obj['word']) for obj in response))
+            self.scores[relation][word_id] = array('f', (obj.get('score', 0) for obj in response))
+            self.limits[relation][word_id] = limit
+
+    def is_explored(self, relation: str, word: str, limit: int) -> bool:
+        """Check whether the results of looking up a word with the given max are known.
+
+        :param relation: the Datamuse relation code
+        :param word: the word to check
+        :param limit: the max the word would be looked up with
+        """
+        word_id = self.word_ids.get(word)
+        if word_id is None or relation not in self.limits or word_id not in self.limits[relation]:
+            return False
+        # Fewer results than the max means there are no more to be had with a higher one
+        return self.limits[relation][word_id] >= limit or \
+            len(self.neighbor_ids[relation][word_id]) < self.limits[relation][word_id]
+
+    def neighbors(self, relation: str, word: str, limit: int) -> Optional[List[str]]:
+        """Return the first results of looking up a word, as Datamuse would, or None if the word hasn't been explored
+        that far.
+
+        :param relation: the Datamuse relation code
+        :param word: the word to look up
+        :param limit: the max the word would be looked up with
+        """
+        if not self.is_explored(relation, word, limit):
+            self.misses += 1
+            return None
+        self.hits += 1
+        words = self.words
+        return [words[neighbor_id] for neighbor_id in self.neighbor_ids[relation][self.word_ids[word]][:limit]]
+
+    def scored_neighbors(self, relation: str, word: str) -> Dict[str, float]:
+        """Return all the known neighbors of a word with their Datamuse scores.
+
+        :param relation: the Datamuse relation code
+        :param word: the word to look up
+        """
+        word_id = self.word_ids.get(word)
+        if word_id is None or word_id not in self.limits.get(relation, {}):
+            return {}
+        return {self.words[neighbor_id]: score for neighbor_id, score in
+                zip(self.neighbor_ids[relation][word_id], self.scores[relation][word_id])}
+
+    @property
+    def stats(self) -> dict:
+        """The size of the graph and how many lookups it answered."""
+        return {'words': len(self.words), 'explored': sum(len(limits) for limits in self.limits.values()),
+                'edges': sum(len(ids) for neighbor_ids in self.neighbor_ids.values() for ids in neighbor_ids.values()),
+                'hits': self.hits, 'misses': self.misses}
+
+    def save(self, path: str):
+        """Write the graph to a gzipped JSON file.
+
+        :param path: location of the file
+        """
+        with self._lock:
+            data = {'words': self.words, 'relations': {
+                relation: {word_id: [limit, self.neighbor_ids[relation][word_id].tolist(),
+                                     [round(score, 2) for score in self.scores[relation][word_id]]]
+                           for word_id, limit in self.limits[relation].items()}
+                for relation in relations}}
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'RelationGraph':
+        """Read a graph written by save.
+
+        :param path: location of the file
+        """
+        graph = cls()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        graph.words = data['words']
+        graph.word_ids = {word: word_id for word_id, word in enumerate(graph.words)}
+        for relation, nodes in data['relations'].items():
+            if relation not in graph.limits:
+                continue
+            for word_id, (limit, neighbor_ids, scores) in nodes.items():
+                graph.limits[relation][int(word_id)] = limit
+                graph.neighbor_ids[relation][int(word_id)] = array('i', neighbor_ids)
+                graph.scores[relation][int(word_id)] = array('f', scores)
+        return graph
@@ -1,11 +1,371 @@
+import atexit
+import contextvars
+import copy
+import itertools
+import os
 import random
-from typing import List, TypeVar, Optional
-import pronouncing
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Tuple, TypeVar, Optional
 from datamuse import datamuse
+from . import sampling
+from .bigrams import BigramIndex
+from .cache import LexicalCache, SingleFlight, default_cache_path
+from .cooccurrence import CooccurrenceIndex
+from .frequency import frequency_table
+from .lexgraph import RelationGraph, default_graph_path
+from .meter import Meter, StressIndex
+from .phonetics import PhoneticIndex
+from .providers import current_budget, record_tier
+from .resilience import LookupUnavailableError, ResilientTransport, TokenBucket
+from .resources import LazyResource
+from .rhymeindex import RhymeIndex
+from .transport import FixtureTransport, LiveTransport
 from .utils import *
 
+if TYPE_CHECKING:
+    from .vectors import WordVectors
+
 api = datamuse.Datamuse()
+lookup_concurrency = 8  # The most Datamuse queries in flight at once, and the size of the connection pool
+lexical_cache = LexicalCache(default_cache_path())
+rate_limiter = TokenBucket(rate=50, burst=100)  # Shared by every Datamuse request this process sends
+transport = ResilientTransport(LiveTransport(api, pool_size=lookup_concurrency), rate_limiter=rate_limiter)
+degraded_lookups = 0  # Lookups answered from stale or local results because the API was unavailable
+lookup_flights = SingleFlight()  # Concurrent identical lookups share one request; see lookup_flights.stats
+rhyme_index = RhymeIndex()
+stress_index = StressIndex()  # Syllable counts and stress patterns, for fitting words to a meter
+relation_graph = RelationGraph()  # Every Datamuse result seen, for walking without further lookups
+bigram_index: Optional[BigramIndex] = None  # Answers left context (lc) lookups locally once loaded
+word_vectors: Optional['WordVectors'] = None  # Answers means like (ml) lookups locally once loaded
+phonetic_index: Optional[LazyResource] = None  # A PhoneticIndex; answers sounds like (sl) lookups locally once loaded
+cooccurrence_index: Optional[CooccurrenceIndex] = None  # Answers trigger (rel_trg) lookups locally once loaded
 str_or_list_of_str = TypeVar('str_or_list_of_str', str, List[str])
+lookup = Tuple[str, str, Optional[int]]  # (relation, word, max), as passed to datamuse_lookup
+_lookup_executor: Optional[ThreadPoolExecutor] = None
+_lookup_thread = threading.local()
+
+
+def datamuse_lookup(relation: str, input_word: str, datamuse_api_max: Optional[int] = None) -> List[dict]:
+    """Return the Datamuse API results for a word and relation, answering from the lexical cache when possible.
+
+    :param relation: the Datamuse query parameter, e.g. sl (sounds like), ml (means like), rel_trg (triggers) or lc
+                     (left context, i.e. frequently following)
+    :param input_word: the word in relation to which the API is queried
+    :param datamuse_api_max: the maximum number of results returned by the API. If not provided, the API client's
+                             default is used.
+
+    Left context lookups for words in the bigram index (see load_bigram_index) are answered from the index, with the
+    number of times each word followed as its score, means like lookups for words in the word vectors (see
+    load_word_vectors) are answered from them, with cosine similarity as the score, and sounds like lookups for words
+    in the phonetic index (see load_phonetic_index) are answered from it, with a score that's higher the nearer the
+    pronunciations are. Trigger lookups for words in the co-occurrence index (see load_cooccurrence_index) are answered
+    from it, with pointwise mutual information as the score.
+
+    If the API is unavailable (it keeps failing, or the circuit breaker has stopped querying it), an expired cached
+    response or the results known to the relation graph are returned instead. If neither is available, the
+    LookupUnavailableError is raised.
+
+    Under a latency budget (see providers.latency_budget), the API is only queried if its recent 95th percentile
+    latency fits in the time left, and otherwise the same fallbacks are used, or no results if there are none.
+    """
+    global degraded_lookups
+    key = (relation, input_word, datamuse_api_max)
+    if _indexed(key):
+        record_tier('local')
+        return _indexed_response(key)
+    response, tier = lexical_cache.lookup(key)
+    if response is None:
+        budget = current_budget()
+        if budget is not None and not budget.affords(_expected_latency()):
+            response, tier = _local_response(key) or ([], 'none')
+            record_tier(tier)
+            return response
+        try:
+            response, tier = lookup_flights.do(key, _fetch, key, {relation: input_word}), 'api'
+        except LookupUnavailableError:
+            local_response = _local_response(key)
+            if local_response is None:
+                raise
+            degraded_lookups += 1
+            record_tier(local_response[1])
+            return local_response[0]
+    limit = datamuse_api_max or api.max
+    if not relation_graph.is_explored(relation, input_word, limit):
+        relation_graph.add(relation, input_word, response, limit)
+    record_tier(tier)
+    return response
+
+
+def _local_response(key: lookup) -> Optional[Tuple[List[dict], str]]:
+    # The best answer to a lookup that can be had without the API, and the tier it came from, or None
+    relation, input_word, datamuse_api_max = key
+    response, tier = lexical_cache.lookup(key, stale=True)
+    if response is not None:
+        return response, tier
+    limit = datamuse_api_max or api.max
+    if relation_graph.is_explored(relation, input_word, 0):
+        scores = relation_graph.scored_neighbors(relation, input_word)
+        return [{'word': word, 'score': score} for word, score in scores.items()][:limit], 'memory'
+    return None
+
+
+def datamuse_query(constraints: Mapping[str, str], datamuse_api_max: Optional[int] = None) -> List[dict]:
+    """Return the Datamuse API results for words that meet several constraints at once, e.g. {'rel_rhy': 'blue',
+    'ml': 'ocean'} for rhymes of blue that mean something like ocean, from a single request. (See WordQuery for a
+    friendlier way to build one.)
+
+    :param constraints: Datamuse query parameters and their values
+    :param datamuse_api_max: the maximum number of results returned by the API. If not provided, the API client's
+                             default is used.
+
+    A query with a single constraint is the same as datamuse_lookup. Otherwise, if the API is unavailable, an expired
+    cached response is returned, or if there is none, the LookupUnavailableError is raised; under a latency budget
+    that can't afford the API, the result is empty unless an expired cached response is available.
+    """
+    constraints = dict(sorted(constraints.items()))
+    if len(constraints) == 1:
+        return datamuse_lookup(*next(iter(constraints.items())), datamuse_api_max)
+    # Cached like a lookup, under the constraint names and values joined together
+    key = ('+'.join(constraints), '+'.join(constraints.values()), datamuse_api_max)
+    response, tier = lexical_cache.lookup(key)
+    if response is None:
+        budget = current_budget()
+        if budget is not None and not budget.affords(_expected_latency()):
+            response, tier = lexical_cache.lookup(key, stale=True)
+            if response is None:
+                response, tier = [], 'none'
+        else:
+            try:
+                response, tier = lookup_flights.do(key, _fetch, key, constraints), 'api'
+            except LookupUnavailableError:
+                response, tier = lexical_cache.lookup(key, stale=True)
+                if response is None:
+                    raise
+    record_tier(tier)
+    return response
+
+
+def _indexed(key: lookup) -> bool:
+    # Whether a lookup is answered by one of the local indexes or the word vectors rather than Datamuse
+    relation, input_word, datamuse_api_max = key
+    if relation == 'lc':
+        return bigram_index is not None and input_word in bigram_index
+    if relation == 'rel_trg':
+        return cooccurrence_index is not None and input_word in cooccurrence_index
+    if relation == 'sl':
+        return phonetic_index is not None and input_word in phonetic_index.load()
+    return relation == 'ml' and word_vectors is not None and input_word in word_vectors
+
+
+def _indexed_response(key: lookup) -> List[dict]:
+    relation, input_word, datamuse_api_max = key
+    if relation == 'lc':
+        scores = bigram_index.scored_following(input_word, datamuse_api_max or api.max)
+    elif relation == 'rel_trg':
+        scores = cooccurrence_index.scored_triggers(input_word, datamuse_api_max or api.max)
+    elif relation == 'sl':
+        index = phonetic_index.load()
+        # Distance 0 (a homophone) scores max_distance + 1, and the furthest words 1
+        scores = [(word, index.max_distance + 1 - distance)
+                  for word, distance in index.neighbors(input_word, datamuse_api_max or api.max)]
+    else:
+        scores = word_vectors.neighbors([input_word], datamuse_api_max or api.max)[input_word]
+    return [{'word': word, 'score': score} for word, score in scores]
+
+
+def _expected_latency() -> float:
+    return getattr(transport, 'expected_latency', lambda: 0)()
+
+
+def _fetch(key: lookup, constraints: Mapping[str, str]) -> List[dict]:
+    # A call for the same key may have finished between the caller's cache miss and this call starting
+    response = lexical_cache.peek(key)
+    if response is None:
+        datamuse_api_max = key[2]
+        query = dict(constraints)
+        if datamuse_api_max:
+            query['max'] = datamuse_api_max
+        response = compact_response(transport.fetch(query))
+        lexical_cache.set(key, response)
+    return response
+
+
+def compact_response(response: List[dict]) -> List[dict]:
+    """Reduce Datamuse results to the fields lexigen uses, each word and its score, so cached responses stay small.
+
+    :param response: the API results, in the order returned
+    """
+    results = []
+    for obj in response:
+        result = {'word': obj['word']}
+        if 'score' in obj:
+            result['score'] = obj['score']
+        results.append(result)
+    return results
+
+
+def _mark_lookup_thread():
+    _lookup_thread.active = True
+
+
+def lookup_executor() -> ThreadPoolExecutor:
+    """Return the thread pool that concurrent Datamuse lookups run on, creating it on first use."""
+    global _lookup_executor
+    if _lookup_executor is None:
+        _lookup_executor = ThreadPoolExecutor(max_workers=lookup_concurrency, thread_name_prefix='lexigen',
+                                              initializer=_mark_lookup_thread)
+    return _lookup_executor
+
+
+def prefetch(lookups: Iterable[lookup]):
+    """Warm the lexical cache for several Datamuse lookups at once by sending the uncached ones concurrently.
+
+    Errors are left for the caller to run into when it performs the lookup itself.
+
+    :param lookups: (relation, word, max) tuples, as passed to datamuse_lookup
+    """
+    keys = list(dict.fromkeys(lookups))
+    if word_vectors is not None:
+        # The vectors answer all of their lookups with one matrix multiply, and keep the answers
+        ml_keys = [key for key in keys if key[0] == 'ml']
+        if ml_keys:
+            word_vectors.neighbors((key[1] for key in ml_keys), max(key[2] or api.max for key in ml_keys))
+    if phonetic_index is not None:
+        # Searched for on every core at once when there are many, and kept
+        phonetic_index.load().neighbors_many(key[1] for key in keys if key[0] == 'sl')
+    pending = [key for key in keys if lexical_cache.peek(key) is None and not _indexed(key)]
+    if len(pending) < 2 or getattr(_lookup_thread, 'active', False):
+        # Nothing to gain from the thread pool, and a pool thread waiting on the pool could deadlock it
+        return
+    # Each lookup runs in a copy of this context, so it's made under the caller's latency budget, if there is one
+    budget = current_budget()
+    wait([lookup_executor().submit(contextvars.copy_context().run, datamuse_lookup, *key) for key in pending],
+         timeout=budget.remaining() if budget is not None else None)
+
+
+def prefetch_in_background(lookups: Iterable[lookup]) -> list:
+    """Start the uncached Datamuse lookups on the lookup thread pool and return without waiting for them. Lookups for
+    the same keys made while these are in flight share their requests.
+
+    :param lookups: (relation, word, max) tuples, as passed to datamuse_lookup
+    """
+    return [lookup_executor().submit(contextvars.copy_context().run, datamuse_lookup, *key)
+            for key in dict.fromkeys(lookups) if lexical_cache.peek(key) is None and not _indexed(key)]
+
+
+@contextmanager
+def use_fixture(path: str, mode: str = 'replay'):
+    """Within this context, answer Datamuse queries from a recorded fixture, or record one from the live API.
+
+    A fresh in-memory cache stands in for the persistent one while the fixture is in use, so that every query is
+    recorded in record mode and no query is answered from outside the fixture in replay and strict modes.
+
+    :param path: location of the fixture file
+    :param mode: record (query the API and save its responses), replay (serve saved responses, and empty responses
+                 for anything unrecorded), or strict (like replay, but raise UnrecordedQueryError instead)
+    """
+    global transport, lexical_cache, relation_graph
+    previous_transport, previous_cache, previous_graph = transport, lexical_cache, relation_graph
+    fixture = FixtureTransport(path, mode=mode, transport=previous_transport)
+    transport, lexical_cache, relation_graph = fixture, LexicalCache(), RelationGraph()
+    try:
+        yield fixture
+    finally:
+        fixture.save()
+        transport, lexical_cache, relation_graph = previous_transport, previous_cache, previous_graph
+
+
+def load_relation_graph(path: Optional[str] = None, save_at_exit: bool = True) -> RelationGraph:
+    """Replace the relation graph with the one saved by an earlier run, if there is one, so that the words explored
+    then can be walked without any lookups.
+
+    :param path: location of the saved graph (default: next to the lexical cache)
+    :param save_at_exit: save the graph, with whatever is explored in this run, when the process exits
+    """
+    global relation_graph
+    path = path or default_graph_path()
+    if path is None:
+        return relation_graph
+    if os.path.exists(path):
+        try:
+            relation_graph = RelationGraph.load(path)
+        except (OSError, ValueError, KeyError):
+            pass  # A damaged graph is only a cold start
+    if save_at_exit:
+        atexit.register(lambda: relation_graph.save(path))
+    return relation_graph
+
+
+def load_bigram_index(path: str) -> BigramIndex:
+    """Load a bigram index saved with BigramIndex.save and answer left context lookups (frequently_following_words)
+    from it from now on, for the words it has. Words it doesn't have are still looked up in Datamuse.
+
+    :param path: location of the saved index
+    """
+    global bigram_index
+    bigram_index = BigramIndex.load(path)
+    return bigram_index
+
+
+def load_cooccurrence_index(path: str) -> CooccurrenceIndex:
+    """Load a co-occurrence index saved with CooccurrenceIndex.save and answer trigger lookups
+    (contextually_linked_words) from it from now on, for the words it has. Words it doesn't have are still looked up in
+    Datamuse. Texts added to the index later are used by the lookups after them.
+
+    :param path: location of the saved index
+    """
+    global cooccurrence_index
+    cooccurrence_index = CooccurrenceIndex.load(path)
+    return cooccurrence_index
+
+
+def load_word_vectors(path: str) -> 'WordVectors':
+    """Map word vectors converted with WordVectors.convert and answer means like lookups (similar_meaning_words) from
+    them from now on, for the words they have. Words they don't have are still looked up in Datamuse.
+
+    :param path: where the converted files are, without an extension
+    """
+    global word_vectors
+    from .vectors import WordVectors  # NumPy is only imported when vectors are used
+    word_vectors = WordVectors.load(path)
+    return word_vectors
+
+
+def load_phonetic_index(max_distance: int = 3, lazy: bool = False) -> LazyResource:
+    """Build a phonetic index of the CMU dictionary and answer sounds like lookups (similar_sounding_words) from it
+    from now on, for the words in the dictionary. Other words are still looked up in Datamuse. Building it takes a few
+    seconds. Return the LazyResource the index is kept behind; its load method returns the PhoneticIndex.
+
+    :param max_distance: the greatest weighted phoneme edit distance at which words count as sounding alike (see
+                         phonetics.distance)
+    :param lazy: build the index the first time a lookup needs it instead of now; it's listed in startup reports as a
+                 lazily loaded resource
+    """
+    global phonetic_index
+    index = PhoneticIndex(max_distance=max_distance)
+    phonetic_index = LazyResource(lambda: index.build() or index, name='CMU phonetic index' if lazy else None)
+    if not lazy:
+        phonetic_index.load()
+    return phonetic_index
+
+
+if os.environ.get('GENERATIVEPOETRY_PHONETIC_INDEX'):
+    load_phonetic_index(lazy=True)  # Importing shouldn't take the seconds building it does
+if os.environ.get('GENERATIVEPOETRY_VECTORS'):
+    load_word_vectors(os.environ['GENERATIVEPOETRY_VECTORS'])
+if os.environ.get('GENERATIVEPOETRY_BIGRAMS'):
+    load_bigram_index(os.environ['GENERATIVEPOETRY_BIGRAMS'])
+if os.environ.get('GENERATIVEPOETRY_COOCCURRENCE'):
+    load_cooccurrence_index(os.environ['GENERATIVEPOETRY_COOCCURRENCE'])
+if os.environ.get('GENERATIVEPOETRY_FIXTURE'):
+    # Lets the CLI, benchmarks, and profilers run on a fixture without any code changes
+    transport = FixtureTransport(os.environ['GENERATIVEPOETRY_FIXTURE'],
+                                 mode=os.environ.get('GENERATIVEPOETRY_FIXTURE_MODE', 'replay'), transport=transport)
+    lexical_cache = LexicalCache()
+elif os.environ.get('GENERATIVEPOETRY_GRAPH'):
+    load_relation_graph(os.environ['GENERATIVEPOETRY_GRAPH'])
 
 
 def rhymes(input_val: str_or_list_of_str, sample_size=None) -> List[str]:
@@ -19,7 +379,8 @@ def rhymes(input_val: str_or_list_of_str, sample_size=None) -> List[str]:
     input_words = validate_str_or_list_of_str(input_val)
     rhyme_words: List[str] = []
     for input_word in input_words:
-        rhyme_words.extend(filter_word_list([word for word in set(pronouncing.rhymes(input_word))]))
+        rhyme_words.extend(rhyme_index.rhymes(input_word))
+        record_tier('local')
     return extract_sample(rhyme_words, sample_size=sample_size)
 
 
@@ -29,35 +390,39 @@ def rhyme(input_word: str) -> Optional[str]:
 
     :param input_word: the word which this function is looking up a rhyme of
     """
-    rhyme_list = rhymes(input_word)
-    if len(rhyme_list):
-        return next(iter(rhyme_list), None)
-    return None
+    record_tier('local')
+    return rhyme_index.random_rhyme(input_word)
 
 
-def extract_sample(word_list: list, sample_size: Optional[int] = None) -> list:
-    """Returns a random sample from the word list or a shuffled copy of the word list.
+def is_rhymable(input_word: str) -> bool:
+    """Check whether at least one rhyme for a given word can be found using the pronouncing module (which uses the CMU
+    rhyming dictionary).
+
+    :param input_word: the word to check
+    """
+    return rhyme_index.is_rhymable(input_word)
+
+
+def extract_sample(word_list: list, sample_size: Optional[int] = None, weights: Optional[Mapping[str, float]] = None,
+                   rng: Optional[random.Random] = None) -> list:
+    """Returns a random sample of the distinct words in the word list, or all of them in random order.
 
     :param word_list: the list of words to extract the random sample from
-    :param sample_size: If this number is greater than the length of the word list, then just return a shuffled
-                        copy of the word list.
+    :param sample_size: If this number is greater than the number of distinct words, then just return a shuffled copy
+                        of the distinct words.
+    :param weights: If provided, a mapping from words to weights, such as Datamuse scores. Words with higher weights are
+                    more likely to be sampled and to come first; words missing from the mapping come last.
+    :param rng: the random number generator to use (default: the random module's)
     """
-    if not sample_size or len(word_list) <= sample_size:
-        return random.sample(word_list, k=len(word_list))
-    else:
-        sample: List[str] = []
-        while len(sample) < sample_size and len(word_list) > 0:
-            sample += [word for word in random.sample(word_list, k=sample_size) if word not in sample]
-            word_list = [word for word in word_list if word not in sample]
-        if sample_size < len(sample):
-            return random.sample(sample, k=sample_size)
-        return sample
+    if weights is not None:
+        return sampling.weighted_sample(((word, weights.get(word, 0)) for word in word_list), sample_size, rng=rng)
+    return sampling.sample(word_list, sample_size, rng=rng)
 
 
 def similar_sounding_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 6,
-                           datamuse_api_max: Optional[int] = 50) -> list:
+                           datamuse_api_max: Optional[int] = 50, weighted: bool = False) -> list:
     """Return a list of similar sounding words to a given word, in randomized order, if at least one can be found using
-    Datamuse API.
+    Datamuse API, or the phonetic index if it's loaded and has the word (see load_phonetic_index).
 
     :param input_val: the word or words in relation to which this function is looking up similar sounding words
     :param sample_size: If provided, return a random sample of this many elements. If this number is greater than the
@@ -66,14 +431,19 @@ def similar_sounding_words(input_val: str_or_list_of_str, sample_size: Optional[
                              are always sorted from most to least similar sounding (according to a numeric score
                              provided by Datamuse), hence by using both parameters, one can control the size of both
                              the sample pool and the sample size.
+    :param weighted: If true, words with higher Datamuse scores are more likely to be sampled and to come first.
     """
     input_words = validate_str_or_list_of_str(input_val)
+    prefetch(('sl', input_word, datamuse_api_max) for input_word in input_words)
     ss_words: List[str] = []
+    scores: Dict[str, float] = {}
     for input_word in input_words:
-        response = api.words(sl=input_word, max=datamuse_api_max) if datamuse_api_max else api.words(sl=input_word)
+        response = datamuse_lookup('sl', input_word, datamuse_api_max)
+        if weighted:
+            scores.update((obj['word'], obj.get('score', 0)) for obj in response)
         exclude_words = input_words + ss_words
         ss_words.extend(filter_word_list([obj['word'] for obj in response], exclude_words=exclude_words))
-    return extract_sample(ss_words, sample_size=sample_size)
+    return extract_sample(ss_words, sample_size=sample_size, weights=scores if weighted else None)
 
 
 def similar_sounding_word(input_word: str, datamuse_api_max: Optional[int] = 20) -> Optional[str]:
@@ -88,9 +458,9 @@ def similar_sounding_word(input_word: str, datamuse_api_max: Optional[int] = 20)
 
 
 def similar_meaning_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 6,
-                          datamuse_api_max: Optional[int] = 20) -> list:
+                          datamuse_api_max: Optional[int] = 20, weighted: bool = False) -> list:
     """Return a list of similar meaning words to a given word, in randomized order, if at least one can be found using
-    Datamuse API.
+    Datamuse API, or the word vectors if they're loaded and have the word (see load_word_vectors).
 
     :param input_val: the word or words in relation to which this function is looking up similar meaning words
     :param sample_size: If provided, return a random sample of this many elements. If this number is greater than the
@@ -99,15 +469,20 @@ def similar_meaning_words(input_val: str_or_list_of_str, sample_size: Optional[i
                              are always sorted from most to least similar meaning (according to a numeric score
                              provided by Datamuse), hence by using both parameters, one can control the size of both
                              the sample pool and the sample size.
+    :param weighted: If true, words with higher Datamuse scores are more likely to be sampled and to come first.
     """
     input_words = validate_str_or_list_of_str(input_val)
+    prefetch(('ml', input_word, datamuse_api_max) for input_word in input_words)
     sm_words: List[str] = []
+    scores: Dict[str, float] = {}
     for input_word in input_words:
-        response = api.words(ml=input_word, max=datamuse_api_max) if datamuse_api_max else api.words(ml=input_word)
+        response = datamuse_lookup('ml', input_word, datamuse_api_max)
+        if weighted:
+            scores.update((obj['word'], obj.get('score', 0)) for obj in response)
         exclude_words = sm_words.copy()
         sm_words.extend(filter_word_list([obj['word'] for obj in response], spellcheck=False,
                                          exclude_words=exclude_words))
-    return extract_sample(sm_words, sample_size=sample_size)
+    return extract_sample(sm_words, sample_size=sample_size, weights=scores if weighted else None)
 
 
 def similar_meaning_word(input_word: str, datamuse_api_max: Optional[int] = 10) -> Optional[str]:
@@ -122,9 +497,10 @@ def similar_meaning_word(input_word: str, datamuse_api_max: Optional[int] = 10)
 
 
 def contextually_linked_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 6,
-                              datamuse_api_max: Optional[int] = 20) -> list:
+                              datamuse_api_max: Optional[int] = 20, weighted: bool = False) -> list:
     """Return a list of words that frequently appear within the same document as a given word, in randomized order,
-    if at least one can be found using the Datamuse API.
+    if at least one can be found using the Datamuse API, or the co-occurrence index if one is loaded and has the word
+    (see load_cooccurrence_index).
 
     :param input_val: the word or words in relation to which this function is looking up contextually linked words
     :param sample_size: If provided, return a random sample of this many elements. If this number is greater than the
@@ -133,18 +509,23 @@ def contextually_linked_words(input_val: str_or_list_of_str, sample_size: Option
                              are always sorted from most to least frequently coappearing (according to a numeric score
                              provided by Datamuse), hence by using both parameters, one can control the size of both
                              the sample pool and the sample size.
+    :param weighted: If true, words with higher Datamuse scores are more likely to be sampled and to come first.
     """
     input_words = validate_str_or_list_of_str(input_val)
-    cl_words: List[str] = []
     for input_word in input_words:
         validate_word(input_word)
-        response = api.words(rel_trg=input_word, max=datamuse_api_max) if datamuse_api_max else \
-            api.words(rel_trg=input_word)
+    prefetch(('rel_trg', input_word, datamuse_api_max) for input_word in input_words)
+    cl_words: List[str] = []
+    scores: Dict[str, float] = {}
+    for input_word in input_words:
+        response = datamuse_lookup('rel_trg', input_word, datamuse_api_max)
+        if weighted:
+            scores.update((obj['word'], obj.get('score', 0)) for obj in response)
         exclude_words = cl_words.copy()
         # Spellcheck removes proper nouns so don't.
         cl_words.extend(filter_word_list([obj['word'] for obj in response], spellcheck=False,
                                          exclude_words=exclude_words))
-    return extract_sample(cl_words, sample_size=sample_size)
+    return extract_sample(cl_words, sample_size=sample_size, weights=scores if weighted else None)
 
 
 def contextually_linked_word(input_word: str, datamuse_api_max: Optional[int] = 10) -> Optional[str]:
@@ -162,7 +543,7 @@ def contextually_linked_word(input_word: str, datamuse_api_max: Optional[int] =
 def frequently_following_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 8,
                                datamuse_api_max: Optional[int] = None) -> list:
     """Return a list of words that frequently follow the given word, in randomized order, if at least one can be found
-    using the Datamuse API.
+    using the Datamuse API, or the bigram index if one is loaded and has the word (see load_bigram_index).
 
     :param input_val: the word or words in relation to which this function is looking up frequently following words
     :param sample_size: If provided, return a random sample of this many elements. If this number is greater than
@@ -174,9 +555,10 @@ def frequently_following_words(input_val: str_or_list_of_str, sample_size: Optio
                                   the size of both the sample pool and the sample size.
     """
     input_words = validate_str_or_list_of_str(input_val)
+    prefetch(('lc', input_word, datamuse_api_max) for input_word in input_words)
     ff_words: List[str] = []
     for input_word in input_words:
-        response = api.words(lc=input_word, max=datamuse_api_max) if datamuse_api_max else api.words(lc=input_word)
+        response = datamuse_lookup('lc', input_word, datamuse_api_max)
         # Filter but don't use spellcheck -- it removes important words (for the markov chain use case) like 'of'
         exclude_words = ff_words.copy()
         ff_words.extend(filter_word_list([obj['word'] for obj in response], spellcheck=False,
@@ -192,7 +574,7 @@ def frequently_following_words(input_val: str_or_list_of_str, sample_size: Optio
         else:
             ending_index = datamuse_api_max
         return extract_sample(ff_words[:ending_index], sample_size=sample_size - 3) + \
-            extract_sample(sort_by_rarity(ff_words)[:ending_index], sample_size=3)
+            extract_sample(frequency_table.rarest(ff_words, ending_index), sample_size=3)
     return extract_sample(ff_words, sample_size=sample_size)  # Standard sampling
 
 
@@ -222,6 +604,7 @@ def phonetically_related_words(input_val: str_or_list_of_str, sample_size=None,
     :Param max_results-per_input_word: limit the number of output words per input word. Useful for ensuring balance
     """
     input_words = validate_str_or_list_of_str(input_val)
+    prefetch(('sl', word, datamuse_api_max) for word in input_words)
     results: List[str] = []
     for word in input_words:
         results.extend(rhymes(word, sample_size=max_results_per_input_word))
@@ -233,6 +616,12 @@ def phonetically_related_words(input_val: str_or_list_of_str, sample_size=None,
     return results
 
 
+def related_rare_lookups(input_words: List[str]) -> List[lookup]:
+    """Return the Datamuse lookups related_rare_words performs for a list of words."""
+    return [(relation, input_word, datamuse_api_max) for input_word in input_words
+            for relation, datamuse_api_max in (('sl', 50), ('rel_trg', 100), ('ml', 100))]
+
+
 def related_rare_words(input_val: str_or_list_of_str, sample_size: Optional[int] = 8,
                        rare_word_population_max: int = 20) -> list:
     """Return a random sample of rare related words to a given word. The words can be related phonetically,
@@ -246,15 +635,15 @@ def related_rare_words(input_val: str_or_list_of_str, sample_size: Optional[int]
                                      null, the max results returned by this function is 2 times this number.
     """
     input_words = validate_str_or_list_of_str(input_val)
+    prefetch(related_rare_lookups(input_words))
     results: List[str] = []
     for input_word in input_words:
-        related_words = phonetically_related_words(input_word)
-        related_words.extend(word for word in contextually_linked_words(
-            input_word, sample_size=None, datamuse_api_max=100) if word not in related_words)
-        related_words.extend(word for word in similar_meaning_words(
-            input_word, sample_size=None, datamuse_api_max=100) if word not in related_words)
+        related_words = sampling.unique(itertools.chain(
+            phonetically_related_words(input_word),
+            contextually_linked_words(input_word, sample_size=None, datamuse_api_max=100),
+            similar_meaning_words(input_word, sample_size=None, datamuse_api_max=100)))
         related_words = [word for word in related_words if not too_similar(input_word, word)]
-        results.extend(sort_by_rarity(related_words)[:rare_word_population_max])
+        results.extend(frequency_table.rarest(related_words, rare_word_population_max))
     return extract_sample(results, sample_size=sample_size)
 
 
@@ -267,4 +656,127 @@ def related_rare_word(input_word: str, rare_word_population_max: int = 10) -> Op
                                     population is sorted from rarest to most common.
     """
     return next(iter(related_rare_words(input_word, sample_size=1,
-                                        rare_word_population_max=rare_word_population_max)), None)
\ No newline at end of file
+                                        rare_word_population_max=rare_word_population_max)), None)
+
+
+class WordQuery:
+    """Combined constraints on words, answered in one request or one local index query instead of by fetching a broad
+    list of words and rejecting most of them.
+
+    Each method returns a new query with one more constraint, so a partial query can be reused:
+
+        rhymes = WordQuery().max_length(8).min_frequency(1e-7).rhymes_with('moon')
+        rhymes.words()  # From the rhyme index, without a request
+        rhymes.means_like('night').topics('sky').words()  # One Datamuse request
+
+    Constraints on sound, meaning, and context go to Datamuse together, except that a query that only constrains the
+    rhyme is answered by the CMU rhyme index. Length, frequency, exclusions, having a rhyme, and fitting a meter are
+    checked locally, using the frequencies Datamuse returns with each word where possible.
+    """
+
+    def __init__(self):
+        self.constraints: Dict[str, str] = {}  # Datamuse query parameters
+        self.max_characters: Optional[int] = None
+        self.frequency_floor: Optional[float] = None
+        self.excluded_words: frozenset = frozenset()
+        self.must_be_rhymable = False
+        self.meter_slot: Optional[Tuple[Meter, int, bool]] = None  # (meter, position, ends_line), see fits_meter
+
+    def __repr__(self):
+        return f'WordQuery({self.constraints}, max_length={self.max_characters}, ' \
+               f'min_frequency={self.frequency_floor}, rhymable={self.must_be_rhymable}, meter_slot={self.meter_slot})'
+
+    def _with(self, **attributes) -> 'WordQuery':
+        query = copy.copy(self)
+        query.constraints = dict(self.constraints)
+        for name, value in attributes.items():
+            setattr(query, name, value)
+        return query
+
+    def _constrain(self, parameter: str, value: str) -> 'WordQuery':
+        for word in value.split(','):
+            validate_word(word)
+        query = self._with()
+        query.constraints[parameter] = value
+        return query
+
+    def sounds_like(self, word: str) -> 'WordQuery':
+        return self._constrain('sl', word)
+
+    def means_like(self, word: str) -> 'WordQuery':
+        return self._constrain('ml', word)
+
+    def rhymes_with(self, word: str) -> 'WordQuery':
+        return self._constrain('rel_rhy', word)
+
+    def triggered_by(self, word: str) -> 'WordQuery':
+        """Words that are statistically associated with the word, as in contextually_linked_words."""
+        return self._constrain('rel_trg', word)
+
+    def follows(self, word: str) -> 'WordQuery':
+        """Words that often follow the word, as in frequently_following_words."""
+        return self._constrain('lc', word)
+
+    def topics(self, *words: str) -> 'WordQuery':
+        """Hint at the theme the words should fit (Datamuse uses up to five topic words). A query can't have topics
+        alone."""
+        return self._constrain('topics', ','.join(words[:5]))
+
+    def max_length(self, characters: Optional[int]) -> 'WordQuery':
+        return self._with(max_characters=characters)
+
+    def min_frequency(self, frequency: Optional[float]) -> 'WordQuery':
+        """Only words at least this frequent, as a fraction of all words (see FrequencyTable.frequency)."""
+        return self._with(frequency_floor=frequency)
+
+    def excluding(self, words: Iterable[str]) -> 'WordQuery':
+        return self._with(excluded_words=self.excluded_words.union(words))
+
+    def rhymable(self) -> 'WordQuery':
+        """Only words that have a rhyme, for ending a line another line can rhyme with."""
+        return self._with(must_be_rhymable=True)
+
+    def fits_meter(self, meter: Meter, position: int = 0, ends_line: bool = False) -> 'WordQuery':
+        """Only words whose stress pattern fits a meter from the given syllable on (see StressIndex.advance).
+
+        :param meter: the meter of the line
+        :param position: the syllable of the meter the word would start on (the first is 0)
+        :param ends_line: if true, the word has to fill the rest of the line; otherwise, it has to leave at least a
+                          syllable of it
+        """
+        return self._with(meter_slot=(meter, position, ends_line))
+
+    def matches(self, word: str) -> bool:
+        """Check a word against the constraints that are checked locally.
+
+        :param word: the word to check
+        """
+        if word in self.excluded_words or (self.max_characters and len(word) > self.max_characters):
+            return False
+        if self.frequency_floor is not None and frequency_table.frequency(word) < self.frequency_floor:
+            return False
+        if self.meter_slot is not None and not stress_index.fits(word, *self.meter_slot):
+            return False
+        return not (self.must_be_rhymable and not is_rhymable(word))
+
+    def words(self, datamuse_api_max: Optional[int] = None) -> List[str]:
+        """Return the words that meet every constraint, most relevant first (rhymes from the index are in dictionary
+        order).
+
+        :param datamuse_api_max: the maximum number of results requested from Datamuse
+        """
+        if not self.constraints:
+            raise ValueError('A word query needs a constraint on sound, meaning, or context')
+        if list(self.constraints) == ['rel_rhy']:
+            record_tier('local')
+            return [word for word in rhyme_index.rhymes(self.constraints['rel_rhy']) if self.matches(word)]
+        if list(self.constraints) == ['topics']:
+            raise ValueError('Topics are only a hint, so a word query needs another constraint as well')
+        return [obj['word'] for obj in datamuse_query(self.constraints, datamuse_api_max) if self.matches(obj['word'])]
+
+    def word(self, datamuse_api_max: Optional[int] = None) -> Optional[str]:
+        """Return a random word that meets every constraint, or None if there's none.
+
+        :param datamuse_api_max: the maximum number of results requested from Datamuse
+        """
+        return next(iter(extract_sample(self.words(datamuse_api_max), sample_size=1)), None)
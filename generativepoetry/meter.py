@@ -0,0 +1,193 @@
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+import pronouncing
+from .frequency import wordfreq
+
+
+class Meter:
+    """The pattern of stressed and unstressed syllables a line follows, written as a string with a character per
+    syllable: 1 for stressed, 0 for unstressed, and x for either, so '01' * 5 is iambic pentameter and 'x' * 7 is the
+    middle line of a haiku.
+
+    The pattern is also kept as two bitmasks, with a bit per syllable (the first syllable is the lowest bit): the
+    stressed syllables and the syllables that can be either. Fitting a word to the meter compares these to the word's
+    own masks.
+    """
+
+    def __init__(self, pattern: str, name: Optional[str] = None):
+        """
+        :param pattern: the pattern, e.g. '0101010101'
+        :param name: what to call the meter (default: the pattern)
+        """
+        if not pattern or set(pattern) - set('01x'):
+            raise ValueError('A meter is a pattern of 1s (stressed), 0s (unstressed) and xs (either)')
+        self.pattern = pattern
+        self.name = name or pattern
+        self.stressed = sum(1 << i for i, syllable in enumerate(pattern) if syllable == '1')
+        self.free = sum(1 << i for i, syllable in enumerate(pattern) if syllable == 'x')
+
+    def __len__(self):
+        """The number of syllables in a line."""
+        return len(self.pattern)
+
+    def __repr__(self):
+        return f'Meter({self.name})'
+
+    @classmethod
+    def syllables(cls, count: int) -> 'Meter':
+        """A meter that only counts syllables, e.g. Meter.syllables(5) for the first line of a haiku."""
+        return cls('x' * count, f'{count} syllables')
+
+
+meters = {name: Meter(pattern, name) for name, pattern in (
+    ('iambic pentameter', '01' * 5), ('iambic tetrameter', '01' * 4), ('trochaic tetrameter', '10' * 4),
+    ('anapestic tetrameter', '001' * 4), ('dactylic trimeter', '100' * 3))}
+# Forms whose lines follow different meters, one after another
+forms = {'haiku': (Meter.syllables(5), Meter.syllables(7), Meter.syllables(5))}
+
+
+class StressIndex:
+    """An index of the syllable counts and stress patterns of the words in the CMU pronouncing dictionary, for fitting
+    words to a meter with a few integer operations instead of parsing their pronunciations every time.
+
+    Each pronunciation is stored as a syllable count and two bitmasks, like a Meter's: the stressed syllables, and the
+    syllables that can go either way, which are those with secondary stress and the only syllable of a one syllable
+    word (since "the" and "night" both take either position in a line). A word's pronunciations sit in one run of the
+    syllables, stressed and flexible arrays, and the offsets array says where each word's run starts.
+
+    The index is built on first use.
+    """
+
+    def __init__(self, frequent_words: int = 20000):
+        """
+        :param frequent_words: how many of the most frequent English words frequent_words_fitting picks from
+        """
+        self.words: List[str] = []  # Word ids index into this list
+        self.word_ids: Dict[str, int] = {}
+        self.offsets = array('l', [0])  # Word id -> start of its run; the next word's offset is the end
+        self.syllables = array('B')
+        self.stressed = array('I')
+        self.flexible = array('I')
+        self.frequent_words = frequent_words
+        self._frequent_ids: Optional[array] = None  # Ids of the most frequent words, most frequent first
+        self._fitting: Dict[Tuple[str, int, bool], Tuple[str, ...]] = {}  # Slot -> frequent words that fit it
+        self._lock = threading.Lock()
+        self._built = False
+
+    def __len__(self):
+        self.build()
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        self.build()
+        return word in self.word_ids
+
+    def build(self):
+        """Read the CMU dictionary into the index, if that hasn't happened yet. Words with characters other than
+        letters are left out."""
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            pronouncing.init_cmu()
+            patterns: Dict[str, List[Tuple[int, int, int]]] = {}
+            for word, phones in pronouncing.pronunciations:
+                if not word.isalpha():
+                    continue
+                stresses = pronouncing.stresses(phones)
+                if len(stresses) == 1:
+                    pattern = (1, 0, 1)
+                else:
+                    pattern = (len(stresses), sum(1 << i for i, stress in enumerate(stresses) if stress == '1'),
+                               sum(1 << i for i, stress in enumerate(stresses) if stress == '2'))
+                if stresses and pattern not in patterns.setdefault(word, []):
+                    patterns[word].append(pattern)
+            for word, word_patterns in patterns.items():
+                if not word_patterns:
+                    continue
+                self.word_ids[word] = len(self.words)
+                self.words.append(word)
+                for syllables, stressed, flexible in word_patterns:
+                    self.syllables.append(syllables)
+                    self.stressed.append(stressed)
+                    self.flexible.append(flexible)
+                self.offsets.append(len(self.syllables))
+            self._built = True
+
+    def syllable_count(self, word: str) -> Optional[int]:
+        """Return the number of syllables in a word's first pronunciation, or None if the word isn't in the dictionary.
+
+        :param word: the word to look up
+        """
+        self.build()
+        word_id = self.word_ids.get(word.lower())
+        return self.syllables[self.offsets[word_id]] if word_id is not None else None
+
+    def stress_patterns(self, word: str) -> List[str]:
+        """Return the stress patterns of a word's pronunciations, written like a Meter's, e.g. ['10'] for 'poem' and
+        ['x'] for 'night'.
+
+        :param word: the word to look up
+        """
+        self.build()
+        word_id = self.word_ids.get(word.lower())
+        if word_id is None:
+            return []
+        return [''.join('x' if self.flexible[i] >> syllable & 1 else str(self.stressed[i] >> syllable & 1)
+                        for syllable in range(self.syllables[i]))
+                for i in range(self.offsets[word_id], self.offsets[word_id + 1])]
+
+    def _advance(self, word_id: int, meter: Meter, position: int, ends_line: bool) -> Optional[int]:
+        remaining = len(meter) - position
+        for i in range(self.offsets[word_id], self.offsets[word_id + 1]):
+            syllables = self.syllables[i]
+            if syllables > remaining or (ends_line and syllables < remaining) or \
+                    (not ends_line and syllables == remaining):
+                continue
+            # The syllables where the word's stress and the meter's differ, and neither can go either way
+            clashes = (self.stressed[i] ^ meter.stressed >> position) & ~(self.flexible[i] | meter.free >> position)
+            if not clashes & ((1 << syllables) - 1):
+                return position + syllables
+        return None
+
+    def advance(self, word: str, meter: Meter, position: int = 0, ends_line: bool = False) -> Optional[int]:
+        """Return the syllable of a meter the line is at after a word, if the word fits the meter from the given
+        syllable on, using the first of its pronunciations that fits. Otherwise, or if the word isn't in the
+        dictionary, return None.
+
+        :param word: the word to fit
+        :param meter: the meter of the line
+        :param position: the syllable of the meter the word would start on (the first is 0)
+        :param ends_line: if true, the word has to fill the rest of the line; otherwise, it has to leave at least a
+                          syllable of it
+        """
+        self.build()
+        word_id = self.word_ids.get(word.lower())
+        return self._advance(word_id, meter, position, ends_line) if word_id is not None else None
+
+    def fits(self, word: str, meter: Meter, position: int = 0, ends_line: bool = False) -> bool:
+        """Check whether a word fits a meter from the given syllable on (see advance)."""
+        return self.advance(word, meter, position, ends_line) is not None
+
+    def frequent_words_fitting(self, meter: Meter, position: int = 0, ends_line: bool = False) -> Tuple[str, ...]:
+        """Return the most frequent English words that fit a meter from the given syllable on (see advance), most
+        frequent first. The words for each syllable are found once and kept.
+
+        :param meter: the meter of the line
+        :param position: the syllable of the meter the word would start on
+        :param ends_line: if true, the words have to fill the rest of the line; otherwise, they have to leave at least
+                          a syllable of it
+        """
+        key = (meter.pattern, position, ends_line)
+        words = self._fitting.get(key)
+        if words is None:
+            self.build()
+            if self._frequent_ids is None:
+                frequent_ids = (self.word_ids.get(word) for word in wordfreq.top_n_list('en', self.frequent_words))
+                self._frequent_ids = array('i', (word_id for word_id in frequent_ids if word_id is not None))
+            words = tuple(self.words[word_id] for word_id in self._frequent_ids
+                          if self._advance(word_id, meter, position, ends_line) is not None)
+            self._fitting[key] = words
+        return words
@@ -8,18 +8,20 @@ from generativepoetry.poemgen import *
 from reportlab.pdfbase.pdfmetrics import registerFont, registerFontFamily
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.pagesizes import letter, landscape
-from nltk.corpus import stopwords
-from pdf2image import convert_from_path, convert_from_bytes
-from pdf2image.exceptions import (
-    PDFInfoNotInstalledError,
-    PDFPageCountError,
-    PDFSyntaxError
-)
+from .resources import LazyResource
 from .utils import filter_word_list
 
 rgb_tuple = Tuple[float]
 
 
+def load_stopwords() -> List[str]:
+    from nltk.corpus import stopwords
+    return stopwords.words('english')
+
+
+english_stopwords = LazyResource(load_stopwords, name='NLTK stopwords')
+
+
 class VisualPoemString():
     """The text drawn by reportlab at an XY coordinate--can be a line, a word, or just a character."""
 
@@ -51,6 +53,7 @@ class PDFGenerator:
         registerFont(TTFont('VeraBI', 'VeraBI.ttf'))
         self.orientation = 'landscape'
         self.drawn_strings: List[VisualPoemString] = []
+        self.tier_report: Optional[TierReport] = None  # Which tiers answered the last poem's lookups
 
     def get_font_size(self, line):
         if len(line) > 30:
@@ -79,6 +82,7 @@ class PDFGenerator:
         return filename
 
     def generate_png(self, input_filepath=None):
+        from pdf2image import convert_from_path  # Only needed here, and slow to import
         pages = convert_from_path(input_filepath)
         for page in pages:
             page.save(f'{input_filepath[:-3]}png', 'PNG')
@@ -86,10 +90,13 @@ class PDFGenerator:
 
 class ChaoticConcretePoemPDFGenerator(PDFGenerator):
 
-    def generate_pdf(self, input_words: Optional[List[str]] = [], max_words=Optional[int]):
+    def generate_pdf(self, input_words: Optional[List[str]] = [], max_words=Optional[int],
+                     latency_budget_ms: Optional[float] = None):
         self.drawn_strings = []
         input_words = get_input_words() if not len(input_words) else input_words
-        output_words = input_words + phonetically_related_words(input_words)
+        with latency_budget(latency_budget_ms) as budget:
+            output_words = input_words + phonetically_related_words(input_words)
+        self.tier_report = budget.report
         random.shuffle(output_words)
         filename = self.set_filename(input_words)
         c = canvas.Canvas(filename)
@@ -138,7 +145,7 @@ class StopwordSoupPoemPDFGenerator(PDFGenerator):
     def generate_pdf(self):
         c = canvas.Canvas("stopword_soup.pdf")
         punctuation = [char for char in string.punctuation]
-        words_to_use = filter_word_list(stopwords.words('english')) + punctuation  # filter removes 1/2s of contractions
+        words_to_use = filter_word_list(english_stopwords.load()) + punctuation  # filter removes 1/2s of contractions
         for word in ['him', 'her', 'his', 'they', 'won']:
             words_to_use.remove(word)
         for i in range(3):
@@ -163,7 +170,8 @@ class StopwordSoupPoemPDFGenerator(PDFGenerator):
 class MarkovPoemPDFGenerator(PDFGenerator):
     default_font_sizes = [15, 18, 21, 24, 28]
 
-    def generate_pdf(self, input_words: Optional[List[str]] = [], orientation: string = 'landscape'):
+    def generate_pdf(self, input_words: Optional[List[str]] = [], orientation: string = 'landscape',
+                     latency_budget_ms: Optional[float] = None):
         self.drawn_strings = []
         self.orientation = orientation
         if self.orientation.lower() == 'landscape':
@@ -185,7 +193,9 @@ class MarkovPoemPDFGenerator(PDFGenerator):
         input_words = get_input_words() if not len(input_words) else input_words
         poemgen = PoemGenerator()
         poem = poemgen.poem_from_markov(input_words=input_words, min_line_words=min_line_words, num_lines=num_lines,
-                                        max_line_words=max_line_words, max_line_length=max_line_length)
+                                        max_line_words=max_line_words, max_line_length=max_line_length,
+                                        latency_budget_ms=latency_budget_ms)
+        self.tier_report = poem.tier_report
         font_choice, last_font_choice = None, None
         filename = self.set_filename(input_words)
         if orientation == 'landscape':
@@ -213,10 +223,12 @@ class FuturistPoemPDFGenerator(PDFGenerator):
     connectors = [' + ', ' - ', ' * ', ' % ', ' = ', ' != ', ' :: ']
     default_font_sizes = [15, 18, 21, 24, 28]
 
-    def generate_pdf(self, input_words: Optional[List[str]] = [],):
+    def generate_pdf(self, input_words: Optional[List[str]] = [], latency_budget_ms: Optional[float] = None):
         self.drawn_strings = []
         input_words = get_input_words() if not len(input_words) else input_words
-        word_list = input_words + phonetically_related_words(input_words)
+        with latency_budget(latency_budget_ms) as budget:
+            word_list = input_words + phonetically_related_words(input_words)
+        self.tier_report = budget.report
         poem_lines = []
         pgen = PoemGenerator()
         for i in range(25):
@@ -0,0 +1,286 @@
+import multiprocessing
+import os
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import pronouncing
+from .frequency import frequency_table
+
+# The ARPAbet phonemes the CMU dictionary uses, grouped by manner of articulation. Phonemes are encoded as their index
+# in this order, so a pronunciation is a bytes object of phoneme ids.
+phoneme_classes = {
+    'vowel': ('AA', 'AE', 'AH', 'AO', 'AW', 'AY', 'EH', 'ER', 'EY', 'IH', 'IY', 'OW', 'OY', 'UH', 'UW'),
+    'stop': ('P', 'B', 'T', 'D', 'K', 'G'),
+    'affricate': ('CH', 'JH'),
+    'fricative': ('F', 'V', 'TH', 'DH', 'S', 'Z', 'SH', 'ZH', 'HH'),
+    'nasal': ('M', 'N', 'NG'),
+    'liquid': ('L', 'R'),
+    'glide': ('W', 'Y'),
+}
+phonemes = [phoneme for members in phoneme_classes.values() for phoneme in members]
+phoneme_ids = {phoneme: phoneme_id for phoneme_id, phoneme in enumerate(phonemes)}
+# For bytes.translate: phoneme id -> class id
+class_table = bytes(class_id for class_id, members in enumerate(phoneme_classes.values()) for _ in members).ljust(256)
+
+# Edit costs. Every operation but swapping a phoneme for another of its class costs 2, which is what lets the index
+# find every neighbor within a distance from deletion variants alone (see PhoneticIndex).
+similar_substitution_cost = 1
+substitution_cost = 2
+insertion_cost = 2
+_substitution_costs = [[0 if a == b else similar_substitution_cost if class_table[a] == class_table[b]
+                        else substitution_cost for b in range(len(phonemes))] for a in range(len(phonemes))]
+
+parallel_threshold = 64  # The fewest words neighbors_many searches for in a process pool
+_worker_index: Optional['PhoneticIndex'] = None  # In a worker process, its own copy of the index it searches
+
+
+def encode(phones: str) -> Optional[bytes]:
+    """Encode a pronunciation from the CMU dictionary, e.g. 'M AE1 JH IH0 K', as phoneme ids, ignoring stress. Return
+    None if it has a symbol that isn't an ARPAbet phoneme.
+
+    :param phones: the pronunciation, as pronouncing returns it
+    """
+    try:
+        return bytes(phoneme_ids[phone.rstrip('012')] for phone in phones.split())
+    except KeyError:
+        return None
+
+
+def distance(a: bytes, b: bytes, bound: Optional[int] = None) -> int:
+    """Return the weighted edit distance between two encoded pronunciations: substituting a phoneme with one of the
+    same class (e.g. P for B, or one vowel for another) costs 1, and any other substitution, insertion or deletion 2.
+
+    :param a: an encoded pronunciation
+    :param b: another
+    :param bound: if given, only work out distances up to this, and return bound + 1 for any greater distance
+    """
+    # With a bound, an alignment can only stray bound // insertion_cost phonemes off the diagonal
+    band = max(len(a), len(b)) if bound is None else bound // insertion_cost
+    if abs(len(a) - len(b)) > band:
+        return bound + 1
+    if bound is not None and len(a) == len(b) and band < 2:
+        # An insertion would take a deletion to make up for, which the bound doesn't leave room for
+        total = sum(_substitution_costs[phoneme][other] for phoneme, other in zip(a, b))
+        return total if total <= bound else bound + 1
+    too_far = insertion_cost * (len(a) + len(b)) + 1
+    previous = [insertion_cost * j if j <= band else too_far for j in range(len(b) + 1)]
+    for i, phoneme in enumerate(a, 1):
+        costs = _substitution_costs[phoneme]
+        first, last = max(1, i - band), min(len(b), i + band)
+        current = [too_far] * (len(b) + 1)
+        if i <= band:
+            current[0] = insertion_cost * i
+        for j in range(first, last + 1):
+            current[j] = min(previous[j] + insertion_cost, current[j - 1] + insertion_cost,
+                             previous[j - 1] + costs[b[j - 1]])
+        if bound is not None and min(current[first - 1:last + 1]) > bound:
+            return bound + 1
+        previous = current
+    return previous[-1] if bound is None or previous[-1] <= bound else bound + 1
+
+
+def deletion_variants(sequence: bytes, deletions: int) -> Set[bytes]:
+    """Return a sequence and every sequence made by deleting up to the given number of its elements."""
+    variants = {sequence}
+    frontier = variants
+    for _ in range(deletions):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+class PhoneticIndex:
+    """An index of the CMU pronouncing dictionary for finding similar sounding words (Datamuse's sl) locally, by
+    weighted phoneme edit distance (see distance).
+
+    Each pronunciation is indexed by its sequence of phoneme classes and by the sequences made by deleting up to
+    max_distance // 2 classes from it. Swapping a phoneme for another of its class doesn't change the class sequence,
+    and every other edit costs 2, so two pronunciations within max_distance of each other always share one of these
+    keys: a query collects the pronunciations under its own keys and computes the exact distance to each, instead of
+    to the whole dictionary. (A BK-tree over the same distance takes several times as long to build and visits tens of
+    thousands of nodes per query, since a weighted distance this small splits the dictionary into few branches.)
+
+    The index is built on first use. The neighbors of a word are kept once found, and those of many words can be found
+    on several cores at once (see neighbors_many).
+    """
+
+    def __init__(self, max_distance: int = 3, pronunciations: Optional[Iterable[Tuple[str, str]]] = None):
+        """
+        :param max_distance: the greatest distance a query can ask for
+        :param pronunciations: (word, pronunciation) pairs to index instead of the CMU dictionary's, with
+                               pronunciations in its format
+        """
+        self.max_distance = max_distance
+        # Kept as a list, since worker processes are sent them to build their own copies of the index
+        self.pronunciations = list(pronunciations) if pronunciations is not None else None
+        self.sequences: List[bytes] = []  # Sequence ids index into this list
+        self.sequence_words: List[List[str]] = []  # Sequence id -> the words pronounced that way
+        self.word_sequences: Dict[str, Tuple[int, ...]] = {}  # Word -> ids of its pronunciations
+        self.keys: Dict[bytes, object] = {}  # Class sequence -> a sequence id, or an array of them
+        self._neighbors: Dict[str, List[Tuple[str, int]]] = {}  # Word -> all its neighbors within max_distance
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_processes = 0
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._built = False
+
+    def __len__(self):
+        """The number of distinct pronunciations."""
+        self.build()
+        return len(self.sequences)
+
+    def __contains__(self, word: str) -> bool:
+        self.build()
+        return word in self.word_sequences
+
+    def build(self):
+        """Read the CMU dictionary (or the pronunciations given) into the index, if that hasn't happened yet. Words with
+        characters other than letters are left out."""
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            pronunciations = self.pronunciations
+            if pronunciations is None:
+                pronouncing.init_cmu()
+                pronunciations = pronouncing.pronunciations
+            self._add(pronunciations)
+            self._built = True
+
+    def _add(self, pronunciations: Iterable[Tuple[str, str]]):
+        sequence_ids: Dict[bytes, int] = {}
+        deletions = self.max_distance // min(substitution_cost, insertion_cost)
+        for word, phones in pronunciations:
+            sequence = encode(phones) if word.isalpha() else None
+            if not sequence:
+                continue
+            sequence_id = sequence_ids.get(sequence)
+            if sequence_id is None:
+                sequence_id = sequence_ids[sequence] = len(self.sequences)
+                self.sequences.append(sequence)
+                self.sequence_words.append([])
+                for key in deletion_variants(sequence.translate(class_table), deletions):
+                    entry = self.keys.get(key)
+                    if entry is None:
+                        self.keys[key] = sequence_id
+                    elif isinstance(entry, int):
+                        self.keys[key] = array('i', (entry, sequence_id))
+                    else:
+                        entry.append(sequence_id)
+            if word not in self.sequence_words[sequence_id]:
+                self.sequence_words[sequence_id].append(word)
+                self.word_sequences[word] = self.word_sequences.get(word, ()) + (sequence_id,)
+
+    def _search(self, word: str) -> List[Tuple[str, int]]:
+        # Every word within max_distance of any of the word's pronunciations, nearest and then most frequent first
+        deletions = self.max_distance // min(substitution_cost, insertion_cost)
+        distances: Dict[int, int] = {}
+        for sequence_id in self.word_sequences.get(word, ()):
+            sequence = self.sequences[sequence_id]
+            candidates: Set[int] = set()
+            for key in deletion_variants(sequence.translate(class_table), deletions):
+                entry = self.keys.get(key)
+                if isinstance(entry, int):
+                    candidates.add(entry)
+                elif entry is not None:
+                    candidates.update(entry)
+            for candidate in candidates:
+                candidate_distance = distance(sequence, self.sequences[candidate], bound=self.max_distance)
+                if candidate_distance <= min(self.max_distance, distances.get(candidate, self.max_distance)):
+                    distances[candidate] = candidate_distance
+        neighbors: Dict[str, int] = {}
+        for sequence_id, sequence_distance in distances.items():
+            for neighbor in self.sequence_words[sequence_id]:
+                if neighbor != word and sequence_distance < neighbors.get(neighbor, self.max_distance + 1):
+                    neighbors[neighbor] = sequence_distance
+        return sorted(neighbors.items(), key=lambda item: (item[1], -frequency_table.frequency(item[0]), item[0]))
+
+    def neighbors(self, word: str, limit: Optional[int] = None,
+                  max_distance: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Return the words that sound like a word, nearest first and, among those equally near, most frequent first,
+        with their distances. A word with several pronunciations is as near as its nearest one.
+
+        :param word: the word to look up
+        :param limit: the most words to return
+        :param max_distance: the greatest distance to return words at (default: the index's max_distance)
+        """
+        return self.neighbors_many([word], limit, max_distance).get(word, [])
+
+    def neighbors_many(self, words: Iterable[str], limit: Optional[int] = None, max_distance: Optional[int] = None,
+                       processes: Optional[int] = None) -> Dict[str, List[Tuple[str, int]]]:
+        """Return the words that sound like each of several words (see neighbors). Words that aren't in the dictionary
+        are left out. When there are enough words whose neighbors haven't been found yet, they're searched for by a
+        pool of processes (see pool).
+
+        :param words: the words to look up
+        :param limit: the most words to return per word
+        :param max_distance: the greatest distance to return words at (default: the index's max_distance)
+        :param processes: how many processes to search with (default: one per core); 1 searches in this process
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        if max_distance > self.max_distance:
+            raise ValueError(f'The index only finds words up to a distance of {self.max_distance}')
+        self.build()
+        words = [word for word in dict.fromkeys(words) if word in self.word_sequences]
+        missing = [word for word in words if word not in self._neighbors]
+        processes = processes or os.cpu_count() or 1
+        if processes > 1 and len(missing) >= parallel_threshold:
+            found = list(self.pool(processes).map(_search, missing,
+                                                  chunksize=max(1, len(missing) // (4 * processes))))
+        else:
+            found = [self._search(word) for word in missing]
+        with self._lock:
+            self._neighbors.update(zip(missing, found))
+        results = {}
+        for word in words:
+            neighbors = self._neighbors[word]
+            if max_distance < self.max_distance:
+                neighbors = [(neighbor, d) for neighbor, d in neighbors if d <= max_distance]
+            results[word] = neighbors[:limit] if limit is not None else neighbors
+        return results
+
+    def pool(self, processes: int) -> ProcessPoolExecutor:
+        """Return the pool of processes that neighbors_many searches in, starting it if it isn't running with the given
+        number of processes. The pool is kept until close is called, since each of its processes builds its own copy of
+        the index when it starts.
+
+        The processes are started by a fork server (or spawned, where there isn't one) rather than forked from this
+        process: lookups run on threads, and a child forked while one of them holds a lock would wait on it forever.
+
+        :param processes: how many processes to search with
+        """
+        with self._pool_lock:
+            if self._pool is None or self._pool_processes != processes:
+                if self._pool is not None:
+                    self._pool.shutdown()
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(start_method),
+                                                 initializer=_start_worker,
+                                                 initargs=(self.max_distance, self.pronunciations))
+                self._pool_processes = processes
+            return self._pool
+
+    def close(self):
+        """Stop the pool of processes neighbors_many searches in, if it's running."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool, self._pool_processes = None, 0
+
+    @property
+    def stats(self) -> dict:
+        self.build()
+        return {'words': len(self.word_sequences), 'pronunciations': len(self.sequences), 'keys': len(self.keys),
+                'cached': len(self._neighbors), 'processes': self._pool_processes}
+
+
+def _start_worker(max_distance: int, pronunciations: Optional[List[Tuple[str, str]]]):
+    global _worker_index
+    _worker_index = PhoneticIndex(max_distance=max_distance, pronunciations=pronunciations)
+    _worker_index.build()
+
+
+def _search(word: str) -> List[Tuple[str, int]]:
+    return _worker_index._search(word)
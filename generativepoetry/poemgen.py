@@ -1,15 +1,21 @@
-import itertools
-from typing import List, Optional
+import time
+from typing import List, Optional, Sequence, Union
 from .lexigen import *
 from .jolastic import StochasticJolasticWordGenerator
-from .utils import too_similar
+from .lattice import CandidateLattice
+from .meter import Meter, forms, meters
+from .providers import TierReport, current_budget, latency_budget
+from . import sampling
+from .utils import remove_too_similar, too_similar
 
 
 class Poem:
 
-    def __init__(self, input_words, words_for_sampling):
+    def __init__(self, input_words, words_for_sampling, lattice: Optional[CandidateLattice] = None):
         self.input_words = input_words
         self.words_for_sampling = words_for_sampling
+        self.lattice = lattice
+        self.tier_report: Optional[TierReport] = None  # Which tiers answered the poem's lookups, if it was generated
         self.title = "'".join(input_words)
         self.lines: List[str] = []
 
@@ -37,7 +43,9 @@ class PoemGenerator:
 
 
     def poem_line_from_markov(self, starting_word: str, num_words: int = 4, rhyme_with: Optional[str] = None,
-                              words_for_sampling: List[str] = [], max_line_length: Optional[int] = 35) -> str:
+                              words_for_sampling: List[str] = [], max_line_length: Optional[int] = 35,
+                              prefetch: bool = False, line_timeout: Optional[float] = None,
+                              lattice: Optional[CandidateLattice] = None) -> str:
         """Generate a line of poetry using a markov chain that optionally tries to make a line rhyme with the last one
 
         Different algorithms handle the last word and all the other words: both algorithms use a mix of random
@@ -51,26 +59,98 @@ class PoemGenerator:
                                    phonetically related words to the starting word probably adds some sonority.
         :param max_line_length: an upper limit in characters for the line -- important for PDF generation to keep
                                 everything on the page.
+        :param prefetch: look up candidates for each next word in the background while the current one is chosen
+        :param line_timeout: roughly the most seconds the line may take; once they're up, the remaining words are
+                             picked without lookups (from words_for_sampling or the common words)
+        :param lattice: a CandidateLattice planned for the poem, to pick words from without lookups where it can
         """
         output_words, previous_word = [starting_word], starting_word
-        markovgen = StochasticJolasticWordGenerator(previous_lines=self.poem.lines)
+        deadline = self._line_deadline(line_timeout)
+        markovgen = StochasticJolasticWordGenerator(previous_lines=self.poem.lines, prefetch=prefetch, lattice=lattice)
+        markovgen.prefetch_next_word_lookups(starting_word)
         for i in range(num_words - 1):
             if (i == num_words - 2) or (max_line_length and (max_line_length > 14 and
                                                              len(' '.join(output_words)) >= max_line_length - 14)):
                 # Checks if if it's the last word--the limit can be determined by either word count or character count
                 max_word_length = 12 if max_line_length else None
                 word = markovgen.last_word_of_markov_line(output_words, rhyme_with=rhyme_with,
-                                                          max_length=max_word_length)
+                                                          max_length=max_word_length,
+                                                          words_for_sampling=words_for_sampling, deadline=deadline)
                 output_words.append(word)
                 break
             else:
-                word = markovgen.nonlast_word_of_markov_line(output_words, words_for_sampling=words_for_sampling)
+                word = markovgen.nonlast_word_of_markov_line(output_words, words_for_sampling=words_for_sampling,
+                                                             deadline=deadline)
+                markovgen.prefetch_next_word_lookups(word)
                 output_words.append(word)
         correct_a_vs_an(output_words)
         return " ".join(output_words)
 
+    @staticmethod
+    def _line_deadline(line_timeout: Optional[float]) -> Optional[float]:
+        # When a line has to be done by: line_timeout seconds from now, or the latency budget's deadline if sooner
+        deadline = time.monotonic() + line_timeout if line_timeout is not None else None
+        budget = current_budget()
+        if budget is not None and budget.deadline is not None:
+            deadline = min(deadline, budget.deadline) if deadline is not None else budget.deadline
+        return deadline
+
+    def metered_line_from_markov(self, starting_word: str, meter: Meter, rhyme_with: Optional[str] = None,
+                                 words_for_sampling: List[str] = [], prefetch: bool = False,
+                                 line_timeout: Optional[float] = None,
+                                 lattice: Optional[CandidateLattice] = None) -> str:
+        """Generate a line of poetry in a meter using a markov chain that optionally tries to make a line rhyme with
+        the last one.
+
+        Words are picked the way poem_line_from_markov picks them, except that each is constrained to fit the meter
+        from the syllable the line is at (see WordQuery.fits_meter), so candidates that don't fit are pruned with stress
+        index lookups instead of being tried. The line ends when the meter's syllables run out, rather than after a
+        number of words or characters.
+
+        :param starting_word: the input word for the Markov algorithm, which hence is also the poem line's first word.
+                              It has to fit the start of the meter.
+        :param meter: the meter of the line, e.g. meters['iambic pentameter'] or Meter.syllables(7)
+        :param rhyme_with: an optional word to try to make the poem line rhyme with
+        :param words_for_sampling: a list of other words to throw in to the poem
+        :param prefetch: look up candidates for each next word in the background while the current one is chosen
+        :param line_timeout: roughly the most seconds the line may take
+        :param lattice: a CandidateLattice planned for the poem, to pick words from without lookups where it can
+        """
+        position = stress_index.advance(starting_word, meter)
+        if position is None:
+            raise ValueError(f"'{starting_word}' doesn't fit the start of {meter.name}")
+        output_words = [starting_word]
+        deadline = self._line_deadline(line_timeout)
+        markovgen = StochasticJolasticWordGenerator(previous_lines=self.poem.lines, prefetch=prefetch, lattice=lattice)
+        markovgen.prefetch_next_word_lookups(starting_word)
+        while position < len(meter):
+            # The last word takes the last syllable or two, if there are frequent words that can end the line there
+            ends_line = len(meter) - position <= 2 and \
+                bool(stress_index.frequent_words_fitting(meter, position, ends_line=True))
+            slot = WordQuery().fits_meter(meter, position, ends_line)
+            if ends_line:
+                word = markovgen.last_word_of_markov_line(output_words, rhyme_with=rhyme_with, max_length=12,
+                                                          words_for_sampling=words_for_sampling, deadline=deadline,
+                                                          constraints=slot)
+            else:
+                word = markovgen.nonlast_word_of_markov_line(output_words, words_for_sampling=words_for_sampling,
+                                                             deadline=deadline, constraints=slot)
+                markovgen.prefetch_next_word_lookups(word)
+            output_words.append(word)
+            if ends_line:
+                break
+            next_position = stress_index.advance(word, meter, position)
+            # Only a last resort common word can miss the meter; it still takes up its syllables
+            position = next_position if next_position is not None else \
+                min(len(meter) - 1, position + (stress_index.syllable_count(word) or 1))
+        correct_a_vs_an(output_words)
+        return " ".join(output_words)
+
     def poem_from_markov(self, input_words, num_lines=10, min_line_words: int = 5, max_line_words: int = 9,
-                         max_line_length: Optional[int] = 35) -> str:
+                         max_line_length: Optional[int] = 35, prefetch: bool = False,
+                         line_timeout: Optional[float] = None, plan: bool = False,
+                         latency_budget_ms: Optional[float] = None,
+                         meter: Union[str, Meter, Sequence[Meter], None] = None) -> str:
         """Generate a line of poetry using a markov chain that optionally tries to make a line rhyme with the last one
             Different algorithms handle the last word and all the other words: both algorithms use a mix of random
             probability and process stopwords differently to keep the generated text interesting and non-repetitive.
@@ -82,42 +162,66 @@ class PoemGenerator:
                                    phonetically related words to the starting word probably adds some sonority.
         :param max_line_length: an upper limit in characters for the line -- important for PDF generation to keep
                                 everything on the page.
+        :param prefetch: look up candidates for each next word in the background while the current one is chosen
+        :param line_timeout: roughly the most seconds each line may take
+        :param plan: before writing the poem, look up the candidate words reachable from the input words in a
+                     concurrent batch (see CandidateLattice), so that most words are picked without lookups
+        :param latency_budget_ms: roughly the most milliseconds the poem may take. Lookups only go to the API while
+                                  its recent latency fits in the time left; after that, words come from the caches,
+                                  the relation graph and local indexes (see providers.latency_budget). Either way,
+                                  how many lookups each tier answered is reported in the poem's tier_report.
+        :param meter: write the lines in a meter instead of with min_line_words to max_line_words words (see
+                      metered_line_from_markov): a Meter, the name of one in meter.meters (e.g. 'iambic pentameter')
+                      or of a form in meter.forms (e.g. 'haiku'), or a sequence of Meters that the lines follow in turn
             """
-        self.poem = None
-        words_for_sampling = input_words + phonetically_related_words(input_words, limit_results_per_input_word=20)
-        # Check for undesirable similarity overlap in the words for sampling list
-        similarity_checks = list(itertools.combinations(words_for_sampling, 2))
-        words_removed = []
-        for word_pair in similarity_checks:
-            if not(word_pair[0] in words_removed or word_pair[1] in words_removed) and \
-                    too_similar(word_pair[0], word_pair[1]):
-                words_removed.append(random.choice([word_pair[0], word_pair[1]]))
-                words_for_sampling.remove(words_removed[-1])
-
-        self.poem = Poem(input_words, words_for_sampling)
-        last_line_last_word = ''
-        random.shuffle(words_for_sampling)
-        line_enders = []
-        print("\n")
-        for i in range(num_lines):
-            rhyme_with = last_line_last_word if i % 2 == 1 else None
-            # 67.5 % chance the line starts with an input word or something relate, 32.5% with a common word
-            line_starter = words_for_sampling.pop() if random.random() > .4 else \
-                    random.choice(StochasticJolasticWordGenerator.common_words)
-            while i >= 1 and too_similar(line_starter, self.poem.lines[i - 1].split(' ')[0]):
-                # while statement prevents repetition of line starters
+        if isinstance(meter, str):
+            if meter not in meters and meter not in forms:
+                raise ValueError(f'Unknown meter: {meter}. Choose from {", ".join(list(meters) + list(forms))}')
+            meter = meters.get(meter) or forms[meter]
+        line_meters = [meter] if isinstance(meter, Meter) else list(meter or [])
+        with latency_budget(latency_budget_ms) as budget:
+            self.poem = None
+            words_for_sampling = input_words + phonetically_related_words(input_words, max_results_per_input_word=20)
+            # Check for undesirable similarity overlap in the words for sampling list. Shuffling first makes it random
+            # which of two too similar words is kept.
+            words_for_sampling = remove_too_similar(sampling.sample(words_for_sampling))
+            # Line starters are popped off the end of words_for_sampling, so plan for those and as many other words for
+            # sampling as well as the input words. The generator prefers sampling the words the lattice has.
+            lattice = CandidateLattice.build(input_words + words_for_sampling[-2 * num_lines:],
+                                             max_length=12 if max_line_length else None) if plan else None
+            self.poem = Poem(input_words, words_for_sampling, lattice=lattice)
+            self.poem.tier_report = budget.report
+            last_line_last_word = ''
+            line_enders = []
+            print("\n")
+            for i in range(num_lines):
+                rhyme_with = last_line_last_word if i % 2 == 1 else None
+                # 67.5 % chance the line starts with an input word or something relate, 32.5% with a common word
+                line_meter = line_meters[i % len(line_meters)] if line_meters else None
                 line_starter = words_for_sampling.pop() if random.random() > .4 else \
-                    random.choice(StochasticJolasticWordGenerator.common_words)
-            line = self.poem_line_from_markov(line_starter, words_for_sampling=words_for_sampling,
-                                              num_words=random.randint(min_line_words, max_line_words),
-                                              rhyme_with=rhyme_with, max_line_length=max_line_length)
-            self.poem.lines.append(line)
-            last_line_last_word = line.split(' ')[-1]
-            # Directly adding line ender to line now will screw up rhyme pairs so save it & add it in another iteration
-            line_enders.append(random.choice(self.markov_line_enders))
-            print(line + line_enders[-1])
-        for i, line in enumerate(self.poem.lines):
-            self.poem.lines[i] += line_enders[i]
+                        random.choice(StochasticJolasticWordGenerator.common_words)
+                while (i >= 1 and too_similar(line_starter, self.poem.lines[i - 1].split(' ')[0])) or \
+                        (line_meter is not None and not stress_index.fits(line_starter, line_meter)):
+                    # while statement prevents repetition of line starters, and starters that don't fit the meter
+                    line_starter = words_for_sampling.pop() if random.random() > .4 and words_for_sampling else \
+                        random.choice(StochasticJolasticWordGenerator.common_words)
+                if line_meter is not None:
+                    line = self.metered_line_from_markov(line_starter, line_meter, rhyme_with=rhyme_with,
+                                                         words_for_sampling=words_for_sampling, prefetch=prefetch,
+                                                         line_timeout=line_timeout, lattice=lattice)
+                else:
+                    line = self.poem_line_from_markov(line_starter, words_for_sampling=words_for_sampling,
+                                                      num_words=random.randint(min_line_words, max_line_words),
+                                                      rhyme_with=rhyme_with, max_line_length=max_line_length,
+                                                      prefetch=prefetch, line_timeout=line_timeout, lattice=lattice)
+                self.poem.lines.append(line)
+                last_line_last_word = line.split(' ')[-1]
+                # Directly adding line ender to line now will screw up rhyme pairs so save it & add it in another
+                # iteration
+                line_enders.append(random.choice(self.markov_line_enders))
+                print(line + line_enders[-1])
+            for i, line in enumerate(self.poem.lines):
+                self.poem.lines[i] += line_enders[i]
         poem = self.poem
         return poem
 
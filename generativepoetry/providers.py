@@ -0,0 +1,84 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Where a lookup can be answered from, fastest first: lexigen's in-memory cache and relation graph, the persistent
+# cache, local indexes built from the CMU dictionary and other data shipped with the package, and the Datamuse API.
+# 'none' counts lookups that no affordable tier could answer.
+tiers = ('memory', 'disk', 'local', 'api', 'none')
+
+
+class TierReport:
+    """Counts how many lookups each tier answered."""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(tiers, 0)
+        self._lock = threading.Lock()
+
+    def record(self, tier: str):
+        with self._lock:
+            self.counts[tier] += 1
+
+    @property
+    def shares(self) -> Dict[str, float]:
+        """The fraction of lookups each tier answered."""
+        total = sum(self.counts.values())
+        return {tier: count / total if total else 0.0 for tier, count in self.counts.items()}
+
+    def __repr__(self):
+        return ', '.join(f'{tier}: {count}' for tier, count in self.counts.items())
+
+
+class LatencyBudget:
+    """A time limit for a request, such as generating a poem, that lookups made on its behalf check before using a
+    slow tier, and a report of which tiers answered them. A lookup only goes to the API if the API's recent 95th
+    percentile latency still fits in what's left of the budget; otherwise it makes do with the local tiers.
+    """
+
+    def __init__(self, milliseconds: Optional[float] = None):
+        """
+        :param milliseconds: the time limit, or None for no limit (just the report)
+        """
+        self.milliseconds = milliseconds
+        self.deadline = time.monotonic() + milliseconds / 1000 if milliseconds is not None else None
+        self.report = TierReport()
+
+    def remaining(self) -> Optional[float]:
+        """Return the seconds left, or None if there's no limit."""
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+
+    def affords(self, seconds: float) -> bool:
+        """Check whether something expected to take the given seconds still fits in the budget."""
+        return self.deadline is None or time.monotonic() + seconds <= self.deadline
+
+
+_current_budget: contextvars.ContextVar = contextvars.ContextVar('latency_budget', default=None)
+
+
+def current_budget() -> Optional[LatencyBudget]:
+    """Return the latency budget lookups in this context are made under, if there is one."""
+    return _current_budget.get()
+
+
+@contextmanager
+def latency_budget(milliseconds: Optional[float] = None):
+    """Within this context, make lookups under a new latency budget, which is yielded. Threads and tasks the lookups
+    are run on inherit it (lexigen copies the context into its thread pool).
+
+    :param milliseconds: the time limit, or None for no limit (just the report of which tiers answered)
+    """
+    budget = LatencyBudget(milliseconds)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def record_tier(tier: str):
+    """Count a lookup answered by a tier in the current latency budget's report, if there is a budget."""
+    budget = _current_budget.get()
+    if budget is not None:
+        budget.report.record(tier)
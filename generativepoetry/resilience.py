@@ -0,0 +1,278 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Deque, List, Optional
+import requests
+
+
+class LookupUnavailableError(Exception):
+    """Raised when a lookup can't be answered by the upstream API right now."""
+
+
+class CircuitOpenError(LookupUnavailableError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Check whether a failed request is worth retrying: connection errors, timeouts, rate limiting, and server errors.
+
+    :param error: the exception the request raised
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status == 429 or status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Return how many seconds a rate limited response asked the client to wait, if it said."""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['Retry-After']) if response is not None else None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """A rate limiter: requests take a token each, and tokens are added at a fixed rate up to a maximum burst.
+
+    One bucket is meant to be shared by every thread in a process, so the process as a whole stays under the rate.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: tokens added per second
+        :param burst: the most tokens that can accumulate, i.e. the most requests that can be sent at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.waited = 0.0  # Total seconds spent waiting for tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take a token, waiting for one if necessary, and return whether one was taken before the timeout.
+
+        :param timeout: the most seconds to wait; if None, wait as long as it takes
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return False
+            self.waited += delay
+            time.sleep(delay)
+
+
+class LatencyTracker:
+    """Keeps the most recent request latencies and estimates a percentile of them."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        :param window: how many of the most recent latencies to keep
+        :param min_samples: how many latencies are needed before a percentile is estimated
+        """
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Return the latency the given fraction of recent requests finished within, or None without enough samples.
+
+        :param fraction: e.g. .95 for the 95th percentile
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Stops requests to an upstream that keeps failing, so callers fail fast instead of waiting out timeouts.
+
+    After failure_threshold consecutive failures, the circuit opens and requests are refused for reset_timeout seconds.
+    Then a single trial request is let through: if it succeeds the circuit closes, and if it fails the circuit opens
+    again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        :param failure_threshold: how many consecutive failures open the circuit
+        :param reset_timeout: how many seconds the circuit stays open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half-open'
+
+    def allow(self) -> bool:
+        """Check whether a request may be sent now."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        self.reset()
+
+    def reset(self):
+        """Close the circuit and forget the failures so far."""
+        with self._lock:
+            self.failures, self.opened_at, self._trial_in_flight = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+            self._trial_in_flight = False
+
+
+class ResilientTransport:
+    """Wraps a transport with a rate limiter, retries with jittered exponential backoff, hedged requests, and a
+    circuit breaker.
+
+    A request that takes longer than the recent 95th percentile latency is sent a second time, and whichever response
+    arrives first is used, which cuts the tail latency caused by the odd slow connection. Transient failures are
+    retried after a random delay of up to base_delay * 2 ** attempt seconds. When the upstream keeps failing, the
+    circuit opens and fetch raises CircuitOpenError right away until it's time to try again.
+    """
+
+    def __init__(self, transport, rate_limiter: Optional[TokenBucket] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None, max_retries: int = 3, base_delay: float = .25,
+                 max_delay: float = 4, hedge_percentile: Optional[float] = .95, min_hedge_delay: float = .25,
+                 rng: Optional[random.Random] = None):
+        """
+        :param transport: the transport to send requests with
+        :param rate_limiter: limits the requests sent, including retries and hedges (default: no limit)
+        :param circuit_breaker: the breaker to use (default: a new one with the default settings)
+        :param max_retries: how many times a transient failure is retried
+        :param base_delay: the most seconds to wait before the first retry; doubled for each further retry
+        :param max_delay: the most seconds to wait before any retry
+        :param hedge_percentile: the latency percentile after which a request is hedged, or None not to hedge
+        :param min_hedge_delay: the fewest seconds to wait before hedging, since hedging fast requests mostly just
+                                doubles the load
+        :param rng: the random number generator for backoff jitter
+        """
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.latencies = LatencyTracker()
+        self.retries, self.hedges, self.hedge_wins, self.rejected = 0, 0, 0, 0
+        self._random = rng or random.Random()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt: int) -> float:
+        """Return a random delay before the given retry, between 0 and base_delay * 2 ** attempt (full jitter)."""
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _send(self, query: dict) -> List[dict]:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start = time.monotonic()
+        response = self.transport.fetch(query)
+        self.latencies.record(time.monotonic() - start)
+        return response
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='lexigen-hedge')
+            return self._hedge_executor
+
+    def _send_hedged(self, query: dict) -> List[dict]:
+        threshold = self.latencies.percentile(self.hedge_percentile) if self.hedge_percentile else None
+        if threshold is None:
+            return self._send(query)
+        threshold = max(threshold, self.min_hedge_delay)
+        executor = self._executor()
+        first = executor.submit(self._send, query)
+        done, _ = wait([first], timeout=threshold)
+        if done:
+            return first.result()
+        self.hedges += 1
+        second = executor.submit(self._send, query)
+        done, pending = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = next(iter(done))
+        if winner.exception() is not None and pending:
+            winner = next(iter(pending))  # Fall back on the other request rather than fail early
+        if winner is second:
+            self.hedge_wins += 1
+        return winner.result()
+
+    def fetch(self, query: dict) -> List[dict]:
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                self.rejected += 1
+                raise CircuitOpenError('Too many recent lookups have failed, so the API is not being queried')
+            try:
+                response = self._send_hedged(query)
+            except Exception as e:
+                if not is_transient(e):
+                    self.circuit_breaker.record_success()  # The upstream answered, if not with results
+                    raise
+                self.circuit_breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise LookupUnavailableError(f'Lookup failed after {attempt + 1} attempts: {e}') from e
+                delay = retry_after(e)
+                time.sleep(min(self.max_delay, delay) if delay is not None else self.backoff(attempt))
+                self.retries += 1
+                attempt += 1
+            else:
+                self.circuit_breaker.record_success()
+                return response
+
+    def expected_latency(self, default: float = .3) -> float:
+        """Return the recent 95th percentile latency, or a default if there aren't enough samples to estimate it.
+
+        :param default: the seconds to assume before any requests have been timed
+        """
+        latency = self.latencies.percentile(.95)
+        return latency if latency is not None else default
+
+    @property
+    def stats(self) -> dict:
+        """Counters for judging how healthy the upstream is."""
+        return {'retries': self.retries, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+                'rejected': self.rejected, 'circuit': self.circuit_breaker.state,
+                'times_opened': self.circuit_breaker.times_opened,
+                'rate_limited_seconds': self.rate_limiter.waited if self.rate_limiter else 0.0,
+                'p95_latency': self.latencies.percentile(.95)}
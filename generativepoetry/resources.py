@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+lazy_resources: Dict[str, 'LazyResource'] = {}  # Named resources, in the order they were declared
+
+
+class LazyResource:
+    """Stands in for a resource that is slow to load, like a language model or a dictionary, and loads it the first time
+    it's used. Attribute lookups and calls are passed through to the resource, so a module-level LazyResource can be
+    used just like the resource itself, but code on a hot path should call load() once and keep what it returns.
+    """
+
+    def __init__(self, loader: Callable[[], Any], name: Optional[str] = None):
+        """
+        :param loader: a function that loads and returns the resource
+        :param name: a name for the resource in startup reports; unnamed resources aren't listed
+        """
+        self.loader = loader
+        self.name = name
+        self.load_seconds: Optional[float] = None
+        self._resource: Any = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        if name is not None:
+            lazy_resources[name] = self
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self) -> Any:
+        """Return the resource, loading it if that hasn't happened yet."""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    start = time.perf_counter()
+                    self._resource = self.loader()
+                    self.load_seconds = time.perf_counter() - start
+                    self._loaded = True
+        return self._resource
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        state = 'loaded' if self._loaded else 'not loaded'
+        return f'<LazyResource {self.name or self.loader.__name__} ({state})>'
@@ -0,0 +1,111 @@
+import random
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+import pronouncing
+from .utils import filter_word_list, validate_str
+
+
+class RhymeIndex:
+    """An index of the CMU pronouncing dictionary from rhyming part to the ids of the words that end with it.
+
+    The index is built on first use. Each rhyming part's words are run through filter_word_list the first time they're
+    needed and kept, so looking up rhymes costs a dictionary lookup instead of a scan of the whole dictionary, and
+    picking a random rhyme is a single random.choice.
+    """
+
+    def __init__(self):
+        self.words: List[str] = []  # Word ids index into this list
+        self.word_ids: Dict[str, int] = {}
+        self.rhyming_parts: Dict[str, Tuple[int, ...]] = {}  # word -> ids of its rhyming parts
+        self.buckets: List[array] = []  # rhyming part id -> ids of the words with that rhyming part
+        self.filtered_buckets: Dict[int, array] = {}
+        self.rhymes_by_word: Dict[str, Tuple[str, ...]] = {}
+        self._rhymable: Optional[frozenset] = None
+        self._lock = threading.Lock()
+        self._built = False
+
+    def build(self):
+        """Read the CMU dictionary into the index, if that hasn't happened yet."""
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            pronouncing.init_cmu()
+            part_ids: Dict[str, int] = {}
+            word_parts: Dict[str, List[int]] = {}
+            for word, phones in pronouncing.pronunciations:
+                if word not in self.word_ids:
+                    self.word_ids[word] = len(self.words)
+                    self.words.append(word)
+                part = pronouncing.rhyming_part(phones)
+                if part not in part_ids:
+                    part_ids[part] = len(self.buckets)
+                    self.buckets.append(array('i'))
+                part_id, word_id = part_ids[part], self.word_ids[word]
+                if part_id not in word_parts.setdefault(word, []):
+                    word_parts[word].append(part_id)
+                    self.buckets[part_id].append(word_id)
+            self.rhyming_parts = {word: tuple(parts) for word, parts in word_parts.items()}
+            self._built = True
+
+    def filtered_bucket(self, part_id: int) -> array:
+        """Return the ids of the words with a rhyming part that pass filter_word_list."""
+        bucket = self.filtered_buckets.get(part_id)
+        if bucket is None:
+            words = self.words
+            bucket = array('i', (self.word_ids[word] for word in filter_word_list(
+                [words[word_id] for word_id in self.buckets[part_id]])))
+            self.filtered_buckets[part_id] = bucket
+        return bucket
+
+    def rhymes(self, input_word: str) -> Tuple[str, ...]:
+        """Return the filtered rhymes of a word, in dictionary order. (Sample them with lexigen.rhymes.)
+
+        :param input_word: the word to look up the rhymes of
+        """
+        validate_str(input_word)
+        rhyme_words = self.rhymes_by_word.get(input_word)
+        if rhyme_words is None:
+            self.build()
+            part_ids = self.rhyming_parts.get(input_word.lower(), ())
+            if len(part_ids) == 1:
+                word_ids = self.filtered_bucket(part_ids[0])
+            else:
+                word_ids = sorted(set(word_id for part_id in part_ids for word_id in self.filtered_bucket(part_id)))
+            rhyme_words = tuple(self.words[word_id] for word_id in word_ids if self.words[word_id] != input_word)
+            self.rhymes_by_word[input_word] = rhyme_words
+        return rhyme_words
+
+    def random_rhyme(self, input_word: str) -> Optional[str]:
+        """Return a random rhyme of a word, or None if it has none.
+
+        :param input_word: the word to look up a rhyme of
+        """
+        rhyme_words = self.rhymes(input_word)
+        return random.choice(rhyme_words) if rhyme_words else None
+
+    def is_rhymable(self, input_word: str) -> bool:
+        """Check whether a word has at least one rhyme.
+
+        :param input_word: the word to check
+        """
+        if self._rhymable is not None and input_word.islower():
+            return input_word in self._rhymable
+        return len(self.rhymes(input_word)) > 0
+
+    def rhymable_words(self) -> frozenset:
+        """Return the set of words in the dictionary that have at least one rhyme. This filters every rhyming part,
+        so calling it once in a long-lived worker means no later lookup pays for filtering."""
+        if self._rhymable is None:
+            self.build()
+            rhymable = set()
+            for part_id, bucket in enumerate(self.buckets):
+                filtered_bucket = self.filtered_bucket(part_id)
+                if len(filtered_bucket) > 1:
+                    rhymable.update(bucket)
+                elif len(filtered_bucket) == 1:
+                    rhymable.update(word_id for word_id in bucket if word_id != filtered_bucket[0])
+            self._rhymable = frozenset(self.words[word_id] for word_id in rhymable)
+        return self._rhymable
@@ -0,0 +1,57 @@
+import heapq
+import math
+import random
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Tuple, TypeVar, Union
+
+T = TypeVar('T', bound=Hashable)
+
+
+def unique(population: Iterable[T]) -> List[T]:
+    """Return the distinct elements of an iterable, in the order they first appear.
+
+    :param population: the elements to deduplicate
+    """
+    return list(dict.fromkeys(population))
+
+
+def sample(population: Iterable[T], k: Optional[int] = None, rng: Optional[random.Random] = None) -> List[T]:
+    """Return k distinct elements of a population in random order, or all of them, shuffled, if k is None or at least
+    the number of distinct elements. Takes time linear in the size of the population.
+
+    :param population: the elements to sample from; duplicates are only sampled once
+    :param k: the number of elements to return
+    :param rng: the random number generator to use (default: the random module's, so random.seed applies)
+    """
+    generator = rng if rng is not None else random
+    pool = unique(population)
+    if not k or k >= len(pool):
+        generator.shuffle(pool)
+        return pool
+    return generator.sample(pool, k)
+
+
+def weighted_sample(population: Union[Mapping[T, float], Iterable[Tuple[T, float]]], k: Optional[int] = None,
+                    rng: Optional[random.Random] = None) -> List[T]:
+    """Return k distinct elements of a population in random order, without replacement, where elements with higher
+    weights are more likely to be picked and to come first. Elements with a weight of zero or less come after all the
+    others. Uses Efraimidis and Spirakis' method, which takes a single pass over the population.
+
+    :param population: a mapping from each element to its weight (e.g. a Datamuse score), or (element, weight) pairs;
+                       an element appearing more than once gets its highest weight
+    :param k: the number of elements to return; if not given, return them all
+    :param rng: the random number generator to use (default: the random module's, so random.seed applies)
+    """
+    generator = rng if rng is not None else random
+    pairs = population.items() if isinstance(population, Mapping) else population
+    weights: Dict[T, float] = {}
+    for element, weight in pairs:
+        if element not in weights or weight > weights[element]:
+            weights[element] = weight
+    # Each element's key is u ** (1 / weight) for a uniform random u, compared by logarithm to avoid underflow
+    keys = ((math.log(1.0 - generator.random()) / weight if weight > 0 else -math.inf, generator.random(), element)
+            for element, weight in weights.items())
+    if not k or k >= len(weights):
+        ranked = sorted(keys, key=lambda key: key[:2], reverse=True)
+    else:
+        ranked = heapq.nlargest(k, keys, key=lambda key: key[:2])
+    return [element for _, _, element in ranked]
@@ -0,0 +1,250 @@
+import gzip
+import hashlib
+import os
+import platform
+import re
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
+import hunspell
+from .cache import default_cache_path
+
+affix_rule = Tuple[str, str, str, Optional[Pattern]]  # (characters stripped, affix added, its flags, condition)
+
+
+def dictionary_paths() -> Tuple[str, str]:
+    """Return the paths of the en_US Hunspell dictionary and affix files for this platform."""
+    if platform.system() == 'Windows':
+        raise Exception('Your OS is not currently supported.')
+    elif platform.system() == 'Darwin':
+        return '/Library/Spelling/en_US.dic', '/Library/Spelling/en_US.aff'
+    return '/usr/share/hunspell/en_US.dic', '/usr/share/hunspell/en_US.aff'
+
+
+def open_dictionary(dic_path: str, aff_path: str):
+    """Return a Hunspell handle for a dictionary.
+
+    :param dic_path: location of the .dic file
+    :param aff_path: location of the .aff file
+    """
+    try:
+        return hunspell.HunSpell(dic_path, aff_path)
+    except Exception:
+        raise Exception('This module requires the installation of the hunspell dictionary.')
+
+
+class AffixFile:
+    """The parts of a Hunspell .aff file needed to expand a dictionary's stems into the words they stand for: the
+    prefix and suffix rules and the flags that keep a stem from being a word on its own."""
+
+    def __init__(self, path: str):
+        """
+        :param path: location of the .aff file
+        """
+        self.encoding = 'utf-8'
+        self.flag_type = 'char'
+        self.prefixes: Dict[str, List[affix_rule]] = {}
+        self.suffixes: Dict[str, List[affix_rule]] = {}
+        self.cross_product: Dict[str, bool] = {}
+        self.not_words: set = set()  # Flags of stems that aren't words by themselves
+        with open(path, 'rb') as f:
+            for raw_line in f:
+                if raw_line.startswith(b'SET '):
+                    self.encoding = raw_line.split()[1].decode('ascii').lower()
+                    break
+        with open(path, encoding=self.encoding, errors='replace') as f:
+            for line in f:
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                if fields[0] == 'FLAG' and len(fields) > 1:
+                    self.flag_type = fields[1]
+                elif fields[0] in ('NEEDAFFIX', 'ONLYINCOMPOUND', 'FORBIDDENWORD') and len(fields) > 1:
+                    self.not_words.update(self.parse_flags(fields[1]))
+                elif fields[0] in ('PFX', 'SFX') and len(fields) >= 4:
+                    rules = self.prefixes if fields[0] == 'PFX' else self.suffixes
+                    flag = fields[1]
+                    if flag not in rules:  # The header line: PFX flag cross_product count
+                        rules[flag] = []
+                        self.cross_product[flag] = fields[2] == 'Y'
+                        continue
+                    strip = '' if fields[2] == '0' else fields[2]
+                    affix, _, affix_flags = fields[3].partition('/')
+                    affix = '' if affix == '0' else affix
+                    condition = fields[4] if len(fields) > 4 else '.'
+                    pattern = None if condition == '.' else \
+                        re.compile(condition + '$' if fields[0] == 'SFX' else '^' + condition)
+                    rules[flag].append((strip, affix, affix_flags, pattern))
+
+    def parse_flags(self, flags: str) -> List[str]:
+        """Split a string of flags according to the file's FLAG setting."""
+        if self.flag_type == 'long':
+            return [flags[i:i + 2] for i in range(0, len(flags), 2)]
+        if self.flag_type == 'num':
+            return flags.split(',')
+        return list(flags)
+
+    def add_suffixes(self, word: str, flags: Iterable[str]) -> Iterator[Tuple[str, str]]:
+        """Yield each word formed by adding one of the flagged suffixes, with the suffix's flag."""
+        for flag in flags:
+            for strip, affix, affix_flags, pattern in self.suffixes.get(flag, ()):
+                if word.endswith(strip) and (pattern is None or pattern.search(word)):
+                    yield word[:len(word) - len(strip)] + affix, flag
+                    # Suffixes may carry further suffixes of their own (e.g. -ful plus -ness)
+                    if affix_flags:
+                        for form, _ in self.add_suffixes(word[:len(word) - len(strip)] + affix,
+                                                         self.parse_flags(affix_flags)):
+                            yield form, flag
+
+    def expand(self, stem: str, flags: List[str]) -> Iterator[str]:
+        """Yield every word a dictionary stem stands for.
+
+        :param stem: the stem, as it appears in the .dic file
+        :param flags: the stem's affix flags
+        """
+        if not self.not_words.intersection(flags):
+            yield stem
+        suffixed = list(self.add_suffixes(stem, flags))
+        for word, _ in suffixed:
+            yield word
+        for flag in flags:
+            for strip, affix, _, pattern in self.prefixes.get(flag, ()):
+                if not stem.startswith(strip) or (pattern is not None and not pattern.search(stem)):
+                    continue
+                yield affix + stem[len(strip):]
+                if self.cross_product[flag]:
+                    for word, suffix_flag in suffixed:
+                        if self.cross_product[suffix_flag] and word.startswith(strip):
+                            yield affix + word[len(strip):]
+
+
+def expand_dictionary(dic_path: str, aff_path: str) -> Iterator[str]:
+    """Yield every word a Hunspell dictionary accepts as spelled (other than compounds and case variants), by applying
+    the affix rules to each stem, like Hunspell's unmunch tool.
+
+    :param dic_path: location of the .dic file
+    :param aff_path: location of the .aff file
+    """
+    affixes = AffixFile(aff_path)
+    with open(dic_path, encoding=affixes.encoding, errors='replace') as f:
+        next(f, None)  # The first line is the number of stems
+        for line in f:
+            entry = line.split(None, 1)[0] if line.strip() else ''
+            if not entry:
+                continue
+            stem, _, flags = entry.partition('/')
+            yield from affixes.expand(stem, affixes.parse_flags(flags))
+
+
+def artifact_path(dic_path: str, aff_path: str) -> Optional[str]:
+    """Return where the expanded form of a dictionary is stored, next to the lexical cache, or None if the lexical
+    cache is memory-only. The name changes whenever either dictionary file does, so stale artifacts are never read."""
+    cache_path = default_cache_path()
+    if cache_path is None:
+        return None
+    signature = hashlib.sha1()
+    for path in (dic_path, aff_path):
+        status = os.stat(path)
+        signature.update(f'{os.path.abspath(path)}:{status.st_size}:{status.st_mtime_ns};'.encode('utf-8'))
+    return os.path.join(os.path.dirname(cache_path), f'spelling-{signature.hexdigest()[:16]}.txt.gz')
+
+
+class SpellChecker:
+    """A spellchecker that keeps its verdicts, so Hunspell is asked about each word at most once per process.
+
+    Optionally, the dictionary can be expanded into the set of every word it accepts; words in that set are known to
+    be spelled correctly without asking Hunspell at all. The expanded set is saved next to the lexical cache and read
+    back by later processes, since building it takes a second or two. Calls into Hunspell are serialized, as a handle
+    isn't safe to share between threads, and a forked process opens its own handle on first use.
+    """
+
+    def __init__(self, dic_path: str, aff_path: str, expand: bool = False, handle=None):
+        """
+        :param dic_path: location of the .dic file
+        :param aff_path: location of the .aff file
+        :param expand: expand the dictionary into a set of known words right away (see the expand method)
+        :param handle: an already opened Hunspell handle for the dictionary, to avoid opening another
+        """
+        self.dic_path = dic_path
+        self.aff_path = aff_path
+        self.known_words: frozenset = frozenset()
+        self.verdicts: Dict[str, bool] = {}
+        self.known_word_hits, self.verdict_hits, self.lookups = 0, 0, 0
+        self._handle = handle
+        self._handle_pid = os.getpid() if handle is not None else None
+        self._lock = threading.Lock()
+        if expand:
+            self.expand()
+
+    @property
+    def handle(self):
+        """The Hunspell handle for this process, opened on first use."""
+        if self._handle_pid != os.getpid():
+            # Also replace the lock, in case another thread held it when this process was forked
+            self._lock = threading.Lock()
+            self._handle = open_dictionary(self.dic_path, self.aff_path)
+            self._handle_pid = os.getpid()
+        return self._handle
+
+    def expand(self, path: Optional[str] = None) -> int:
+        """Load the set of words the dictionary accepts from the stored artifact, building and storing it first if
+        there isn't one, and return the number of words. Call this once in a long-lived worker.
+
+        :param path: location of the artifact (default: next to the lexical cache)
+        """
+        path = path or artifact_path(self.dic_path, self.aff_path)
+        if path and os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                self.known_words = frozenset(f.read().splitlines())
+            return len(self.known_words)
+        self.known_words = frozenset(expand_dictionary(self.dic_path, self.aff_path))
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                temporary_path = f'{path}.{os.getpid()}.tmp'
+                with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+                    f.write('\n'.join(sorted(self.known_words)))
+                os.replace(temporary_path, path)
+            except OSError:
+                pass  # It will just be built again next time
+        return len(self.known_words)
+
+    def spell(self, word: str) -> bool:
+        """Check whether a word is spelled correctly.
+
+        :param word: the word to check
+        """
+        if word in self.known_words:
+            self.known_word_hits += 1
+            return True
+        verdict = self.verdicts.get(word)
+        if verdict is not None:
+            self.verdict_hits += 1
+            return verdict
+        handle = self.handle
+        with self._lock:
+            verdict = self.verdicts[word] = bool(handle.spell(word))
+            self.lookups += 1
+        return verdict
+
+    def spell_many(self, words: Iterable[str]) -> List[bool]:
+        """Check whether each of several words is spelled correctly, asking Hunspell about the unknown ones in a single
+        batch.
+
+        :param words: the words to check
+        """
+        words = list(words)
+        known_words, verdicts = self.known_words, self.verdicts
+        unknown = [word for word in dict.fromkeys(words) if word not in known_words and word not in verdicts]
+        if unknown:
+            handle = self.handle
+            with self._lock:
+                for word in unknown:
+                    verdicts[word] = bool(handle.spell(word))
+                self.lookups += len(unknown)
+        return [word in known_words or verdicts[word] for word in words]
+
+    @property
+    def stats(self) -> dict:
+        """How many words were answered from the expanded dictionary, from remembered verdicts, and by Hunspell."""
+        return {'known_word_hits': self.known_word_hits, 'verdict_hits': self.verdict_hits, 'lookups': self.lookups,
+                'known_words': len(self.known_words)}
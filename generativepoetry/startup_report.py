@@ -0,0 +1,65 @@
+"""Reports how long the package's modules take to import and its heavy resources take to load, and how much memory
+each adds. Run it with:
+
+    python -m generativepoetry.startup_report [--imports-only]
+"""
+import importlib
+import os
+import sys
+import time
+from typing import List, Tuple
+
+report_row = Tuple[str, float, float]  # (what was imported or loaded, seconds, megabytes of memory added)
+
+modules = ['generativepoetry.utils', 'generativepoetry.lexigen', 'generativepoetry.poemgen', 'generativepoetry.pdf',
+           'generativepoetry.decomposer']
+
+
+def resident_megabytes() -> float:
+    """Return the memory currently used by this process, in megabytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource  # Not on Windows, which the package doesn't support anyway
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Peak, rather than current, usage
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def measure(name: str, function) -> report_row:
+    memory = resident_megabytes()
+    start = time.perf_counter()
+    try:
+        function()
+    except Exception as e:  # e.g. a model or corpus that hasn't been downloaded
+        name = f'{name} (failed: {type(e).__name__})'
+    return name, time.perf_counter() - start, resident_megabytes() - memory
+
+
+def startup_report(load_resources: bool = True) -> List[report_row]:
+    """Import each of the package's modules in turn, then (optionally) load each lazily loaded resource, and return
+    how long each step took and how much memory it added. Modules imported earlier in the same process count as
+    free, so run this in a fresh interpreter.
+
+    :param load_resources: also load the lazily loaded resources
+    """
+    rows = [measure(f'import {module}', lambda: importlib.import_module(module)) for module in modules]
+    if load_resources:
+        from .lexigen import rhyme_index
+        from .resources import lazy_resources
+        for name, resource in lazy_resources.items():
+            rows.append(measure(name, resource.load))
+        rows.append(measure('rhyme index', rhyme_index.build))
+    return rows
+
+
+def main():
+    rows = startup_report(load_resources='--imports-only' not in sys.argv[1:])
+    width = max(len(name) for name, _, _ in rows)
+    print(f'{"":{width}}  {"seconds":>8}  {"MB":>7}')
+    for name, seconds, megabytes in rows:
+        print(f'{name:{width}}  {seconds:8.3f}  {megabytes:7.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import atexit
+import gzip
+import json
+import os
+import threading
+from typing import List
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+fixture_modes = ('record', 'replay', 'strict')
+
+
+class UnrecordedQueryError(Exception):
+    """Raised in strict mode when a query is missing from the fixture."""
+
+
+def query_key(query: dict) -> str:
+    """Return a canonical string for a Datamuse query, independent of the order of its parameters."""
+    return urlencode(sorted((key, value) for key, value in query.items() if value is not None))
+
+
+class LiveTransport:
+    """Sends Datamuse queries to the live API over a pool of keep-alive connections.
+
+    The python-datamuse client opens a new connection for every request, so only its API root and default max are
+    used here. The pool is safe to share between threads.
+    """
+
+    def __init__(self, client, pool_size: int = 8, timeout: float = 10):
+        """
+        :param client: the python-datamuse client whose settings are used
+        :param pool_size: the maximum number of connections kept alive, which should match the number of threads
+                          sending queries concurrently
+        :param timeout: seconds to wait for the API to respond before giving up
+        """
+        self.client = client
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch(self, query: dict) -> List[dict]:
+        params = dict(query)
+        params.setdefault('max', self.client.max)
+        response = self.session.get(f'{self.client.api_root}/words', params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class FixtureTransport:
+    """Records Datamuse responses to, or replays them from, a gzipped JSON fixture so lexigen can run hermetically.
+
+    In record mode, queries are passed to the wrapped transport and the responses are saved when the process exits
+    (or when save is called). In replay mode, unrecorded queries get an empty response; in strict mode they raise an
+    UnrecordedQueryError. Neither replay mode touches the network.
+    """
+
+    def __init__(self, path: str, mode: str = 'replay', transport=None):
+        """
+        :param path: location of the fixture file
+        :param mode: record, replay, or strict
+        :param transport: the transport to record from (required in record mode)
+        """
+        if mode not in fixture_modes:
+            raise ValueError(f'Fixture mode must be one of: {", ".join(fixture_modes)}')
+        if mode == 'record' and transport is None:
+            raise ValueError('Record mode requires a transport to record from')
+        self.path = path
+        self.mode = mode
+        self.transport = transport
+        self.responses = {}
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                self.responses = json.load(f)
+        elif mode != 'record':
+            raise FileNotFoundError(f'No lexical fixture at {path}')
+        if mode == 'record':
+            atexit.register(self.save)
+
+    def fetch(self, query: dict) -> List[dict]:
+        key = query_key(query)
+        response = self.responses.get(key)
+        if response is not None:
+            return response
+        if self.mode == 'record':
+            response = self.transport.fetch(query)
+            with self._lock:
+                self.responses[key] = response
+                self._dirty = True
+            return response
+        self.misses += 1
+        if self.mode == 'strict':
+            raise UnrecordedQueryError(f'Query not in fixture {self.path}: {key}')
+        return []
+
+    def save(self):
+        """Write the recorded responses to the fixture file, if anything new was recorded."""
+        with self._lock:
+            if not self._dirty:
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temporary_path = self.path + '.tmp'
+            with gzip.open(temporary_path, 'wt', encoding='utf-8') as f:
+                json.dump(self.responses, f, separators=(',', ':'), sort_keys=True)
+            os.replace(temporary_path, self.path)
+            self._dirty = False
@@ -1,31 +1,30 @@
 import pkgutil
-import platform
 import random
 import re
-import hunspell
 from consolemenu.screen import Screen
-from typing import List, TypeVar
-from wordfreq import word_frequency
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, TypeVar
+from .frequency import frequency_table
+from .resources import LazyResource
+from .spelling import SpellChecker, dictionary_paths, open_dictionary
 
 
 def setup_spellchecker():
-    if platform.system() == 'Windows':
-        raise Exception('Your OS is not currently supported.')
-    elif platform.system() == 'Darwin':
-        try:
-            return hunspell.HunSpell('/Library/Spelling/en_US.dic', '/Library/Spelling/en_US.aff')
-        except Exception:
-            raise Exception('This module requires the installation of the hunspell dictionary.')
-    else:
-        try:
-            return hunspell.HunSpell('/usr/share/hunspell/en_US.dic', '/usr/share/hunspell/en_US.aff')
-        except Exception:
-            raise Exception('This module requires the installation of the hunspell dictionary.')
+    return open_dictionary(*dictionary_paths())
+
+
+spellchecker = SpellChecker(*dictionary_paths())  # Opens the dictionary the first time a word is checked
+hobj = LazyResource(lambda: spellchecker.handle, name='Hunspell dictionary')
+
+
+def get_spellchecker() -> SpellChecker:
+    """Return the shared spellchecker."""
+    return spellchecker
 
 
-hobj = setup_spellchecker()
 str_or_list_of_str = TypeVar('str_or_list_of_str', str, List[str])
 
+
 def get_input_words():
     prompt = 'To generate a poem, type some words separated by commas or spaces, and then press enter.\n\n'
 
@@ -100,7 +99,83 @@ def validate_word(input_val):
         raise ValueError('Word may not contain digits, spaces, or special characters.')
 
 
-def filter_word(string, spellcheck=True, exclude_words=[], word_frequency_threshold=4e-08):
+class WordFilter:
+    """Filters out words that are too short, have invalid characters, are too archaic, are on the package's lists of
+    unfitting words, or (optionally) cannot be found in a spelling dictionary.
+
+    The word lists are read once, and the verdict on each word is remembered, so filtering a word seen before costs a
+    couple of dictionary lookups.
+    """
+
+    def __init__(self, word_frequency_threshold: float = 4e-08):
+        """
+        :param word_frequency_threshold: how frequently the word appears in the word_frequency package's corpus --
+                                         filter out word if less frequent than this threshold
+        """
+        self.word_frequency_threshold = word_frequency_threshold
+        self._unfitting_words: Optional[frozenset] = None
+        self._verdicts: Dict[str, bool] = {}  # Verdicts on everything except spelling and excluded words
+
+    @property
+    def unfitting_words(self) -> frozenset:
+        # Datamuse is built from webscraping and occasionally returns offensive and oppressive language, which I am
+        # here adding to filter out. Although there is an appropriate and even critical way for humans to write poetry
+        # using some of these words that might be considered edge cases (e.g. Hottentot), a stochastic text generator
+        # does not have a historical sense to do that, so I have decided to exclude these. The abbreviations list
+        # holds some words Datamuse tends to return that disrupt poetic flow.
+        if self._unfitting_words is None:
+            self._unfitting_words = frozenset(
+                pkgutil.get_data('generativepoetry', 'data/hate_words.txt').decode("utf-8").splitlines() +
+                pkgutil.get_data('generativepoetry', 'data/abbreviations_etc.txt').decode("utf-8").splitlines())
+        return self._unfitting_words
+
+    def _well_formed(self, string: str) -> bool:
+        validate_str(string)
+        return len(string) >= 3 and not has_invalid_characters(string) and string not in self.unfitting_words
+
+    def _verdict(self, string: str) -> bool:
+        verdict = self._verdicts.get(string)
+        if verdict is None:
+            verdict = self._verdicts[string] = self._well_formed(string) and \
+                frequency_table.frequency(string) >= self.word_frequency_threshold
+        return verdict
+
+    def filter_word(self, string: str, spellcheck: bool = True, exclude_words: Iterable[str] = (),
+                    word_frequency_threshold: Optional[float] = None) -> bool:
+        """Return whether a word passes the filter.
+
+        :param string: the string to check against
+        :param spellcheck: Use a spelling dictionary as filter.
+        :param exclude_words: words to filter out
+        :param word_frequency_threshold: overrides the filter's threshold for this call
+        """
+        if word_frequency_threshold is None or word_frequency_threshold == self.word_frequency_threshold:
+            if not self._verdict(string):
+                return False
+        elif not (self._well_formed(string) and frequency_table.frequency(string) >= word_frequency_threshold):
+            return False
+        return not (spellcheck and not get_spellchecker().spell(string)) and string not in exclude_words
+
+    def filter_many(self, word_list: Iterable[str], spellcheck: bool = True,
+                    exclude_words: Iterable[str] = ()) -> List[str]:
+        """Return the words of a list that pass the filter, in order.
+
+        :param word_list: the words to filter
+        :param spellcheck: Use a spelling dictionary as filter.
+        :param exclude_words: words to filter out
+        """
+        exclude_words = exclude_words if isinstance(exclude_words, (set, frozenset)) else set(exclude_words)
+        verdict = self._verdict
+        words = [word for word in word_list if verdict(word) and word not in exclude_words]
+        if spellcheck:
+            words = [word for word, spelled in zip(words, get_spellchecker().spell_many(words)) if spelled]
+        return words
+
+
+word_filter = WordFilter()
+
+
+def filter_word(string, spellcheck=True, exclude_words: Iterable[str] = (), word_frequency_threshold=4e-08):
     """Filter out a word if it is too short, has invalid characters, is too archaic, or (optionally) cannot be found in
     a spelling dictionary.
 
@@ -112,50 +187,57 @@ def filter_word(string, spellcheck=True, exclude_words=[], word_frequency_thresh
     :param word_frequency_threshold: how frequently the word appears in the word_frequency package's corpus -- filter
                                      out word if less frequent than this threshold
     """
-    # Datamuse is built from webscraping and occasionally returns offensive and oppressive language, which I am here
-    # adding to filter out. Although there is an appropriate and even critical way for humans to write poetry using some
-    # of these words that might be considered edge cases (e.g. Hottentot), a stochastic text generator does not have
-    # a historical sense to do that, so I have decided to exclude these.
-    unfitting_words = pkgutil.get_data('generativepoetry', 'data/hate_words.txt').decode("utf-8").splitlines()
-    unfitting_words.extend(pkgutil.get_data('generativepoetry', 'data/abbreviations_etc.txt').decode("utf-8")
-                           .splitlines())
-    exclude_words.extend(unfitting_words)  # Some words Datamuse tends to return that disruptive poetic flow
-    validate_str(string)
-    if len(string) < 3:
-        return False
-    if has_invalid_characters(string):
-        return False
-    if word_frequency(string, 'en') < word_frequency_threshold:
-        return False
-    if spellcheck and not hobj.spell(string):
-        return False
-    if string in exclude_words:
-        return False
-    return True
-
-
-def filter_word_list(word_list: List[str], spellcheck: bool = True, exclude_words: List[str] = []) -> List[str]:
+    return word_filter.filter_word(string, spellcheck=spellcheck, exclude_words=exclude_words,
+                                   word_frequency_threshold=word_frequency_threshold)
+
+
+def filter_word_list(word_list: List[str], spellcheck: bool = True, exclude_words: Iterable[str] = ()) -> List[str]:
     """Filter a list of words using the filter_word method.
 
     :param word_list: list of words to filter
     :param spellcheck (bool) -- Use a spelling dictionary as filter (helps eliminate abbreviations and Internet slang).
+    :param exclude_words: words to filter out
     """
-    results: List[str] = list(
-        filter(
-            lambda word: filter_word(word, spellcheck=spellcheck, exclude_words=exclude_words), word_list
-        )
-    )
-    return results
+    return word_filter.filter_many(word_list, spellcheck=spellcheck, exclude_words=exclude_words)
 
 
 def sort_by_rarity(word_list: List[str]) -> List[str]:
-    if len(word_list) <= 1:
-        return word_list
-    return sort_by_rarity(
-        [word for word in word_list[1:] if word_frequency(word, 'en') < word_frequency(word_list[0], 'en')]
-    ) + [word_list[0]] + \
-           sort_by_rarity(
-               [word for word in word_list[1:] if word_frequency(word, 'en') >= word_frequency(word_list[0], 'en')])
+    """Sort a list of words from rarest to most common, according to the wordfreq package's corpus. Equally frequent
+    words keep their order.
+
+    :param word_list: list of words to sort
+    """
+    return frequency_table.sort_by_rarity(word_list)
+
+
+the_variants = frozenset(['the', 'thee', 'them'])  # Too similar to one another to follow each other
+
+
+@lru_cache(maxsize=65536)
+def similarity_stems(word: str) -> FrozenSet[str]:
+    """Return the words a word is too similar to because it is one of their inflections: the word minus a plural -s, an
+    adverbial -ly, a past tense -d, or a gerund -ing. Two words are too similar if they're the same, if either is a
+    stem of the other, or if both are variants of 'the'.
+
+    :param word: the word to find the stems of
+    """
+    stems = []
+    if len(word) > 1 and word[-1] == 's':  # Plural, probably
+        stems.append(word[:-1])
+    if len(word) > 2 and word[-2:] == 'ly':  # Adverb form of an adjective
+        stems.append(word[:-2])
+    if len(word) > 3 and word[-2:] == 'ed':  # Past tense
+        stems.append(word[:-1])
+    if len(word) > 5 and word[-3:] == 'ing':  # Gerund
+        stems.append(word[:-3])
+    # Perhaps these checks could still be done efficiently with lemmatization
+    return frozenset(stems)
+
+
+def words_too_similar(word1: str, word2: str) -> bool:
+    """Check whether two nonempty words are too similar to follow one another in a poem. (See too_similar.)"""
+    return word1 == word2 or word1 in similarity_stems(word2) or word2 in similarity_stems(word1) or \
+        (word1 in the_variants and word2 in the_variants)
 
 
 def too_similar(word1: str, comparison_val: str_or_list_of_str) -> bool:
@@ -168,26 +250,64 @@ def too_similar(word1: str, comparison_val: str_or_list_of_str) -> bool:
     for word2 in comparison_words:
         if len(word1) == 0 or len(word2) == 0:
             return False
-        if word1 == word2:
-            return True
-        if word1 + 's' == word2 or word2 + 's' == word1:  # Plural, probably
-            return True
-        if word1 + 'ly' == word2 or word2 + 'ly' == word1:  # Adverb form of an adjective
-            return True
-        # Perhaps the latter two checks could still be done efficiently with lemmatization
-        if (len(word1) > 2 and len(word2) > 2) and ((word1[-2] == 'e' and word2 + 'd' == word1) or
-            (word2[-2] == 'e' and word1 + 'd' == word2)):  # Past tense
-            return True
-        if ((len(word1) > 5 and len(word2) > 2) or (len(word2) > 5 and len(word1) > 2)) and \
-                ((word1[-3:] == 'ing' and word2 + 'ing' == word1) or (word2[-3:] == 'ing' and word1 + 'ing' == word2)):
-            # Gerunds
-            return True
-        too_similar_case = ['the', 'thee', 'them']
-        if word1 in too_similar_case and word2 in too_similar_case:
+        if words_too_similar(word1, word2):
             return True
     return False
 
 
+class SimilarityIndex:
+    """A set of words that can tell in constant time whether another word is too similar to any of them, in the sense
+    of too_similar. Empty words are ignored.
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        """
+        :param words: the words to start with
+        """
+        self.words: Set[str] = set()
+        self.stems: Set[str] = set()  # The stems of the words
+        self.has_the_variant = False
+        self.update(words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, word: str):
+        if word:
+            self.words.add(word)
+            self.stems.update(similarity_stems(word))
+            self.has_the_variant = self.has_the_variant or word in the_variants
+
+    def update(self, words: Iterable[str]):
+        for word in words:
+            self.add(word)
+
+    def too_similar(self, word: str) -> bool:
+        """Check whether a word is too similar to any word in the index.
+
+        :param word: the word to check
+        """
+        if not word:
+            return False
+        return word in self.words or word in self.stems or not self.words.isdisjoint(similarity_stems(word)) or \
+            (self.has_the_variant and word in the_variants)
+
+
+def remove_too_similar(word_list: Iterable[str]) -> List[str]:
+    """Return the words of a list, in order, leaving out each word that is too similar to a word before it (including
+    repeats).
+
+    :param word_list: the words to deduplicate
+    """
+    index = SimilarityIndex()
+    kept_words = []
+    for word in word_list:
+        if not index.too_similar(word):
+            index.add(word)
+            kept_words.append(word)
+    return kept_words
+
+
 def correct_a_vs_an(phrase_as_list: List[str]) -> List[str]:
     consonants = 'bcdfghjklmnpqrstvwxyz'
     vowels = 'aeoiu'
@@ -0,0 +1,134 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+
+class WordVectors:
+    """Word embeddings in a memory-mapped float32 matrix with a vocabulary index, for finding similar meaning words
+    (Datamuse's ml) locally.
+
+    Embeddings are converted once, from a GloVe or word2vec file, into two files: <path>.vocab, with the matrix's shape
+    and then one word per row, and <path>.f32, the rows normalized to unit length as raw float32s. Loading maps the
+    matrix instead of reading it, so only the pages a query touches are read, and several processes share them.
+
+    Neighbors are ranked by cosine similarity. The neighbors of a batch of words come from one matrix multiply, and are
+    kept so that asking again costs nothing.
+    """
+
+    def __init__(self, words: List[str], matrix: np.ndarray, batch_size: int = 256):
+        """
+        :param words: the vocabulary, in the order of the matrix's rows
+        :param matrix: the unit length vectors of the words, one per row
+        :param batch_size: the most words whose similarities to the whole vocabulary are computed at once, which
+                           bounds the memory a query takes (batch_size * vocabulary size float32s)
+        """
+        self.words = words
+        self.word_ids: Dict[str, int] = {word: word_id for word_id, word in enumerate(words)}
+        self.matrix = matrix
+        self.batch_size = batch_size
+        self._neighbors: Dict[str, List[Tuple[str, float]]] = {}  # word -> its best neighbors found so far
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.word_ids
+
+    def neighbors(self, words: Iterable[str], k: int) -> Dict[str, List[Tuple[str, float]]]:
+        """Return the k words most similar to each of several words, most similar first, with their cosine
+        similarities. Words that aren't in the vocabulary are left out.
+
+        :param words: the words to find the neighbors of
+        :param k: how many neighbors to return per word
+        """
+        words = [word for word in dict.fromkeys(words) if word in self.word_ids]
+        k = min(k, len(self.words) - 1)
+        if k <= 0:
+            return {word: [] for word in words}
+        # A word's neighbors were cached for at least k if there are at least k of them
+        missing = [word for word in words if len(self._neighbors.get(word, ())) < k]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            word_ids = np.array([self.word_ids[word] for word in batch])
+            similarities = self.matrix[word_ids] @ self.matrix.T  # One multiply for the whole batch
+            similarities[np.arange(len(batch)), word_ids] = -np.inf  # A word isn't its own neighbor
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+            with self._lock:
+                for row, word in enumerate(batch):
+                    neighbor_ids = top[row][np.argsort(-similarities[row, top[row]], kind='stable')]
+                    self._neighbors[word] = [(self.words[neighbor_id], round(float(similarities[row, neighbor_id]), 4))
+                                             for neighbor_id in neighbor_ids]
+        return {word: self._neighbors[word][:k] for word in words}
+
+    @staticmethod
+    def convert(source_path: str, path: str, binary: Optional[bool] = None, max_words: Optional[int] = None):
+        """Convert a GloVe or word2vec embedding file into the files load reads. Only words made of letters are kept,
+        since the others could never be a result.
+
+        :param source_path: the embedding file: GloVe text, word2vec text (with a header line giving the shape), or
+                            word2vec binary
+        :param path: where to write the converted files, without an extension
+        :param binary: whether the file is in word2vec's binary format (default: if its name ends with .bin)
+        :param max_words: keep only this many words; these files list the most frequent words first
+        """
+        binary = source_path.endswith('.bin') if binary is None else binary
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        words: List[str] = []
+        dimensions = None
+        with open(f'{path}.f32.tmp', 'wb') as matrix_file:
+            for word, vector in (_read_binary(source_path) if binary else _read_text(source_path)):
+                if max_words is not None and len(words) >= max_words:
+                    break
+                if not word.isalpha() or (dimensions is not None and len(vector) != dimensions):
+                    continue
+                dimensions = len(vector)
+                norm = np.linalg.norm(vector)
+                matrix_file.write((vector / norm if norm else vector).astype('<f4').tobytes())
+                words.append(word)
+        with open(f'{path}.vocab.tmp', 'w', encoding='utf-8') as vocab_file:
+            vocab_file.write(f'{len(words)} {dimensions or 0}\n')
+            vocab_file.writelines(f'{word}\n' for word in words)
+        os.replace(f'{path}.f32.tmp', f'{path}.f32')
+        os.replace(f'{path}.vocab.tmp', f'{path}.vocab')
+
+    @classmethod
+    def load(cls, path: str, batch_size: int = 256) -> 'WordVectors':
+        """Map the files written by convert.
+
+        :param path: where the converted files are, without an extension
+        :param batch_size: see __init__
+        """
+        with open(f'{path}.vocab', encoding='utf-8') as vocab_file:
+            rows, dimensions = (int(value) for value in vocab_file.readline().split())
+            words = [line.rstrip('\n') for line in vocab_file]
+        matrix = np.memmap(f'{path}.f32', dtype='<f4', mode='r', shape=(rows, dimensions))
+        return cls(words, matrix, batch_size=batch_size)
+
+    @property
+    def stats(self) -> dict:
+        return {'words': len(self.words), 'dimensions': self.matrix.shape[1], 'cached': len(self._neighbors)}
+
+
+def _read_text(source_path: str):
+    with open(source_path, encoding='utf-8', errors='replace') as f:
+        for line_number, line in enumerate(f):
+            parts = line.rstrip().split(' ')
+            if line_number == 0 and len(parts) == 2:
+                continue  # word2vec's header
+            yield parts[0], np.array(parts[1:], dtype=np.float32)
+
+
+def _read_binary(source_path: str):
+    with open(source_path, 'rb') as f:
+        rows, dimensions = (int(value) for value in f.readline().split())
+        for _ in range(rows):
+            word = bytearray()
+            while True:
+                character = f.read(1)
+                if character in (b' ', b''):
+                    break
+                if character != b'\n':  # Each vector may be followed by a newline
+                    word.extend(character)
+            yield word.decode('utf-8', errors='replace'), np.frombuffer(f.read(4 * dimensions), dtype='<f4')
@@ -16,12 +16,14 @@ requirements = [
     'internetarchive==1.8.5',
     'markovify==0.8.0',
     'nltk==3.4.5',
+    'numpy>=1.16',
     'pdf2image==1.12.1',
     'rdflib==4.2.2',
     'pronouncing>=0.2.0',
     'python-datamuse>=1.3.0',
     'spacy>=2.2.3',
     'reportlab>=3.5.26',
+    'requests>=2.22.0',
     'unittest2==1.1.0',
     'wordfreq>=2.2.2',
 ]
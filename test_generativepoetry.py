@@ -1,15 +1,40 @@
+import asyncio
 import itertools
 import os
+import random
 import re
+import tempfile
+import threading
+import time
 import inflect
+import numpy as np
+import requests
 import spacy
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
+from generativepoetry import aiolexigen, lexigen, phonetics, sampling
+from generativepoetry.bigrams import *
+from generativepoetry.cache import *
+from generativepoetry.cooccurrence import *
+from generativepoetry.frequency import *
+from generativepoetry.jolastic import *
+from generativepoetry.lattice import *
+from generativepoetry.lexgraph import *
 from generativepoetry.lexigen import *
+from generativepoetry.meter import *
 from generativepoetry.pdf import *
 from generativepoetry.poemgen import *
+from generativepoetry.providers import *
+from generativepoetry.resilience import *
+from generativepoetry.resources import *
+from generativepoetry.rhymeindex import *
+from generativepoetry.spelling import *
+from generativepoetry.transport import *
 from generativepoetry.utils import *
+from generativepoetry.vectors import *
 from generativepoetry.decomposer import *
+from generativepoetry.startup_report import modules as report_modules, startup_report
 
 spacy_nlp = spacy.load('en_core_web_sm', disable=['ner'])
 spacy_nlp.remove_pipe("parser")
@@ -95,6 +120,21 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(too_similar('thee', 'the'))
         self.assertTrue(too_similar('thee', 'the'))
 
+    def test_similarity_index(self):
+        self.assertEqual(similarity_stems('riposted'), {'riposte'})
+        self.assertEqual(similarity_stems('sings'), {'sing'})
+        self.assertEqual(similarity_stems('sing'), set())
+        index = SimilarityIndex(['riposte', 'spherical', '', 'them'])
+        self.assertEqual(len(index), 3)
+        for word in ['riposte', 'riposted', 'ripostes', 'spherically', 'the', 'thee']:
+            self.assertTrue(index.too_similar(word))
+        for word in ['dogs', 'sphere', '', 'therefore']:
+            self.assertFalse(index.too_similar(word))
+        index.add('dogs')
+        self.assertTrue(index.too_similar('dog'))
+        words = ['dog', 'cat', 'dogs', 'spherical', 'cat', 'spherically', 'thee', 'the', 'mushroom']
+        self.assertEqual(remove_too_similar(words), ['dog', 'cat', 'spherical', 'thee', 'mushroom'])
+
     def test_filter_word(self):
         self.assertFalse(filter_word('an'))
         self.assertFalse(filter_word('nonexistentword'))
@@ -115,6 +155,22 @@ class TestUtils(unittest.TestCase):
         exclude_words = ['diamond', 'dinosaur']
         self.assertEqual(filter_word_list(word_list, exclude_words=exclude_words), ['arraignment'])
 
+    def test_word_filter(self):
+        word_filter = WordFilter()
+        word_list = ['the', 'underworld', 'gh0st', 'errantry', 'an', 'thew', 'crepuscular', 'dinosaur', 'dynosaur']
+        exclude_words = ['dinosaur']
+        self.assertEqual(word_filter.filter_many(word_list, exclude_words=exclude_words),
+                         ['the', 'underworld', 'crepuscular'])
+        self.assertEqual(exclude_words, ['dinosaur'])  # The caller's list isn't extended with the unfitting words
+        self.assertEqual(word_filter.filter_many(word_list, spellcheck=False, exclude_words={'the'}),
+                         ['underworld', 'crepuscular', 'dinosaur'])
+        self.assertIn('thew', word_filter.unfitting_words)
+        self.assertTrue(word_filter.filter_word('crepuscular'))
+        self.assertFalse(word_filter.filter_word('crepuscular', word_frequency_threshold=1e-07))
+        self.assertTrue(word_filter.filter_word('errantry', word_frequency_threshold=1e-08))
+        self.assertFalse(word_filter.filter_word('errantry'))  # The verdict for the default threshold is unchanged
+        self.assertRaises(ValueError, lambda: word_filter.filter_many(['dinosaur', None]))
+
     def test_sort_by_rarity(self):
         unsorted_words = ['cat', 'catabasis', 'hue', 'corncob',  'the', 'Catalan', 'errant']
         correctly_sorted_words = ['catabasis', 'corncob', 'errant', 'hue', 'Catalan', 'cat', 'the']
@@ -127,6 +183,147 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(correct_a_vs_an(needs_no_correction), needs_no_correction)
 
 
+class TestFrequencyTable(unittest.TestCase):
+
+    def test_frequency(self):
+        table = FrequencyTable()
+        self.assertGreater(table.frequency('errantry'), 0)
+        self.assertEqual(table.frequency('nonexistentword'), 0)
+        self.assertEqual(len(table), 2)
+        table.frequency('errantry')
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.zipf('nonexistentword'), 0)
+        self.assertGreater(table.zipf('the'), 7)
+
+    def test_rarity(self):
+        unsorted_words = ['cat', 'catabasis', 'hue', 'corncob', 'the', 'errant']
+        correctly_sorted_words = ['catabasis', 'corncob', 'errant', 'hue', 'cat', 'the']
+        table = FrequencyTable()
+        self.assertEqual(table.sort_by_rarity(unsorted_words), correctly_sorted_words)
+        self.assertEqual(table.rarest(unsorted_words, 3), correctly_sorted_words[:3])
+        self.assertEqual(table.rarest(unsorted_words, None), correctly_sorted_words)
+        self.assertEqual(table.rarest([], 3), [])
+        self.assertEqual(table.sort_by_rarity(['nonexistentword', 'the', 'qwxzv']), ['nonexistentword', 'qwxzv', 'the'])
+
+    def test_zipf_tiers(self):
+        tiers = FrequencyTable().tiers(['the', 'cat', 'catabasis', 'corncob', 'the'])
+        self.assertEqual(len(tiers), 4)
+        self.assertEqual(tiers.words_in_tier(7), ['the'])
+        self.assertIn(tiers.random_rare_word(), ['catabasis', 'corncob'])
+        self.assertIsNone(tiers.random_rare_word(max_tier=-1))
+        self.assertIsNone(ZipfTiers([]).random_rare_word())
+
+
+class TestSpellChecker(unittest.TestCase):
+    affixes = ['SET UTF-8', 'NEEDAFFIX X', 'PFX U Y 1', 'PFX U 0 un .', 'SFX S Y 2', 'SFX S y ies [^aeiou]y',
+               'SFX S 0 s [^y]', 'SFX D Y 1', 'SFX D 0 ed [^ey]']
+    stems = ['4', 'cat/S', 'pony/S', 'lock/UDS', 'gizm/XS']
+    expanded = {'cat', 'cats', 'pony', 'ponies', 'lock', 'locks', 'locked', 'unlock', 'unlocks', 'unlocked', 'gizms'}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dic_path = os.path.join(self.directory.name, 'test.dic')
+        self.aff_path = os.path.join(self.directory.name, 'test.aff')
+        with open(self.dic_path, 'w') as f:
+            f.write('\n'.join(self.stems) + '\n')
+        with open(self.aff_path, 'w') as f:
+            f.write('\n'.join(self.affixes) + '\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_expand_dictionary(self):
+        self.assertEqual(set(expand_dictionary(self.dic_path, self.aff_path)), self.expanded)
+
+    def test_spell(self):
+        artifact = os.path.join(self.directory.name, 'spelling.txt.gz')
+        checker = SpellChecker(self.dic_path, self.aff_path)
+        self.assertEqual(checker.expand(artifact), len(self.expanded))
+        self.assertTrue(os.path.exists(artifact))
+        self.assertTrue(checker.spell('unlocked'))
+        self.assertEqual(checker.stats['lookups'], 0)
+        self.assertEqual(checker.spell_many(['ponies', 'unpony', 'unpony', 'cats']), [True, False, False, True])
+        self.assertEqual(checker.stats['lookups'], 1)
+        self.assertFalse(checker.spell('unpony'))
+        self.assertEqual(checker.stats['lookups'], 1)
+        reloaded = SpellChecker(self.dic_path, self.aff_path)
+        reloaded.expand(artifact)
+        self.assertEqual(reloaded.known_words, checker.known_words)
+
+
+class TestLazyResource(unittest.TestCase):
+
+    def test_load(self):
+        calls = []
+
+        def load_resource():
+            calls.append(1)
+            return {'word': 'tintinnabulation'}
+
+        resource = LazyResource(load_resource)
+        self.assertFalse(resource.loaded)
+        self.assertEqual(resource.get('word'), 'tintinnabulation')
+        self.assertTrue(resource.loaded)
+        self.assertIs(resource.load(), resource.load())
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn(None, lazy_resources)
+        self.assertEqual(LazyResource(lambda: len)('abc'), 3)
+
+    def test_named_resources(self):
+        for name in ['Hunspell dictionary', 'spaCy en_core_web_sm', 'punkt sentence detector', 'inflect engine',
+                     'NLTK stopwords']:
+            self.assertIn(name, lazy_resources)
+        self.assertIs(get_sentence_detector(), sent_detector.load())
+        self.assertEqual(get_inflector().plural('cat'), 'cats')
+
+    def test_startup_report(self):
+        rows = startup_report(load_resources=False)
+        self.assertEqual([row[0] for row in rows], [f'import {module}' for module in report_modules])
+        for name, seconds, megabytes in rows:
+            self.assertGreaterEqual(seconds, 0)
+
+
+class LookupTestCase(unittest.TestCase):
+    """For tests that mock the API: earlier tests' failed requests shouldn't leave the circuit breaker open."""
+
+    def setUp(self):
+        lexigen.transport.circuit_breaker.reset()
+
+
+class TestSampling(LookupTestCase):
+
+    def test_sample(self):
+        population = ['a', 'b', 'a', 'c', 'b', 'd']
+        self.assertEqual(sampling.unique(population), ['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(sampling.sample(population)), ['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(sampling.sample(population, 10)), ['a', 'b', 'c', 'd'])
+        sample = sampling.sample(population, 2)
+        self.assertEqual(len(set(sample)), 2)
+        self.assertTrue(set(population).issuperset(sample))
+        self.assertEqual(sampling.sample(population, 3, rng=random.Random(7)),
+                         sampling.sample(population, 3, rng=random.Random(7)))
+        self.assertEqual(sampling.sample([], 3), [])
+
+    def test_weighted_sample(self):
+        scores = {'a': 1000, 'b': 1, 'c': 0}
+        self.assertEqual(sorted(sampling.weighted_sample(scores)), ['a', 'b', 'c'])
+        self.assertEqual(sampling.weighted_sample(scores)[-1], 'c')
+        rng = random.Random(0)
+        first_picks = [sampling.weighted_sample(scores, 1, rng=rng)[0] for i in range(100)]
+        self.assertGreater(first_picks.count('a'), 90)
+        self.assertNotIn('c', first_picks)
+        self.assertEqual(sorted(sampling.weighted_sample([('a', 1), ('b', 2), ('a', 5)])), ['a', 'b'])
+        self.assertEqual(sampling.weighted_sample({}, 3), [])
+
+    def test_weighted_lookup(self):
+        response = [{'word': 'cumulus', 'score': 9000}, {'word': 'overcast', 'score': 1}]
+        with patch.object(LiveTransport, 'fetch', return_value=response), \
+                patch('generativepoetry.lexigen.lexical_cache', LexicalCache()):
+            self.assertEqual(sorted(similar_meaning_words('cloud', sample_size=None, weighted=True)),
+                             ['cumulus', 'overcast'])
+            self.assertEqual(similar_meaning_words('cloud', sample_size=1, weighted=True), ['cumulus'])
+
+
 class TestLexigen(unittest.TestCase):
     def test_rhymes(self):
         self.assertEqual(rhymes('metamorphosis'), [])
@@ -152,6 +349,11 @@ class TestLexigen(unittest.TestCase):
         self.assertIsNone(rhyme('metamorphosis'))
         self.assertIn(rhyme('sprouting'), rhymes('sprouting'))
 
+    def test_is_rhymable(self):
+        self.assertTrue(is_rhymable('sprouting'))
+        self.assertFalse(is_rhymable('metamorphosis'))
+        self.assertFalse(is_rhymable('nonexistentword'))
+
     def test_extract_sample(self):
         self.assertEqual(extract_sample([], sample_size=100), [])
         self.assertEqual(extract_sample(['a'], sample_size=100), ['a'])
@@ -159,6 +361,10 @@ class TestLexigen(unittest.TestCase):
         sample = extract_sample(['a','b','c','d','e','f'], sample_size=4)
         self.assertNotEqual(sorted(sample), ['a','b','c','d','e','f'])
         self.assertTrue(set(['a','b','c','d','e','f']).issuperset(set(sample)))
+        self.assertEqual(sorted(extract_sample(['a', 'b', 'a'])), ['a', 'b'])
+        self.assertEqual(extract_sample(['a', 'b', 'c'], weights={'a': 1, 'b': 1}, sample_size=None)[-1], 'c')
+        self.assertEqual(extract_sample(['a', 'b', 'c', 'd'], sample_size=2, rng=random.Random(1)),
+                         extract_sample(['a', 'b', 'c', 'd'], sample_size=2, rng=random.Random(1)))
 
     def test_similar_sounding_words(self):
         similar_sounding_to_homonym_words = ['hastening', 'heightening', 'hominid', 'hominy', 'homonyms', 'summoning',
@@ -330,7 +536,681 @@ class TestLexigen(unittest.TestCase):
         self.assertIn(related_rare_word('comical'), result_possibilities)
 
 
-class TestStochasticJolasticWordGenerator(unittest.TestCase):
+class TestRhymeIndex(unittest.TestCase):
+
+    def test_rhymes(self):
+        rhyme_index = RhymeIndex()
+        self.assertEqual(rhyme_index.rhymes('clouds'), ('crowds', 'shrouds'))
+        self.assertEqual(rhyme_index.rhymes('metamorphosis'), ())
+        self.assertNotIn('permit', rhyme_index.rhymes('permit'))
+        # Permit has two pronunciations, and so two rhyming parts
+        self.assertTrue(set(rhyme_index.rhymes('permit')).issuperset({'admit', 'armpit'}))
+        self.assertIn(rhyme_index.random_rhyme('clouds'), ['crowds', 'shrouds'])
+        self.assertIsNone(rhyme_index.random_rhyme('metamorphosis'))
+        self.assertRaises(ValueError, lambda: rhyme_index.rhymes(None))
+
+    def test_rhymable_words(self):
+        rhyme_index = RhymeIndex()
+        rhymable_words = rhyme_index.rhymable_words()
+        self.assertIn('clouds', rhymable_words)
+        self.assertIn('sprouting', rhymable_words)
+        self.assertNotIn('metamorphosis', rhymable_words)
+        self.assertTrue(rhyme_index.is_rhymable('clouds'))
+        self.assertFalse(rhyme_index.is_rhymable('metamorphosis'))
+
+
+class TestStressIndex(unittest.TestCase):
+
+    def test_stress_patterns(self):
+        stress_index = StressIndex()
+        self.assertEqual(stress_index.syllable_count('remember'), 3)
+        self.assertEqual(stress_index.stress_patterns('remember'), ['010'])
+        self.assertEqual(stress_index.stress_patterns('night'), ['x'])  # One syllable words fit either position
+        self.assertEqual(stress_index.stress_patterns('fire'), ['10', 'x'])
+        self.assertIsNone(stress_index.syllable_count('nonexistentword'))
+        self.assertEqual(stress_index.stress_patterns('nonexistentword'), [])
+
+    def test_fits(self):
+        stress_index = StressIndex()
+        iambic_pentameter = meters['iambic pentameter']
+        self.assertEqual(stress_index.advance('remember', iambic_pentameter), 3)
+        self.assertIsNone(stress_index.advance('garden', iambic_pentameter))
+        self.assertEqual(stress_index.advance('garden', iambic_pentameter, 3), 5)
+        self.assertEqual(stress_index.advance('fire', iambic_pentameter), 1)  # Only its one syllable pronunciation fits
+        self.assertIsNone(stress_index.advance('night', iambic_pentameter, 8, ends_line=True))  # Leaves a syllable
+        self.assertEqual(stress_index.advance('believe', iambic_pentameter, 8, ends_line=True), 10)
+        self.assertIsNone(stress_index.advance('believe', iambic_pentameter, 8))  # Leaves no syllable
+        self.assertTrue(stress_index.fits('garden', Meter.syllables(3)))
+        ending = stress_index.frequent_words_fitting(iambic_pentameter, 8, ends_line=True)
+        self.assertIn('believe', ending)
+        self.assertTrue(all(stress_index.fits(word, iambic_pentameter, 8, ends_line=True) for word in ending))
+        self.assertRaises(ValueError, lambda: Meter('da-DUM'))
+        query = WordQuery().fits_meter(iambic_pentameter, 8, ends_line=True)
+        self.assertTrue(query.matches('believe'))
+        self.assertFalse(query.matches('garden'))
+
+
+class TestLexicalCache(LookupTestCase):
+
+    def test_memory_tier(self):
+        cache = LexicalCache(max_memory_entries=2)
+        self.assertIsNone(cache.get(('sl', 'homonym', 20)))
+        cache.set(('sl', 'homonym', 20), [{'word': 'synonym', 'score': 90}])
+        self.assertEqual(cache.get(('sl', 'homonym', 20)), [{'word': 'synonym', 'score': 90}])
+        self.assertIsNone(cache.get(('sl', 'homonym', 50)))  # max is part of the key
+        cache.set(('ml', 'vampire', 10), [{'word': 'ghoul', 'score': 80}])
+        cache.set(('lc', 'magic', None), [{'word': 'wand', 'score': 70}])
+        self.assertIsNone(cache.get(('sl', 'homonym', 20)))  # least recently used, so evicted
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 3)
+
+    def test_negative_entries_and_ttl(self):
+        cache = LexicalCache(ttl=100, negative_ttl=10)
+        cache.set(('ml', 'nonexistentword', 20), [])
+        cache.set(('ml', 'vampire', 20), [{'word': 'ghoul', 'score': 80}])
+        self.assertEqual(cache.get(('ml', 'nonexistentword', 20)), [])
+        self.assertEqual(cache.stats['negative_hits'], 1)
+        with patch('generativepoetry.cache.time.time', return_value=time.time() + 50):
+            self.assertIsNone(cache.get(('ml', 'nonexistentword', 20)))
+            self.assertIsNotNone(cache.get(('ml', 'vampire', 20)))
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lexicon.sqlite3')
+            LexicalCache(path).set(('rel_trg', 'crepuscular', 20), [{'word': 'dusk', 'score': 100}])
+            cache = LexicalCache(path)
+            self.assertEqual(cache.get(('rel_trg', 'crepuscular', 20)), [{'word': 'dusk', 'score': 100}])
+            self.assertEqual(cache.stats['disk_hits'], 1)
+            self.assertEqual(cache.lookup(('rel_trg', 'crepuscular', 20)), ([{'word': 'dusk', 'score': 100}], 'memory'))
+            self.assertEqual(cache.stats['memory_hits'], 1)
+            self.assertEqual(LexicalCache(path).lookup(('rel_trg', 'crepuscular', 20))[1], 'disk')
+            self.assertEqual(cache.lookup(('rel_trg', 'gloaming', 20)), (None, None))
+            cache = LexicalCache(path, max_disk_entries=10)
+            for i in range(20):
+                cache.set(('sl', 'word' + str(i), 20), [{'word': 'bird', 'score': i}])
+            self.assertLessEqual(cache._connect().execute('SELECT COUNT(*) FROM lookups').fetchone()[0], 10)
+
+    def test_datamuse_lookup_uses_cache(self):
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', return_value=[{'word': 'wand', 'score': 70}]) as mock_fetch:
+            self.assertEqual(datamuse_lookup('lc', 'magic', 10), [{'word': 'wand', 'score': 70}])
+            self.assertEqual(datamuse_lookup('lc', 'magic', 10), [{'word': 'wand', 'score': 70}])
+            mock_fetch.assert_called_once_with({'lc': 'magic', 'max': 10})
+
+    def test_datamuse_lookup_compacts_response(self):
+        response = [{'word': 'grimoire', 'score': 900, 'tags': ['n'], 'numSyllables': 2},
+                    {'word': 'wand', 'score': 800}, {'word': 'hocus'}]
+        cache = LexicalCache()
+        with patch('generativepoetry.lexigen.lexical_cache', cache), \
+                patch.object(LiveTransport, 'fetch', return_value=response):
+            self.assertEqual(datamuse_lookup('ml', 'magic', 10),
+                             [{'word': 'grimoire', 'score': 900}, {'word': 'wand', 'score': 800}, {'word': 'hocus'}])
+        self.assertEqual(cache.peek(('ml', 'magic', 10))[0], {'word': 'grimoire', 'score': 900})
+
+
+class TestFixtureTransport(LookupTestCase):
+
+    def test_record_and_replay(self):
+        live_transport = LiveTransport(api)
+        vampire_response = [{'word': 'ghoul', 'score': 80}, {'word': 'lamia', 'score': 70}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fixture.json.gz')
+            self.assertRaises(FileNotFoundError, lambda: FixtureTransport(path, mode='replay'))
+            self.assertRaises(ValueError, lambda: FixtureTransport(path, mode='record'))
+            self.assertRaises(ValueError, lambda: FixtureTransport(path, mode='rewind', transport=live_transport))
+            with patch.object(live_transport, 'fetch', return_value=vampire_response) as mock_fetch:
+                recorder = FixtureTransport(path, mode='record', transport=live_transport)
+                self.assertEqual(recorder.fetch({'ml': 'vampire', 'max': 20}), vampire_response)
+                self.assertEqual(recorder.fetch({'max': 20, 'ml': 'vampire'}), vampire_response)
+                recorder.save()
+                mock_fetch.assert_called_once_with({'ml': 'vampire', 'max': 20})
+            with patch.object(live_transport, 'fetch') as mock_fetch:
+                replayer = FixtureTransport(path, mode='replay')
+                self.assertEqual(replayer.fetch({'ml': 'vampire', 'max': 20}), vampire_response)
+                self.assertEqual(replayer.fetch({'ml': 'gothic', 'max': 20}), [])
+                self.assertEqual(replayer.misses, 1)
+                strict_replayer = FixtureTransport(path, mode='strict')
+                self.assertRaises(UnrecordedQueryError, lambda: strict_replayer.fetch({'ml': 'gothic', 'max': 20}))
+                mock_fetch.assert_not_called()
+
+    def test_use_fixture(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fixture.json.gz')
+            with patch.object(LiveTransport, 'fetch', return_value=[{'word': 'ghoul', 'score': 80}]):
+                with use_fixture(path, mode='record'):
+                    self.assertEqual(similar_meaning_words('vampire', sample_size=None), ['ghoul'])
+            with patch.object(LiveTransport, 'fetch') as mock_fetch:
+                with use_fixture(path, mode='strict'):
+                    self.assertEqual(similar_meaning_words('vampire', sample_size=None), ['ghoul'])
+                    self.assertRaises(UnrecordedQueryError, lambda: similar_meaning_words('gothic'))
+                mock_fetch.assert_not_called()
+
+
+class TestConcurrentLookups(LookupTestCase):
+
+    @staticmethod
+    def slow_fetch(query):
+        time.sleep(.2)
+        return [{'word': 'ghoul', 'score': 80}] if query.get('ml') == 'vampire' else []
+
+    def test_prefetch(self):
+        words = ['vampire', 'gothic', 'crypt', 'ghost', 'bats']
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', side_effect=self.slow_fetch) as mock_fetch:
+            start = time.time()
+            self.assertEqual(similar_meaning_words(words, sample_size=None), ['ghoul'])
+            self.assertLess(time.time() - start, .2 * len(words) / 2)
+            self.assertEqual(mock_fetch.call_count, len(words))
+
+    def test_aiolexigen(self):
+        words = ['vampire', 'gothic', 'crypt', 'ghost', 'bats']
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', side_effect=self.slow_fetch) as mock_fetch:
+            start = time.time()
+            self.assertEqual(asyncio.run(aiolexigen.similar_meaning_words(words, sample_size=None)), ['ghoul'])
+            self.assertLess(time.time() - start, .2 * 2)
+            start = time.time()
+            responses = asyncio.run(aiolexigen.datamuse_lookups(related_rare_lookups(words)))
+            self.assertEqual(len(responses), len(words) * 3)
+            self.assertLess(time.time() - start, .2 * 3)  # Two rounds of eight concurrent lookups
+            results = asyncio.run(aiolexigen.related_rare_words(words, sample_size=None))
+            self.assertTrue(set(rhymes(words, sample_size=None) + ['ghoul']).issuperset(set(results)))
+            self.assertEqual(mock_fetch.call_count, len(words) * 4)
+            self.assertRaises(ValueError, lambda: asyncio.run(aiolexigen.contextually_linked_words(['compound word'])))
+            threads = []
+
+            def filter_and_sample(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return []
+            with patch('generativepoetry.lexigen.similar_meaning_words', filter_and_sample):
+                asyncio.run(aiolexigen.similar_meaning_words(words))
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())  # Not on the event loop's thread
+
+
+class TestSingleFlight(LookupTestCase):
+
+    def test_do(self):
+        flights = SingleFlight()
+        barrier = threading.Barrier(6)
+
+        def slow_call(word):
+            time.sleep(.2)
+            return [word]
+
+        def caller():
+            barrier.wait()
+            return flights.do(('ml', 'vampire', 20), slow_call, 'ghoul')
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(lambda _: caller(), range(6)))
+        self.assertEqual(results, [['ghoul']] * 6)
+        self.assertEqual(flights.stats, {'calls': 1, 'coalesced': 5})
+        self.assertEqual(flights.do(('ml', 'vampire', 20), slow_call, 'lamia'), ['lamia'])  # Not in flight anymore
+
+        def failing_call():
+            raise ValueError('Nonexistent word')
+
+        self.assertRaises(ValueError, lambda: flights.do(('ml', 'nonexistentword', 20), failing_call))
+        self.assertEqual(flights.stats['calls'], 3)
+
+    def test_datamuse_lookup_coalescing(self):
+        barrier = threading.Barrier(4)
+
+        def slow_fetch(query):
+            time.sleep(.2)
+            return [{'word': 'wand', 'score': 70}]
+
+        def caller():
+            barrier.wait()
+            return datamuse_lookup('lc', 'magic', 10)
+
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.lookup_flights', SingleFlight()) as flights, \
+                patch.object(LiveTransport, 'fetch', side_effect=slow_fetch) as mock_fetch:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: caller(), range(4)))
+            self.assertEqual(results, [[{'word': 'wand', 'score': 70}]] * 4)
+            mock_fetch.assert_called_once_with({'lc': 'magic', 'max': 10})
+            self.assertEqual(flights.stats['coalesced'], 3)
+
+
+class FlakyTransport:
+
+    def __init__(self, failures, delay=0):
+        self.failures = list(failures)
+        self.delay = delay
+        self.calls = 0
+
+    def fetch(self, query):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.failures:
+            raise self.failures.pop(0)
+        return [{'word': 'ghoul', 'score': 80}]
+
+
+class TestResilience(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=50, burst=5)
+        start = time.time()
+        for i in range(10):
+            self.assertTrue(bucket.acquire())
+        self.assertGreaterEqual(time.time() - start, 4 / 50)
+        self.assertFalse(TokenBucket(rate=1, burst=0).acquire(timeout=.01))
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=.1)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        time.sleep(.1)
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # Only one trial request at a time
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        time.sleep(.1)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.times_opened, 2)
+
+    def test_retries(self):
+        flaky = FlakyTransport([requests.ConnectionError(), requests.Timeout()])
+        transport = ResilientTransport(flaky, base_delay=0)
+        self.assertEqual(transport.fetch({'ml': 'vampire'}), [{'word': 'ghoul', 'score': 80}])
+        self.assertEqual((flaky.calls, transport.stats['retries']), (3, 2))
+        transport = ResilientTransport(FlakyTransport([ValueError('Not transient')]), base_delay=0)
+        self.assertRaises(ValueError, lambda: transport.fetch({'ml': 'vampire'}))
+        self.assertEqual(transport.stats['retries'], 0)
+        flaky = FlakyTransport([requests.ConnectionError()] * 10)
+        transport = ResilientTransport(flaky, circuit_breaker=CircuitBreaker(failure_threshold=3), max_retries=5,
+                                       base_delay=0)
+        self.assertRaises(LookupUnavailableError, lambda: transport.fetch({'ml': 'vampire'}))
+        self.assertRaises(CircuitOpenError, lambda: transport.fetch({'ml': 'vampire'}))
+        self.assertEqual(flaky.calls, 3)
+        self.assertEqual(transport.stats['rejected'], 2)
+
+    def test_hedging(self):
+        transport = ResilientTransport(FlakyTransport([], delay=.01), min_hedge_delay=.05)
+        for i in range(20):
+            transport.fetch({'ml': 'vampire'})
+        self.assertEqual(transport.stats['hedges'], 0)
+        transport.transport.delay = .3
+        start = time.time()
+        self.assertEqual(transport.fetch({'ml': 'vampire'}), [{'word': 'ghoul', 'score': 80}])
+        self.assertEqual(transport.stats['hedges'], 1)
+        self.assertLess(time.time() - start, .3 + .05 + .1)
+
+    def test_datamuse_lookup_degrades(self):
+        graph = RelationGraph()
+        graph.add('ml', 'magic', [{'word': 'lantern', 'score': 900}, {'word': 'spell', 'score': 800}], 10)
+        failing_transport = ResilientTransport(FlakyTransport([requests.ConnectionError()] * 10), max_retries=1,
+                                               base_delay=0)
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache(ttl=0)) as cache, \
+                patch('generativepoetry.lexigen.relation_graph', graph), \
+                patch('generativepoetry.lexigen.transport', failing_transport):
+            self.assertEqual(datamuse_lookup('ml', 'magic', 1), [{'word': 'lantern', 'score': 900}])
+            self.assertRaises(LookupUnavailableError, lambda: datamuse_lookup('ml', 'gothic', 10))
+            cache.set(('rel_trg', 'magic', 10), [{'word': 'rabbit', 'score': 700}])  # Expired right away
+            self.assertEqual(datamuse_lookup('rel_trg', 'magic', 10), [{'word': 'rabbit', 'score': 700}])
+            self.assertEqual(cache.stats['stale_hits'], 1)
+            self.assertIsNone(cache.peek(('ml', 'magic', 1)))  # Degraded results aren't cached
+
+
+class TestLatencyBudget(LookupTestCase):
+
+    def test_budget(self):
+        budget = LatencyBudget(100)
+        self.assertTrue(budget.affords(.05))
+        self.assertFalse(budget.affords(.5))
+        self.assertLessEqual(budget.remaining(), .1)
+        self.assertTrue(LatencyBudget().affords(1000))
+        self.assertIsNone(LatencyBudget().remaining())
+        self.assertIsNone(current_budget())
+        with latency_budget(100) as budget:
+            self.assertIs(current_budget(), budget)
+            record_tier('api')
+            record_tier('memory')
+            record_tier('memory')
+        self.assertIsNone(current_budget())
+        record_tier('api')  # Not counted anywhere
+        self.assertEqual(budget.report.counts, {'memory': 2, 'disk': 0, 'local': 0, 'api': 1, 'none': 0})
+        self.assertAlmostEqual(budget.report.shares['memory'], 2 / 3)
+
+    def test_datamuse_lookup_within_budget(self):
+        graph = RelationGraph()
+        graph.add('ml', 'magic', [{'word': 'lantern', 'score': 900}], 10)
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()) as cache, \
+                patch('generativepoetry.lexigen.relation_graph', graph), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            cache.set(('rel_trg', 'magic', 10), [{'word': 'rabbit', 'score': 700}])
+            index = phonetics.PhoneticIndex(pronunciations=[('magic', 'M AE1 JH IH0 K'), ('majik', 'M AE1 JH IH0 K')])
+            with latency_budget(0) as budget:
+                self.assertEqual(datamuse_lookup('rel_trg', 'magic', 10), [{'word': 'rabbit', 'score': 700}])
+                self.assertEqual(datamuse_lookup('ml', 'magic', 10), [{'word': 'lantern', 'score': 900}])
+                self.assertEqual(datamuse_lookup('lc', 'magic', 10), [])
+                self.assertEqual(datamuse_lookup('sl', 'magic', 10), [])  # Not answered with some other relation
+                with patch('generativepoetry.lexigen.phonetic_index', LazyResource(lambda: index)):
+                    self.assertEqual(datamuse_lookup('sl', 'magic', 10), [{'word': 'majik', 'score': 4}])
+            self.assertEqual(budget.report.counts, {'memory': 2, 'disk': 0, 'local': 1, 'api': 0, 'none': 2})
+            self.assertIsNone(cache.peek(('lc', 'magic', 10)))  # Nothing the budget ruled out is cached
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', return_value=[{'word': 'wand', 'score': 70}]):
+            with latency_budget(10000) as budget:
+                self.assertEqual(datamuse_lookup('lc', 'magic', 10), [{'word': 'wand', 'score': 70}])
+                datamuse_lookup('lc', 'magic', 10)
+                lexigen.prefetch([('lc', 'wand', 10), ('lc', 'spell', 10)])  # Pool threads count toward the budget
+            self.assertEqual(budget.report.counts['api'], 3)
+            self.assertEqual(budget.report.counts['memory'], 1)
+
+
+class TestRelationGraph(LookupTestCase):
+    response = [{'word': 'lantern', 'score': 900}, {'word': 'spell', 'score': 800}, {'word': 'trick', 'score': 700}]
+
+    def test_add(self):
+        graph = RelationGraph()
+        self.assertIsNone(graph.neighbors('ml', 'magic', 10))
+        graph.add('ml', 'magic', self.response, 3)
+        self.assertEqual(graph.neighbors('ml', 'magic', 2), ['lantern', 'spell'])
+        self.assertEqual(graph.neighbors('ml', 'magic', 3), ['lantern', 'spell', 'trick'])
+        self.assertIsNone(graph.neighbors('ml', 'magic', 10))  # There may be more than 3
+        self.assertIsNone(graph.neighbors('sl', 'magic', 1))
+        graph.add('ml', 'magic', self.response[:1], 2)  # Ignored, since the lookup was smaller
+        self.assertEqual(graph.neighbors('ml', 'magic', 3), ['lantern', 'spell', 'trick'])
+        graph.add('ml', 'spell', self.response[:1], 10)
+        self.assertEqual(graph.neighbors('ml', 'spell', 100), ['lantern'])  # Datamuse had no more to give
+        self.assertEqual(graph.scored_neighbors('ml', 'magic'), {'lantern': 900, 'spell': 800, 'trick': 700})
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(graph.stats['explored'], 2)
+        self.assertEqual(graph.stats['edges'], 4)
+
+    def test_save_and_load(self):
+        graph = RelationGraph()
+        graph.add('ml', 'magic', self.response, 3)
+        graph.add('lc', 'lantern', self.response[1:], 10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'relations.json.gz')
+            graph.save(path)
+            loaded = RelationGraph.load(path)
+        self.assertEqual(loaded.words, graph.words)
+        self.assertEqual(loaded.neighbors('ml', 'magic', 3), ['lantern', 'spell', 'trick'])
+        self.assertEqual(loaded.neighbors('lc', 'lantern', 10), ['spell', 'trick'])
+        self.assertEqual(loaded.scored_neighbors('lc', 'lantern'), {'spell': 800, 'trick': 700})
+
+    def test_datamuse_lookup(self):
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()) as graph, \
+                patch.object(LiveTransport, 'fetch', return_value=self.response):
+            datamuse_lookup('rel_trg', 'magic', 10)
+            datamuse_lookup('ml', 'magic')
+        self.assertEqual(graph.neighbors('rel_trg', 'magic', 10), ['lantern', 'spell', 'trick'])
+        self.assertEqual(graph.limits['ml'][graph.word_ids['magic']], 100)
+
+
+class TestBigramIndex(LookupTestCase):
+    text = 'The white rabbit ran. The white queen ran after the rabbit; the rabbit\u2019s watch stopped.'
+
+    def test_add_text(self):
+        index = BigramIndex()
+        index.add_text(self.text)
+        self.assertEqual(index.scored_following('the'), [('white', 2), ('rabbit', 1), ("rabbit's", 1)])
+        self.assertEqual(index.following('the', 1), ['white'])
+        self.assertEqual(index.following('rabbit'), ['ran'])  # Not 'the', which follows it across a semicolon
+        self.assertNotIn('stopped', index)
+        self.assertNotIn('nonexistentword', index)
+        index.add_text('The rabbit ran. The rabbit ran.')
+        self.assertEqual(index.following('the'), ['rabbit', 'white', "rabbit's"])
+        self.assertEqual(index.stats['texts'], 2)
+        self.assertEqual(BigramIndex.from_texts([self.text], min_count=2).stats['ranked_bigrams'], 1)
+        # Adding texts one at a time, with lookups in between, gives the same index as counting them all at once
+        index = BigramIndex(min_count=2)
+        index.add_text('The dark night.')
+        self.assertEqual(index.following('dark'), [])
+        index.add_text('The dark night.')
+        self.assertEqual(index.following('dark'), ['night'])
+        all_at_once = BigramIndex.from_texts(['The dark night.'] * 2, min_count=2)
+        self.assertEqual(all_at_once.scored_following('the'), index.scored_following('the'))
+        self.assertEqual(all_at_once.stats, index.stats)
+
+    def test_save_and_load(self):
+        index = BigramIndex.from_texts([self.text], min_count=2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bigrams.json.gz')
+            index.save(path)
+            loaded = BigramIndex.load(path)
+        self.assertEqual(loaded.scored_following('white'), index.scored_following('white'))
+        self.assertEqual(loaded.stats, index.stats)
+        loaded.add_text(self.text)  # Counts below min_count survive saving, so they still add up
+        self.assertEqual(loaded.following('rabbit'), ['ran'])
+
+    def test_frequently_following_words(self):
+        index = BigramIndex.from_texts([self.text, 'The white cliffs. The white horses. The white knight.'])
+        with patch('generativepoetry.lexigen.bigram_index', index), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            self.assertEqual(sorted(frequently_following_words('white', sample_size=None)),
+                             ['cliffs', 'horses', 'knight', 'queen', 'rabbit'])
+            self.assertEqual(datamuse_lookup('lc', 'white', 2),
+                             [{'word': 'rabbit', 'score': 1}, {'word': 'queen', 'score': 1}])
+
+
+class TestCooccurrenceIndex(LookupTestCase):
+    text = 'The sailor rowed the boat across the sea. The sea rocked the boat. A sailor loves the sea and his boat. ' \
+           'The baker baked bread. The bread was warm.'
+    more_text = 'The baker sold bread. A sailor ate the bread.'
+
+    def test_add_text(self):
+        index = CooccurrenceIndex(window=3, min_count=2)
+        index.add_text(self.text)
+        self.assertEqual(index.triggers('sea'), ['boat', 'the'])
+        self.assertEqual(index.triggers('sea', 1), ['boat'])
+        self.assertGreater(index.scored_triggers('sea')[0][1], index.scored_triggers('sea')[1][1])
+        self.assertNotIn('baker', index)  # Only co-occurred with bread once
+        self.assertNotIn('warm', index)  # Not within the window of bread in the sentence before
+        index.add_text(self.more_text)
+        self.assertEqual(index.triggers('baker'), ['bread', 'the'])
+        self.assertEqual(index.stats['texts'], 2)
+        # Adding texts one at a time gives the same index as counting them all at once
+        all_at_once = CooccurrenceIndex.from_texts([self.text, self.more_text], window=3, min_count=2)
+        self.assertEqual(all_at_once.scored_triggers('bread'), index.scored_triggers('bread'))
+        self.assertEqual(all_at_once.stats, index.stats)
+
+    def test_save_and_load(self):
+        index = CooccurrenceIndex.from_texts([self.text, self.more_text], window=3, min_count=2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cooccurrence.json.gz')
+            index.save(path)
+            loaded = CooccurrenceIndex.load(path)
+        self.assertEqual(loaded.scored_triggers('sea'), index.scored_triggers('sea'))
+        self.assertEqual(loaded.stats, index.stats)
+
+    def test_contextually_linked_words(self):
+        index = CooccurrenceIndex.from_texts([self.text, self.more_text], window=3, min_count=2)
+        with patch('generativepoetry.lexigen.cooccurrence_index', index), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            self.assertIn('boat', contextually_linked_words('sea', sample_size=None))
+            self.assertEqual(datamuse_lookup('rel_trg', 'baker', 1), [{'word': 'bread', 'score': 1.4021}])
+
+
+class TestWordVectors(LookupTestCase):
+    vectors = {'king': [1, 1, 0, 0], 'queen': [1, 1, .2, 0], 'monarch': [1, .9, .1, 0], 'apple': [0, 0, 0, 1],
+               'pear': [0, 0, .1, 1], 'fruit': [0, .1, .1, 1], '42': [1, 1, 1, 1]}
+
+    def convert(self, directory: str, binary: bool = False) -> WordVectors:
+        source_path = os.path.join(directory, 'vectors.bin' if binary else 'vectors.txt')
+        if binary:
+            with open(source_path, 'wb') as f:
+                f.write(f'{len(self.vectors)} 4\n'.encode())
+                for word, vector in self.vectors.items():
+                    f.write(word.encode() + b' ' + np.array(vector, dtype='<f4').tobytes() + b'\n')
+        else:
+            with open(source_path, 'w') as f:
+                f.writelines(f'{word} {" ".join(map(str, vector))}\n' for word, vector in self.vectors.items())
+        WordVectors.convert(source_path, os.path.join(directory, 'vectors'))
+        return WordVectors.load(os.path.join(directory, 'vectors'))
+
+    def test_neighbors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for binary in (False, True):
+                vectors = self.convert(directory, binary)
+                self.assertEqual(len(vectors), 6)  # Not '42'
+                self.assertNotIn('42', vectors)
+                neighbors = vectors.neighbors(['king', 'apple', 'nonexistentword'], 2)
+                self.assertEqual(list(neighbors), ['king', 'apple'])
+                self.assertEqual([word for word, score in neighbors['king']], ['monarch', 'queen'])
+                self.assertEqual([word for word, score in neighbors['apple']], ['pear', 'fruit'])
+                self.assertGreater(neighbors['king'][0][1], neighbors['king'][1][1])
+                self.assertEqual(len(vectors.neighbors(['king'], 100)['king']), 5)
+                del vectors
+
+    def test_similar_meaning_words(self):
+        with tempfile.TemporaryDirectory() as directory:
+            vectors = self.convert(directory)
+            with patch('generativepoetry.lexigen.word_vectors', vectors), \
+                    patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+                self.assertEqual(sorted(similar_meaning_words(['king', 'apple'], sample_size=None, datamuse_api_max=2)),
+                                 ['fruit', 'monarch', 'pear', 'queen'])
+                self.assertEqual(vectors.stats['cached'], 2)
+                self.assertEqual(datamuse_lookup('ml', 'queen', 1), [{'word': 'monarch', 'score': 0.9964}])
+            del vectors
+
+
+class TestPhoneticIndex(LookupTestCase):
+    pronunciations = [('magic', 'M AE1 JH IH0 K'), ('majik', 'M AE1 JH IH0 K'), ('magid', 'M AE1 JH IH0 D'),
+                      ('manic', 'M AE1 N IH0 K'), ('mantic', 'M AE1 N T IH0 K'), ('music', 'M Y UW1 Z IH0 K'),
+                      ('cat', 'K AE1 T'), ('kit', 'K IH1 T'), ("cat's", 'K AE1 T S')]
+
+    def test_distance(self):
+        magic = phonetics.encode('M AE1 JH IH0 K')
+        self.assertEqual(magic, phonetics.encode('M AE0 JH IH1 K'))  # Stress is ignored
+        self.assertIsNone(phonetics.encode('M AE1 XX'))
+        self.assertEqual(phonetics.distance(magic, magic), 0)
+        self.assertEqual(phonetics.distance(magic, phonetics.encode('M AE1 JH IH0 D')), 1)  # Both stops
+        self.assertEqual(phonetics.distance(magic, phonetics.encode('M AE1 N IH0 K')), 2)
+        self.assertEqual(phonetics.distance(magic, phonetics.encode('M AE1 N T IH0 K')), 4)
+        self.assertEqual(phonetics.distance(magic, phonetics.encode('M AE1 N T IH0 K'), bound=3), 4)
+        self.assertEqual(phonetics.distance(magic, phonetics.encode('K AE1 T'), bound=3), 4)
+
+    def test_neighbors(self):
+        index = phonetics.PhoneticIndex(pronunciations=self.pronunciations)
+        self.assertEqual(len(index), 7)  # Not cat's, and magic and majik sound the same
+        self.assertNotIn("cat's", index)
+        self.assertEqual(index.neighbors('magic'), [('majik', 0), ('magid', 1), ('manic', 2)])
+        self.assertEqual(index.neighbors('magic', limit=2, max_distance=1), [('majik', 0), ('magid', 1)])
+        self.assertEqual(index.neighbors('nonexistentword'), [])
+        self.assertRaises(ValueError, lambda: index.neighbors('magic', max_distance=4))
+        pooled = phonetics.PhoneticIndex(pronunciations=iter(self.pronunciations))
+        with patch('generativepoetry.phonetics.parallel_threshold', 1):
+            in_processes = pooled.neighbors_many(['magic', 'cat', 'manic'], processes=2)
+        self.assertEqual(pooled.stats['processes'], 2)
+        pooled.close()
+        self.assertEqual(in_processes, index.neighbors_many(['magic', 'cat', 'manic'], processes=1))
+        self.assertEqual(in_processes['cat'], [('kit', 1)])
+
+    def test_similar_sounding_lookup(self):
+        index = phonetics.PhoneticIndex(pronunciations=self.pronunciations)
+        with patch('generativepoetry.lexigen.phonetic_index', LazyResource(lambda: index)), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            prefetch([('sl', 'magic', 2), ('sl', 'cat', 2)])
+            self.assertEqual(index.stats['cached'], 2)
+            self.assertEqual(datamuse_lookup('sl', 'magic', 2), [{'word': 'majik', 'score': 4},
+                                                                 {'word': 'magid', 'score': 3}])
+
+    def test_lazy_load(self):
+        with patch('generativepoetry.lexigen.phonetic_index', None), \
+                patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', return_value=[]) as mock_fetch, \
+                patch.object(phonetics.PhoneticIndex, 'build', return_value=None) as mock_build:
+            resource = load_phonetic_index(lazy=True)
+            mock_build.assert_not_called()
+            self.assertIs(lexigen.phonetic_index, resource)
+            self.assertIs(lazy_resources.pop('CMU phonetic index'), resource)
+            self.assertEqual(datamuse_lookup('sl', 'magic', 10), [])
+            self.assertTrue(resource.loaded)  # Built through the resource when the lookup checked the index
+            mock_build.assert_called_with()
+            mock_fetch.assert_called_once_with({'sl': 'magic', 'max': 10})  # The unbuilt index has no words
+            self.assertIsInstance(resource.load(), phonetics.PhoneticIndex)
+
+
+class TestWordQuery(LookupTestCase):
+
+    def test_combined_query(self):
+        response = [{'word': 'lagoon', 'score': 900}, {'word': 'monsoon', 'score': 800},
+                    {'word': 'typhoon', 'score': 700}, {'word': 'maroon', 'score': 600}]
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', return_value=response) as mock_fetch:
+            query = WordQuery().rhymes_with('moon').means_like('ocean').max_length(7).excluding(['maroon'])
+            self.assertEqual(query.min_frequency(2.5e-6).words(10), ['lagoon', 'typhoon'])
+            self.assertEqual(query.words(10), ['lagoon', 'monsoon', 'typhoon'])  # Answered from the cache
+            mock_fetch.assert_called_once_with({'ml': 'ocean', 'rel_rhy': 'moon', 'max': 10})
+        self.assertEqual(query.constraints, {'rel_rhy': 'moon', 'ml': 'ocean'})
+
+    def test_local_query(self):
+        with patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            rhymes = WordQuery().rhymes_with('moon').max_length(6).words()
+        self.assertTrue(rhymes)
+        self.assertEqual(rhymes, [word for word in lexigen.rhyme_index.rhymes('moon') if len(word) <= 6])
+        self.assertTrue(WordQuery().rhymable().matches('moon'))
+        self.assertFalse(WordQuery().max_length(3).matches('moon'))
+        self.assertRaises(ValueError, lambda: WordQuery().max_length(6).words())
+        self.assertRaises(ValueError, lambda: WordQuery().topics('sky').words())
+        self.assertRaises(ValueError, lambda: WordQuery().sounds_like('two words'))
+
+    def test_next_word_with_constraints(self):
+        graph = RelationGraph()
+        graph.add('ml', 'magic', [{'word': 'enchantment'}, {'word': 'spell'}, {'word': 'sorcery'}], 10)
+        markovgen = StochasticJolasticWordGenerator()
+        with patch('generativepoetry.lexigen.relation_graph', graph):
+            for i in range(5):
+                self.assertEqual(markovgen.next_word(similar_meaning_word, 'magic',
+                                                     constraints=WordQuery().max_length(5)), 'spell')
+            self.assertIsNone(markovgen.next_word(similar_meaning_word, 'magic', constraints=WordQuery().max_length(4)))
+
+
+class TestCandidateLattice(LookupTestCase):
+    responses = {('ml', 'magic'): ['sorcery', 'magics', 'lantern', 'x-ray'],
+                 ('sl', 'magic'): ['magic', 'magpie'],
+                 ('rel_trg', 'magic'): ['rabbit', 'conjuring'],
+                 ('ml', 'lantern'): ['lamp']}
+
+    def fetch(self, query):
+        relation = next(key for key in query if key != 'max')
+        return [{'word': word, 'score': 100} for word in self.responses.get((relation, query[relation]), [])]
+
+    def test_build(self):
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()), \
+                patch.object(LiveTransport, 'fetch', side_effect=self.fetch) as mock_fetch:
+            lattice = CandidateLattice.build(['magic'], neighbors_per_word=10, max_length=9)
+            self.assertEqual(mock_fetch.call_count, 4 * (1 + 5))  # magic, then its five candidates
+        self.assertEqual(lattice.get('ml', 'magic'), ['sorcery', 'lantern'])  # Too similar, too long, or invalid
+        self.assertEqual(lattice.get('sl', 'magic'), ['magpie'])
+        self.assertEqual(lattice.get('ml', 'lantern'), ['lamp'])
+        self.assertEqual(lattice.get('lc', 'magic'), [])
+        self.assertIsNone(lattice.get('ml', 'lamp'))
+        self.assertEqual(set(lattice.get('rel_trg', 'magic', rhymable=True)), {'rabbit'})
+        self.assertEqual((lattice.stats['hits'], lattice.stats['misses']), (5, 1))
+        markovgen = StochasticJolasticWordGenerator(lattice=lattice)
+        with patch.object(LiveTransport, 'fetch', side_effect=AssertionError('Unexpected lookup')):
+            for i in range(5):
+                self.assertIn(markovgen.next_word(similar_meaning_word, 'magic'), ['sorcery', 'lantern'])
+                self.assertIsNone(markovgen.next_word(frequently_following_word, 'magic'))
+
+    def test_build_with_failed_lookups(self):
+        unavailable = ResilientTransport(FlakyTransport([requests.ConnectionError()] * 10), max_retries=0)
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()), \
+                patch('generativepoetry.lexigen.transport', unavailable):
+            lattice = CandidateLattice.build(['magic'])
+        self.assertEqual(len(lattice), 0)
+        self.assertEqual(lattice.stats['failed_lookups'], 4)
+
+
+class TestStochasticJolasticWordGenerator(LookupTestCase):
 
     def test_random_nonrhyme(self):
         with open('tests/random_nonrhyme_possible_results.txt') as f:
@@ -368,6 +1248,121 @@ class TestStochasticJolasticWordGenerator(unittest.TestCase):
             self.assertLessEqual(len(rhyming_result), 10)
             self.assertIn(rhyming_result, rhymes('shudder', sample_size=None))
 
+    def test_next_word(self):
+        graph = RelationGraph()
+        graph.add('ml', 'magic', [{'word': 'lantern'}, {'word': 'sorcery'}], 10)
+        graph.add('sl', 'magic', [{'word': 'magic'}, {'word': 'magpie'}], 20)
+        markovgen = StochasticJolasticWordGenerator()
+        with patch('generativepoetry.lexigen.relation_graph', graph), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('Unexpected lookup')):
+            for i in range(5):
+                self.assertIn(markovgen.next_word(similar_meaning_word, 'magic'), ['lantern', 'sorcery'])
+                self.assertEqual(markovgen.next_word(similar_sounding_word, 'magic'), 'magpie')
+        with patch('generativepoetry.lexigen.relation_graph', graph), \
+                patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', return_value=[{'word': 'rabbit'}]) as mock_fetch:
+            self.assertEqual(markovgen.next_word(contextually_linked_word, 'magic'), 'rabbit')
+            self.assertEqual(mock_fetch.call_count, 1)
+            self.assertEqual(graph.neighbors('rel_trg', 'magic', 10), ['rabbit'])
+
+    def test_search_budget(self):
+        budget = SearchBudget(max_attempts=2)
+        self.assertEqual([budget.spend() for i in range(3)], [True, True, False])
+        self.assertTrue(budget.exhausted)
+        self.assertFalse(SearchBudget(deadline=time.monotonic()).spend())
+        markovgen = StochasticJolasticWordGenerator()
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()), \
+                patch.object(LiveTransport, 'fetch', return_value=[]) as mock_fetch:
+            self.assertIn(markovgen.random_nonrhyme(['magic'], max_attempts=3), markovgen.common_words)
+            self.assertLessEqual(mock_fetch.call_count, 3 * 2)
+            self.assertEqual(markovgen.last_word_of_markov_line(['magic'], words_for_sampling=['magics', 'lantern'],
+                                                                max_attempts=3), 'lantern')
+            mock_fetch.reset_mock()
+            self.assertEqual(markovgen.nonlast_word_of_markov_line(['magic'], words_for_sampling=['magic', 'lantern'],
+                                                                   deadline=time.monotonic()), 'lantern')
+            mock_fetch.assert_not_called()
+        with patch.object(LiveTransport, 'fetch', side_effect=AssertionError('Unexpected lookup')):
+            self.assertIn(markovgen.last_word_of_markov_line(['magic'], rhyme_with='shudder', max_length=10),
+                          rhymes('shudder', sample_size=None))
+        self.assertEqual(markovgen.stats['rungs_used'], {'rhyme': 1, 'nonrhyme': 0, 'sampling pool': 2,
+                                                         'common word': 1, 'connector': 0})
+        self.assertEqual(markovgen.stats['exhausted_searches'], 3)
+        unavailable = ResilientTransport(FlakyTransport([requests.ConnectionError()] * 10), max_retries=0)
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()), \
+                patch('generativepoetry.lexigen.transport', unavailable):
+            self.assertEqual(markovgen.last_word_of_markov_line(['magic'], words_for_sampling=['lantern']), 'lantern')
+            self.assertEqual(markovgen.exhausted_searches, 4)
+
+    def test_algorithm_bandit(self):
+        bandit = AlgorithmBandit(exploration=0)
+        for i in range(50):
+            bandit.record(similar_sounding_word, 'magic', False, .2, 1)
+            bandit.record(similar_meaning_word, 'magic', True, .01, 0)
+        algorithms = [similar_sounding_word, similar_meaning_word]
+        self.assertEqual({bandit.choose(algorithms, 'magic') for i in range(50)}, {similar_meaning_word})
+        # Nothing has been learned about words as common as 'the', so picks are uniform over the list
+        self.assertEqual({bandit.choose(algorithms, 'the') for i in range(200)}, set(algorithms))
+        listed = [similar_sounding_word, similar_meaning_word, contextually_linked_word, frequently_following_word,
+                  frequently_following_word]
+        picks = [bandit.choose(listed, 'the') for i in range(2000)]
+        self.assertAlmostEqual(picks.count(frequently_following_word) / len(picks), .4, delta=.06)
+        self.assertEqual({AlgorithmBandit(exploration=1).choose(algorithms, 'magic') for i in range(200)},
+                         set(algorithms))
+        stats = bandit.stats
+        self.assertEqual(stats['algorithms']['similar_sounding_word']['attempts'], 50)
+        self.assertEqual(stats['algorithms']['similar_meaning_word']['accepted'], 50)
+        self.assertEqual(stats['lookups_per_accepted_word'], 1)
+        # A cached algorithm that's no more productive doesn't crowd out one that makes network lookups
+        algorithms = [similar_meaning_word, contextually_linked_word, frequently_following_word]
+        for i in range(200):
+            for algorithm, seconds in zip(algorithms, (.01, .3, .5)):
+                bandit.record(algorithm, 'lantern', i % 2 == 0, seconds, 1)
+        picks = [bandit.choose(algorithms, 'lantern') for i in range(600)]
+        self.assertLess(max(picks.count(algorithm) for algorithm in algorithms) / len(picks), .5)
+        graph = RelationGraph()
+        graph.add('ml', 'magic', [{'word': 'lantern'}, {'word': 'sorcery'}], 10)
+        graph.add('sl', 'magic', [{'word': 'magic'}, {'word': 'magpie'}], 20)
+        bandit = AlgorithmBandit()
+        markovgen = StochasticJolasticWordGenerator(bandit=bandit)
+        with patch('generativepoetry.lexigen.relation_graph', graph), \
+                patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', return_value=[]):
+            for i in range(10):
+                markovgen.random_nonrhyme(['magic'])
+        stats = bandit.stats
+        self.assertEqual(sum(record['accepted'] for record in stats['algorithms'].values()),
+                         markovgen.rungs_used['nonrhyme'])
+        self.assertEqual(sum(record['lookups'] for record in stats['algorithms'].values()), markovgen.lookups)
+
+    def test_prefetch_next_word_lookups(self):
+        prefetched = []
+        with patch('generativepoetry.jolastic.prefetch_in_background',
+                   side_effect=lambda lookups: prefetched.append(sorted(lookups))), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()):
+            StochasticJolasticWordGenerator().prefetch_next_word_lookups('magic')
+            self.assertEqual(prefetched, [])
+            markovgen = StochasticJolasticWordGenerator(previous_lines=['the magic lantern'], prefetch=True)
+            markovgen.prefetch_next_word_lookups('compound word')
+            markovgen.prefetch_next_word_lookups('magic')
+            self.assertEqual(prefetched, [[('lc', 'lantern', 10), ('ml', 'lantern', 10), ('rel_trg', 'lantern', 10),
+                                           ('sl', 'lantern', 20)],
+                                          [('lc', 'magic', 10), ('ml', 'magic', 10), ('rel_trg', 'magic', 10),
+                                           ('sl', 'magic', 20)]])
+            # Candidates that are rejected aren't prefetched for; the line generators prefetch for accepted words
+            prefetched.clear()
+            with patch.object(markovgen, 'next_word', return_value='magic'):
+                self.assertIn(markovgen.random_nonrhyme(['magic'], max_attempts=5), markovgen.common_words)
+            self.assertEqual(prefetched, [])
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()) as cache, \
+                patch.object(LiveTransport, 'fetch', return_value=[]) as mock_fetch:
+            cache.set(('sl', 'magic', 20), [])
+            futures = prefetch_in_background([('sl', 'magic', 20), ('ml', 'magic', 10), ('ml', 'magic', 10)])
+            self.assertEqual([future.result() for future in futures], [[]])
+            mock_fetch.assert_called_once_with({'ml': 'magic', 'max': 10})
+
+
 class TestPoemGenerator(unittest.TestCase):
 
     def get_possible_word_list(self, input_word_list):
@@ -436,6 +1431,58 @@ class TestPoemGenerator(unittest.TestCase):
             self.assertLessEqual(len(words), 10)
             self.assertLessEqual(len(line), 71)
 
+    def test_poem_from_markov_looks_up_related_words(self):
+        input_words = ['chalice', 'crime', 'coins', 'spectacular', 'dazzle', 'enigma']
+        # autospec checks the call against phonetically_related_words' signature, which a wrong keyword would fail
+        with patch('generativepoetry.poemgen.phonetically_related_words', autospec=True,
+                   return_value=[]) as mock_related, \
+                patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            poem = PoemGenerator().poem_from_markov(input_words=input_words, num_lines=2, latency_budget_ms=0)
+        mock_related.assert_called_once_with(input_words, max_results_per_input_word=20)
+        self.assertEqual(len(poem.lines), 2)
+
+    def test_poem_from_markov_within_latency_budget(self):
+        input_words = ['chalice', 'crime', 'coins', 'spectacular', 'dazzle', 'enigma']
+        pgen = PoemGenerator()
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            poem = pgen.poem_from_markov(input_words=input_words, num_lines=4, latency_budget_ms=0)
+        self.assertEqual(len(poem.lines), 4)
+        self.assertEqual(poem.tier_report.counts['api'], 0)
+        self.assertGreater(poem.tier_report.counts['local'], 0)  # Rhymes come from the rhyme index
+
+    def test_poem_from_markov_with_plan(self):
+        response = [{'word': 'responsibilities', 'score': 100}, {'word': 'lantern', 'score': 90}]
+        lexigen.transport.circuit_breaker.reset()  # Earlier tests' failed requests may have opened it
+        pgen = PoemGenerator()
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch('generativepoetry.lexigen.relation_graph', RelationGraph()), \
+                patch.object(LiveTransport, 'fetch', return_value=response):
+            poem = pgen.poem_from_markov(input_words=['chalice', 'crime'], num_lines=2, plan=True)
+        candidates = set(itertools.chain.from_iterable(poem.lattice.candidates.values()))
+        self.assertIn('lantern', candidates)
+        self.assertNotIn('responsibilities', candidates)  # Longer than a word in a 35 character line may be
+
+    def test_poem_from_markov_in_meter(self):
+        input_words = ['chalice', 'crime', 'coins', 'spectacular', 'dazzle', 'enigma']
+        pgen = PoemGenerator()
+        with patch('generativepoetry.lexigen.lexical_cache', LexicalCache()), \
+                patch.object(LiveTransport, 'fetch', side_effect=AssertionError('The API was queried')):
+            poem = pgen.poem_from_markov(input_words=input_words, num_lines=4, latency_budget_ms=0,
+                                         meter='iambic pentameter')
+            haiku = pgen.poem_from_markov(input_words=input_words, num_lines=3, latency_budget_ms=0, meter='haiku')
+        for lines, line_meters in ((poem.lines, [meters['iambic pentameter']]), (haiku.lines, forms['haiku'])):
+            for i, line in enumerate(lines):
+                line_meter, position = line_meters[i % len(line_meters)], 0
+                words = line.rstrip(',.!?').split(' ')
+                for word in words[:-1]:
+                    position = lexigen.stress_index.advance(word, line_meter, position)
+                    self.assertIsNotNone(position, line)
+                self.assertEqual(lexigen.stress_index.advance(words[-1], line_meter, position, ends_line=True),
+                                 len(line_meter), line)
+        self.assertRaises(ValueError, lambda: pgen.poem_from_markov(input_words, meter='free verse'))
+
     # def test_poem_line_from_markov(self):
     #     pgen = PoemGenerator()
     #     words_for_sampling = ['fervent', 'mutants', 'dazzling', 'flying', 'saucer', 'milquetoast']
@@ -610,6 +1657,7 @@ class TestFuturistPoemPDFGenerator(unittest.TestCase):
             self.assertTrue(type(ds.rgb), tuple)
             y_coord += 31
 
+
 class TextExtractionTestCase(unittest.TestCase):
 
     def test_validate_url(self):
@@ -887,8 +1935,6 @@ class TextProcessingTestCase(unittest.TestCase):
         cutouts = cutup([burroughs_sample1, burroughs_sample2])
         print("\nWilliam S. Burroughs Computer Cut-Up #3:\n" + " ".join(cutouts))
         for cutout in cutouts:
-            # if not(3 <= len(cutout.split()) <= 7 or cutout.split()[-1] == burroughs_sample1.split()[-1] or cutout == burroughs_sample2.split()[-1]):
-            #     import ipdb; ipdb.set_trace()
             self.assertTrue(len(cutout.split()) <= 7 or cutout.split()[-1] == burroughs_sample1.split()[-1] or
                             cutout == burroughs_sample2.split()[-1])
             self.assertTrue(cutout in burroughs_sample1 or cutout in burroughs_sample2)